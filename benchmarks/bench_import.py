@@ -0,0 +1,47 @@
+"""
+Benchmark the time to import the package's modules, each in a fresh interpreter.
+
+    python benchmarks/bench_import.py --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+MODULES = ('locrian_collect', 'locrian_collect.constants', 'locrian_collect.logs',
+           'locrian_collect.validation', 'locrian_collect.parse_level_two_book',
+           'locrian_collect.data_managers', 'locrian_collect.scheduler')
+
+
+def import_time(module, env):
+    """Cumulative import time in milliseconds of the package's top level imports, from
+    `python -X importtime`, so interpreter start up is not counted."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            env=env, capture_output=True, text=True, check=True).stderr
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented and already included in their parent's time.
+        if name.startswith(' locrian_collect'):
+            total += int(cumulative)
+    return total / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, PYTHONPATH=root)
+        for module in MODULES:
+            milliseconds = min(import_time(module, env) for _ in range(args.repeat))
+            print(f'{module:<40}{milliseconds:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
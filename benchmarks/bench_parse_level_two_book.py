@@ -0,0 +1,70 @@
+"""
+Benchmark parse_level_two_book against the previous level by level implementation.
+
+    python benchmarks/bench_parse_level_two_book.py --levels 500 --books 20
+"""
+import argparse
+import random
+import timeit
+
+import pandas as pd
+
+from locrian_collect.constants import ORDER_MAP, Side
+from locrian_collect.level_two_book import LevelTwoBook
+from locrian_collect.parse_level_two_book import parse_level_two_book
+
+
+def parse_level_two_book_loop(timestamp, book):
+    """The previous implementation, building the rows one level at a time."""
+    data = []
+    book.pop('timestamp', None)
+    for side in book:
+        ordering = ORDER_MAP[Side[side]]
+        levels = book[side][::ordering]
+        side_as_value = Side[side].value
+
+        for level_index, level in enumerate(levels, 1):
+            price = level[0]
+            volume = level[1]
+            data.append([timestamp, side_as_value, level_index, price, volume])
+
+    return pd.DataFrame(data, columns=['timestamp', 'side', 'level', 'price', 'volume'])
+
+
+def make_book(levels, as_strings=False):
+    """Make a random book with `levels` levels per side in the exchange's format."""
+    def level(price):
+        row = [round(price, 2), round(random.uniform(0.001, 10), 4)]
+        return [f'{value}' for value in row] if as_strings else row
+
+    asks = [level(4000 + 0.01 * index) for index in range(levels, 0, -1)]
+    bids = [level(3999 - 0.01 * index) for index in range(levels)]
+    return {'asks': asks, 'bids': bids, 'timestamp': '2020-01-01T00:00:00.000Z'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--levels', type=int, default=500)
+    parser.add_argument('--books', type=int, default=20, help='books parsed per tick')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for as_strings in (False, True):
+        books = [make_book(args.levels, as_strings) for _ in range(args.books)]
+
+        # The loop implementation pops the timestamp so it is given copies of the books.
+        implementations = {
+            'loop': lambda: [parse_level_two_book_loop(1, dict(book)) for book in books],
+            'vectorized': lambda: [parse_level_two_book(1, book) for book in books],
+            'book': lambda: [LevelTwoBook.from_exchange(1, book).to_frame() for book in books],
+        }
+
+        print(f'{args.books} books x {args.levels} levels per side, '
+              f'{"string" if as_strings else "float"} levels')
+        for name, implementation in implementations.items():
+            seconds = min(timeit.repeat(implementation, number=1, repeat=args.repeat))
+            print(f'  {name:<12}{seconds * 1000:8.2f} ms per tick')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Local stand-in for the OkCoin and OKEx REST endpoints requested by the managers.
+
+Order book, trades and futures index requests are answered under the exchanges' v3 paths after
+`latency` seconds, from a recording when one is given and otherwise synthesized, books with
+the `size` levels per side requested.  A recording is json lines of
+{"kind": "book" | "trades" | "index", "response": ...} replayed in turn per instrument, the
+trade ids of each pass shifted past the previous pass so every pass is new trades.
+
+Record responses from the exchanges, or serve the stand-in until interrupted:
+
+    python benchmarks/exchange_stand_in.py --record responses.jsonl --samples 20
+    python benchmarks/exchange_stand_in.py --port 8080 --latency 0.05
+"""
+import argparse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+from threading import Thread, Lock
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from locrian_collect.constants import BASE_OKCOIN_URL, BASE_OKEX_URL
+from locrian_collect.data_managers import get_future_alias_mapping
+from locrian_collect.sessions import get_json
+
+from bench_parse_level_two_book import make_book
+
+KINDS = ('book', 'trades', 'index')
+BOOK_POOL_SIZE = 16  # synthesized books served in turn per depth
+
+
+class ExchangeStandIn:
+    """HTTP server answering the managers' requests from daemon threads.
+
+    Parameters
+    ----------
+    latency: float
+        Seconds each response is delayed.
+    recording: str
+        Path of a recording to replay, None to synthesize the responses.
+    trades: int
+        Trades per synthesized response when the request has no `size`.
+    host: str
+        Address to listen on.
+    port: int
+        Port to listen on, 0 for any free port.
+    """
+    def __init__(self, latency=0.0, recording=None, trades=100, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.trades = trades
+        self._recorded = _load_recording(recording) if recording is not None else None
+        self._books = {}
+        self._requests = {}
+        self._lock = Lock()
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = Thread(target=self._server.serve_forever, name='exchange_stand_in',
+                              daemon=True)
+
+    @property
+    def url(self):
+        """str: Root url of the stand-in."""
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def book_url(self, instrument, size):
+        return f'{self.url}/api/spot/v3/instruments/{instrument}/book?size={size}'
+
+    def trades_url(self, instrument, size):
+        return f'{self.url}/api/spot/v3/instruments/{instrument}/trades?size={size}'
+
+    def index_url(self, instrument):
+        return f'{self.url}/api/futures/v3/instruments/{instrument}/index'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, path):
+        """Get the body of the response to a request.
+
+        Returns
+        -------
+        bytes
+            The json response, None for an unknown path.
+        """
+        url = urlsplit(path)
+        kind = url.path.rsplit('/', 1)[-1]
+        if kind not in KINDS:
+            return None
+        size = int(parse_qs(url.query).get('size', [self.trades])[0])
+
+        # Each instrument is answered in turn, independently of the others.
+        with self._lock:
+            number = self._requests.get(url.path, 0)
+            self._requests[url.path] = number + 1
+
+        if self._recorded is not None:
+            return self._replay(kind, number)
+        if kind == 'book':
+            return self._book(size, number)
+        if kind == 'trades':
+            return json.dumps(_make_trades(number * size, size)).encode()
+        return json.dumps({'instrument_id': url.path.split('/')[-2],
+                           'index': f'{random.uniform(3900, 4100):.2f}',
+                           'timestamp': _now()}).encode()
+
+    def _book(self, size, number):
+        with self._lock:
+            books = self._books.get(size)
+            if books is None:
+                books = self._books[size] = [json.dumps(make_book(size, as_strings=True)).encode()
+                                             for _ in range(BOOK_POOL_SIZE)]
+        return books[number % len(books)]
+
+    def _replay(self, kind, number):
+        responses = self._recorded[kind]
+        response = responses[number % len(responses)]
+        if kind != 'trades':
+            return json.dumps(response).encode()
+
+        tids = [int(trade['trade_id']) for recorded in responses for trade in recorded]
+        shift = (number // len(responses)) * (max(tids) - min(tids) + 1)
+        return json.dumps([dict(trade, trade_id=str(int(trade['trade_id']) + shift))
+                           for trade in response]).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as with the exchanges
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        body = self.server.stand_in.respond(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        time.sleep(self.server.stand_in.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def _make_trades(first_tid, size):
+    """Trades with the ids from `first_tid`, newest first as the exchange returns them."""
+    now = _now()
+    return [{'timestamp': now, 'trade_id': str(tid), 'price': f'{random.uniform(3900, 4100):.2f}',
+             'size': f'{random.uniform(0.001, 2):.4f}', 'side': random.choice(('buy', 'sell'))}
+            for tid in range(first_tid + size - 1, first_tid - 1, -1)]
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def _load_recording(path):
+    recorded = {kind: [] for kind in KINDS}
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recorded[entry['kind']].append(entry['response'])
+    missing = [kind for kind, responses in recorded.items() if not responses]
+    if missing:
+        raise ValueError(f'{path} has no {", ".join(missing)} responses')
+    return recorded
+
+
+def record(path, samples, interval, currency='btc', depth=200, trades=100):
+    """Record responses of the exchanges for one currency, `samples` of each kind
+    `interval` seconds apart."""
+    delivery = get_future_alias_mapping()['quarter']
+    urls = {'book': f'{BASE_OKCOIN_URL}{currency.upper()}-USD/book?size={depth}',
+            'trades': f'{BASE_OKCOIN_URL}{currency.upper()}-USD/trades?size={trades}',
+            'index': f'{BASE_OKEX_URL}{currency.upper()}-USD-{delivery}/index'}
+    with open(path, 'w') as f:
+        for sample in range(samples):
+            for kind, url in urls.items():
+                f.write(json.dumps({'kind': kind, 'response': get_json(url)}) + '\n')
+            if sample < samples - 1:
+                time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--record', default=None, help='path to record responses to')
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=2, help='seconds between samples')
+    parser.add_argument('--recording', default=None, help='recording to serve')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    if args.record is not None:
+        record(args.record, args.samples, args.interval)
+        return
+
+    stand_in = ExchangeStandIn(args.latency, args.recording, port=args.port).start()
+    print(f'Serving on {stand_in.url}, e.g. {stand_in.book_url("BTC-USD", 200)}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stand_in.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+"""
+Locrian Collect, collection of cryptocurrency market data from OkCoin and Okex.
+
+Importing the package is cheap: submodules are not imported here, database credentials are
+read when the first engine is created and log handlers are added by
+`logs.configure_logging` when collection starts.
+"""
+__version__ = '0.1.0'
@@ -0,0 +1,191 @@
+"""
+Local columnar archive of the collected data, written alongside MySQL.
+
+Rows are appended to parquet files partitioned by dataset, table, day and hour:
+
+    {base_directory}/{dataset}/{table}/date=2020-01-01/hour=13/part-{first timestamp}.parquet
+
+Rows are buffered and written as compressed row groups to a temporary file which is renamed
+into place when the hour rolls over or the archive is closed, so readers only ever see
+complete files.  Requires pyarrow.
+"""
+import glob
+import os
+from threading import Lock
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pq = None
+
+from .constants import (
+    BASE_DATA_DIRECTORY, NANOSECOND_FACTOR, ARCHIVE_ROW_GROUP_SIZE, ARCHIVE_COMPRESSION
+)
+
+ARCHIVE_DIRECTORY = f'{BASE_DATA_DIRECTORY}/archive'
+HOUR_IN_NANOSECONDS = 3600 * NANOSECOND_FACTOR
+
+
+class ParquetSink:
+    """Sink appending data frames to an hourly partitioned parquet archive.
+
+    Parameters
+    ----------
+    base_directory: str
+        Root directory of the archive.
+    row_group_size: int
+        Number of rows buffered per table before a row group is written.
+    compression: str
+        Parquet compression codec.
+    """
+    def __init__(self, base_directory=ARCHIVE_DIRECTORY, row_group_size=ARCHIVE_ROW_GROUP_SIZE,
+                 compression=ARCHIVE_COMPRESSION):
+        if pa is None:
+            raise ImportError('pyarrow is required for the parquet archive')
+        self.base_directory = base_directory
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self._writers = {}
+        self._lock = Lock()
+
+    def write(self, dataset, table, frame, timestamp):
+        """Append rows to the archive.
+
+        Parameters
+        ----------
+        dataset: str
+            Name of the dataset, the managers use their database name.
+        table: str
+            Name of the table.
+        frame: pd.DataFrame
+            The rows to append, all rows of a table must have the same columns.
+        timestamp: int
+            The unix time in nanoseconds used to choose the hourly partition.
+        """
+        with self._lock:
+            writer = self._writers.get((dataset, table))
+            if writer is None:
+                writer = HourlyParquetWriter(f'{self.base_directory}/{dataset}/{table}',
+                                             self.row_group_size, self.compression)
+                self._writers[(dataset, table)] = writer
+        writer.append(frame, timestamp)
+
+    def close(self):
+        """Write the buffered rows and finish the open files."""
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+
+
+class HourlyParquetWriter:
+    """Writer for a single table of the archive, see `ParquetSink`.
+
+    Parameters
+    ----------
+    directory: str
+        Directory of the table.
+    row_group_size: int
+        Number of rows buffered before a row group is written.
+    compression: str
+        Parquet compression codec.
+    file_name: str
+        Name of every file written, without the extension, so writing the same rows again
+        replaces the files rather than adding to them.  Defaults to `part-{first timestamp}`.
+    """
+    def __init__(self, directory, row_group_size=ARCHIVE_ROW_GROUP_SIZE,
+                 compression=ARCHIVE_COMPRESSION, file_name=None):
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.file_name = file_name
+        self._hour = None
+        self._path = None
+        self._writer = None
+        self._buffer = []
+        self._buffered_rows = 0
+        self._lock = Lock()
+
+    def append(self, frame, timestamp):
+        """Buffer rows, writing a row group when the buffer is full and rolling over to a new
+        file when `timestamp` is in a new hour."""
+        hour = timestamp // HOUR_IN_NANOSECONDS
+        with self._lock:
+            if hour != self._hour:
+                self._finish_file()
+                self._hour = hour
+                self._path = self._partition_path(hour, timestamp)
+
+            self._buffer.append(frame)
+            self._buffered_rows += len(frame)
+            if self._buffered_rows >= self.row_group_size:
+                self._write_row_group()
+
+    def close(self):
+        """Write the buffered rows and finish the open file."""
+        with self._lock:
+            self._finish_file()
+            self._hour = None
+
+    def is_finished(self, timestamp):
+        """bool: Whether the file of `timestamp`'s hour is already finished, only meaningful
+        with a fixed `file_name`."""
+        hour = timestamp // HOUR_IN_NANOSECONDS
+        with self._lock:
+            if hour == self._hour:
+                return False
+        return os.path.exists(self._partition_path(hour, timestamp))
+
+    def _partition_path(self, hour, timestamp):
+        start = pd.Timestamp(hour * HOUR_IN_NANOSECONDS)
+        file_name = self.file_name if self.file_name is not None else f'part-{timestamp}'
+        return f'{self.directory}/date={start:%Y-%m-%d}/hour={start:%H}/{file_name}.parquet'
+
+    def _write_row_group(self):
+        if not self._buffer:
+            return
+        table = pa.Table.from_pandas(pd.concat(self._buffer, ignore_index=True),
+                                     preserve_index=False)
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            self._writer = pq.ParquetWriter(f'{self._path}.tmp', table.schema,
+                                            compression=self.compression)
+        self._writer.write_table(table)
+        self._buffer = []
+        self._buffered_rows = 0
+
+    def _finish_file(self):
+        self._write_row_group()
+        if self._writer is not None:
+            self._writer.close()
+            os.replace(f'{self._path}.tmp', self._path)
+            self._writer = None
+
+
+def read_archive(dataset, table, base_directory=ARCHIVE_DIRECTORY):
+    """Read every finished file of a table in the archive, memory mapping the files.
+
+    Parameters
+    ----------
+    dataset: str
+        Name of the dataset, e.g. locrian_level_two.
+    table: str
+        Name of the table, e.g. spot_btc.
+    base_directory: str
+        Root directory of the archive.
+
+    Returns
+    -------
+    pd.DataFrame
+        The rows of the table in file order.
+    """
+    if pa is None:
+        raise ImportError('pyarrow is required for the parquet archive')
+    paths = sorted(glob.glob(f'{base_directory}/{dataset}/{table}/date=*/hour=*/*.parquet'))
+    if not paths:
+        return pd.DataFrame()
+    return pa.concat_tables(
+        [pq.read_table(path, memory_map=True) for path in paths]).to_pandas()
@@ -0,0 +1,169 @@
+"""
+Schedule the collection of data from a single asyncio event loop.
+
+All requests share one keep-alive HTTP client and run concurrently up to a limit, while
+the database writes, which are blocking, run in a small thread pool.  The writes are not
+awaited by the ticks, so a slow database does not delay the next requests.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import aiohttp
+
+from .constants import NANOSECOND_FACTOR, HTTP_RATE_LIMIT_STATUS
+from .engines import dispose_engines
+from .logs import logger_order_book
+from .rate_limit import get_rate_limiter, parse_retry_after
+from .scheduler import delta_time_to_sleep, due_managers, close_outputs
+from .sessions import loads
+
+MAX_CONCURRENT_REQUESTS = 10
+DB_WORKERS = 4
+REQUEST_TIMEOUT = 8  # seconds
+
+
+def run_async_scheduler(db_managers, logger, time_between_requests, offset, log_msg,
+                        max_concurrent_requests=MAX_CONCURRENT_REQUESTS, db_workers=DB_WORKERS):
+    """Schedule the recording of data (order book, index or trades) from an event loop.
+
+    Ticks are aligned in the same way as `scheduler.scheduler`, and managers with their own
+    interval, e.g. from `schedule`, run on the first tick at or after each of their turns.
+
+    Parameters
+    ----------
+    db_managers: list
+        List of data managers, see data_managers module.
+    logger:
+        logger object for logging info and warnings.
+    time_between_requests: float
+        Amount of time to wait between requests of data.
+    offset: float
+        Offset to add to the amount of time to wait between requests.
+    log_msg: str
+        Message to display each time data is requested.
+    max_concurrent_requests: int
+        Maximum number of requests in flight at once.
+    db_workers: int
+        Number of threads used to write to the database.
+    """
+    asyncio.run(async_scheduler(db_managers, logger, time_between_requests, offset, log_msg,
+                                max_concurrent_requests, db_workers))
+
+
+async def async_scheduler(db_managers, logger, time_between_requests, offset, log_msg,
+                          max_concurrent_requests=MAX_CONCURRENT_REQUESTS,
+                          db_workers=DB_WORKERS):
+    """Coroutine run by `run_async_scheduler`, see there for the parameters."""
+    if len(db_managers) / time_between_requests > 10:
+        raise ValueError("Number of requests per second exceeds Okcoin's "
+                         "limits (1 request every 0.1 seconds)")
+
+    for manager in db_managers:
+        manager.interval = manager.interval or time_between_requests
+        manager.phase = offset
+
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix='locrian_db')
+    connector = aiohttp.TCPConnector(limit=max_concurrent_requests)
+
+    try:
+        async with aiohttp.ClientSession(
+                connector=connector, headers={'Accept-Encoding': 'gzip, deflate'}) as session:
+            while True:
+                await asyncio.sleep(delta_time_to_sleep(interval=time_between_requests,
+                                                        offset=offset))
+                logger.info(log_msg)
+                await collect_tick(due_managers(db_managers, time.time(), time_between_requests),
+                                   session, semaphore, executor)
+    finally:
+        executor.shutdown(wait=True)
+        close_outputs(db_managers)
+        dispose_engines()
+
+
+async def collect_tick(db_managers, session, semaphore, executor):
+    """Request data for every manager concurrently and hand the results to the executor to
+    save, without waiting for the writes.  Managers not making REST requests, such as streaming
+    managers, run `get_data` in the executor instead.
+
+    Parameters
+    ----------
+    db_managers: list
+        List of data managers, see data_managers module.
+    session: aiohttp.ClientSession
+        The shared HTTP client.
+    semaphore: asyncio.Semaphore
+        Bounds the number of requests in flight.
+    executor: concurrent.futures.Executor
+        Executor the managers' `handle_result` is run in.
+
+    Returns
+    -------
+    list(asyncio.Future)
+        The writes, which log their own errors.
+    """
+    return await asyncio.gather(*(_collect(manager, session, semaphore, executor)
+                                  for manager in db_managers))
+
+
+async def _collect(manager, session, semaphore, executor):
+    loop = asyncio.get_running_loop()
+    if manager.uses_rest:
+        request_time, return_time, result = await request_data(manager, session, semaphore)
+        write = loop.run_in_executor(executor, manager.handle_result, request_time,
+                                     return_time, result)
+    else:
+        write = loop.run_in_executor(executor, manager.get_data)
+    write.add_done_callback(lambda future: _log_write_error(future, manager))
+    return write
+
+
+def _log_write_error(future, manager):
+    if not future.cancelled() and future.exception() is not None:
+        logger_order_book.warning(f'Error saving {manager.mysql_table}: {future.exception()!r}')
+
+
+async def request_data(manager, session, semaphore):
+    """Make a REST request to the manager's url, the asyncio version of
+    `BaseManager._request_data`.  Waits for a token from the host's rate limiter first.
+
+    Returns
+    -------
+    tuple
+        (request_time, return_time, result), all None if the request failed.
+    """
+    async with semaphore:
+        limiter = get_rate_limiter(manager.url)
+        wait = limiter.try_acquire()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = limiter.try_acquire()
+
+        try:
+            request_time = int(time.time() * NANOSECOND_FACTOR)
+            timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            async with session.get(manager.url, timeout=timeout) as response:
+                if response.status == HTTP_RATE_LIMIT_STATUS:
+                    logger_order_book.warning(f'Rate limited: {manager.mysql_table}')
+                    manager.record_error('rate_limited')
+                    get_rate_limiter(manager.url).back_off(
+                        parse_retry_after(response.headers.get('Retry-After')))
+                    return None, None, None
+                result = loads(await response.read())
+            return_time = int(time.time() * NANOSECOND_FACTOR)
+            manager.record_request(request_time, return_time)
+            get_rate_limiter(manager.url).on_success()
+            return request_time, return_time, result
+
+        except asyncio.TimeoutError:
+            logger_order_book.warning(f'Timeout error: {manager.mysql_table}')
+            manager.record_error('timeout')
+        except aiohttp.ClientError as exc:
+            logger_order_book.warning(f'Client error: {manager.mysql_table} | {exc}')
+            manager.record_error('connection')
+        except ValueError as exc:
+            logger_order_book.warning(f'{exc}')
+            manager.record_error('decode')
+
+    return None, None, None
@@ -0,0 +1,138 @@
+"""
+Delta encoding of level two books.
+
+In delta storage mode a manager writes a full book (a keyframe) to the usual level two table
+every `keyframe_interval` ticks and, in between, only the price levels that changed to the
+table `{asset_name}_delta`.  A delta row gives the new volume at a price, a volume of zero
+means the price level was removed.
+"""
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from .constants import Side
+from .engines import get_engine
+from .level_two_book import LevelTwoBook, diff_sides
+from .parse_level_two_book import LEVEL_TWO_COLUMNS
+
+DELTA_COLUMNS = ['timestamp', 'side', 'price', 'volume']
+
+
+def diff_books(previous, current):
+    """Get the price levels that were changed, added or removed between two books.
+
+    Parameters
+    ----------
+    previous: LevelTwoBook or pd.DataFrame
+        The previous book, a dataframe in the format returned by `parse_level_two_book`.
+    current: LevelTwoBook or pd.DataFrame
+        The current book, a dataframe in the format returned by `parse_level_two_book`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Delta rows with the columns `DELTA_COLUMNS`, stamped with the current book's timestamp.
+    """
+    if not isinstance(previous, LevelTwoBook):
+        previous = LevelTwoBook.from_frame(previous)
+    if not isinstance(current, LevelTwoBook):
+        current = LevelTwoBook.from_frame(current)
+
+    sides = []
+    prices = []
+    volumes = []
+    for side in (Side.ask, Side.bid):
+        side_prices, side_volumes = diff_sides(previous, current, side)
+        sides.append(np.full(len(side_prices), side.value, dtype=np.int64))
+        prices.append(side_prices)
+        volumes.append(side_volumes)
+
+    side_array = np.concatenate(sides)
+    return pd.DataFrame({
+        'timestamp': np.full(len(side_array), current.timestamp, dtype=np.int64),
+        'side': side_array,
+        'price': np.concatenate(prices),
+        'volume': np.concatenate(volumes),
+    }, columns=DELTA_COLUMNS)
+
+
+def reconstruct_book(keyframe, deltas, timestamp):
+    """Rebuild the full book at a timestamp from a keyframe and the deltas written after it.
+
+    Parameters
+    ----------
+    keyframe: pd.DataFrame
+        The latest full book written at or before `timestamp`, in the format returned by
+        `parse_level_two_book`.
+    deltas: pd.DataFrame
+        Delta rows with the columns `DELTA_COLUMNS`, rows outside of the keyframe's timestamp
+        and `timestamp` are ignored.
+    timestamp: int
+        The unix time in nanoseconds to rebuild the book at.
+
+    Returns
+    -------
+    pd.DataFrame
+        The book in the format returned by `parse_level_two_book`, stamped with the timestamp
+        of the last keyframe or delta applied.
+    """
+    keyframe_timestamp = keyframe['timestamp'].iloc[0] if len(keyframe) else -1
+    deltas = deltas[(deltas['timestamp'] > keyframe_timestamp)
+                    & (deltas['timestamp'] <= timestamp)]
+    book_timestamp = deltas['timestamp'].max() if len(deltas) else keyframe_timestamp
+
+    # Later rows win, so the keyframe goes first followed by the deltas in time order.
+    levels = (
+        pd.concat([keyframe[['side', 'price', 'volume']],
+                   deltas.sort_values('timestamp', kind='stable')[['side', 'price', 'volume']]],
+                  ignore_index=True)
+        .drop_duplicates(['side', 'price'], keep='last')
+    )
+    levels = levels[levels['volume'] != 0]
+
+    sides = []
+    for side in (Side.ask, Side.bid):
+        side_levels = levels[levels['side'] == side.value].sort_values(
+            'price', ascending=side is Side.ask)
+        sides.append(side_levels.assign(level=np.arange(1, len(side_levels) + 1,
+                                                        dtype=np.int64)))
+
+    book = pd.concat(sides, ignore_index=True)
+    book['timestamp'] = np.int64(book_timestamp)
+    return book.astype({'side': np.int64, 'price': np.float64,
+                        'volume': np.float64})[LEVEL_TWO_COLUMNS]
+
+
+def read_book_at(asset_name, timestamp, database_name='locrian_level_two'):
+    """Read the full book of an asset stored in delta mode at a timestamp.
+
+    Parameters
+    ----------
+    asset_name: str
+        Name of the level two table, e.g. spot_btc.
+    timestamp: int
+        The unix time in nanoseconds to rebuild the book at.
+    database_name: str
+        The name of the database.
+
+    Returns
+    -------
+    pd.DataFrame
+        The book in the format returned by `parse_level_two_book`, empty if there is no
+        keyframe at or before `timestamp`.
+    """
+    engine = get_engine(database_name)
+    keyframe_timestamp = engine.execute(text(
+        f'SELECT MAX(timestamp) FROM {asset_name} WHERE timestamp <= {int(timestamp)}'
+    )).fetchall()[0][0]
+
+    if keyframe_timestamp is None:
+        return pd.DataFrame(columns=LEVEL_TWO_COLUMNS)
+
+    keyframe = pd.read_sql(text(
+        f'SELECT {", ".join(LEVEL_TWO_COLUMNS)} FROM {asset_name} '
+        f'WHERE timestamp = {keyframe_timestamp}'), engine)
+    deltas = pd.read_sql(text(
+        f'SELECT {", ".join(DELTA_COLUMNS)} FROM {asset_name}_delta '
+        f'WHERE timestamp > {keyframe_timestamp} AND timestamp <= {int(timestamp)}'), engine)
+    return reconstruct_book(keyframe, deltas, timestamp)
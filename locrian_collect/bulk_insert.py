@@ -0,0 +1,77 @@
+"""
+Bulk inserts through the raw DBAPI connection, bypassing `DataFrame.to_sql`.
+
+`to_sql` reflects the table and builds a parameter dict per row.  Here the columns are
+converted to python lists in one step and handed to `executemany` as a single statement,
+which MySQLdb sends as multi-row `INSERT` statements.
+"""
+_PLACEHOLDERS = {'format': '%s', 'pyformat': '%s', 'qmark': '?'}
+
+
+def insert_frame(engine, table, frame, columns=None):
+    """Append the rows of a data frame to a table.
+
+    Parameters
+    ----------
+    engine:
+        Sqlalchemy engine.
+    table: str
+        Name of the table.
+    frame: pd.DataFrame
+        Rows to insert, e.g. a book returned by `parse_level_two_book`.
+    columns: list(str)
+        Columns to insert, defaults to all columns of the frame.
+
+    Returns
+    -------
+    int
+        The number of rows inserted.
+    """
+    columns = list(frame.columns) if columns is None else columns
+    return insert_arrays(engine, table, columns, [frame[column].to_numpy() for column in columns])
+
+
+def insert_arrays(engine, table, columns, arrays):
+    """Append rows given as one array per column to a table with a single `executemany`.
+
+    Parameters
+    ----------
+    engine:
+        Sqlalchemy engine.
+    table: str
+        Name of the table.
+    columns: list(str)
+        Column names.
+    arrays: list(np.ndarray)
+        One array per column, all of the same length.
+
+    Returns
+    -------
+    int
+        The number of rows inserted.
+    """
+    # tolist converts the whole column to python scalars, which every DBAPI driver accepts.
+    rows = list(zip(*(array.tolist() for array in arrays)))
+    if not rows:
+        return 0
+
+    placeholder = _placeholder(engine)
+    query = (f'INSERT INTO {table} ({", ".join(columns)}) '
+             f'VALUES ({", ".join([placeholder] * len(columns))})')
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.executemany(query, rows)
+        cursor.close()
+        connection.commit()
+    finally:
+        connection.close()
+    return len(rows)
+
+
+def _placeholder(engine):
+    try:
+        return _PLACEHOLDERS[engine.dialect.paramstyle]
+    except KeyError:
+        raise ValueError(f'Unsupported DBAPI paramstyle {engine.dialect.paramstyle}') from None
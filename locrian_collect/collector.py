@@ -0,0 +1,186 @@
+"""
+Collect order books, futures indexes and trades together in one process.
+
+The managers are built from a declarative config and run on their own cadences by the rate
+limited scheduler, sharing the HTTP sessions, database engines and instrument registry of the
+process.  The config is json, any key left out takes its value from `DEFAULT_CONFIG`:
+
+    {
+        "currencies": ["btc", "eth"],
+        "contracts": ["this_week", "quarter"],
+        "order_book": {"interval": 10, "spot_depth": 500, "future_depth": 200,
+                       "storage_mode": "snapshot", "stream": false},
+        "index": {"interval": 10},
+        "trades": {"interval": 30, "size": 200},
+        "schedule": [["spot_btc_*", 2, 10]],
+        "retention": [["future_*", {"action": "archive", "raw_days": 7}]],
+        "schema": {"price_types": [["spot_*", "DECIMAL(16,8)"]]},
+        "offset": 0.001
+    }
+
+`retention` configures the compaction of old level two partitions, see partitions.py, and
+`schema` the tables created by schema.create_tables.
+"""
+import copy
+import json
+
+from .constants import CURRENCY_LIST, CONTRACT_LIST, BOOK_STORAGE_MODES
+from .data_managers import get_managers, get_trades_managers, IndexManager
+from .logs import logger_collector, configure_logging
+from .partitions import check_retention
+from .schema import DEFAULT_SCHEMA, check_schema
+from .scheduler import (
+    apply_schedule, attach_outputs, follow_contract_rolls, rate_limited_scheduler
+)
+from .streaming import StreamingBookManager, get_streaming_book_managers, start_book_streams
+
+DEFAULT_CONFIG = {
+    'currencies': list(CURRENCY_LIST),
+    'contracts': list(CONTRACT_LIST),
+    'order_book': {'interval': 10, 'spot_depth': 500, 'future_depth': 200,
+                   'storage_mode': 'snapshot', 'stream': False},
+    'index': {'interval': 10},
+    'trades': {'interval': 30, 'size': 200},
+    'schedule': [],
+    'retention': [],
+    'schema': copy.deepcopy(DEFAULT_SCHEMA),
+    'offset': 0.001,
+}
+
+
+def load_config(path=None):
+    """Load a collector config, filling in the keys left out from `DEFAULT_CONFIG`.
+
+    Parameters
+    ----------
+    path: str
+        Path of the json config, None for the default config.
+
+    Returns
+    -------
+    dict
+        The validated config.
+
+    Raises
+    ------
+    ValueError
+        If the config has unknown keys or values.
+    """
+    config = {}
+    if path is not None:
+        with open(path, 'r') as f:
+            config = json.loads(f.read())
+    return merge_config(config)
+
+
+def merge_config(config):
+    """Fill in the keys left out of a config from `DEFAULT_CONFIG` and validate it."""
+    merged = copy.deepcopy(DEFAULT_CONFIG)
+    for key, value in config.items():
+        if key not in merged:
+            raise ValueError(f'Unknown config key {key}, expected one of {list(merged)}')
+        if isinstance(merged[key], dict):
+            if value is None:
+                merged[key] = None
+                continue
+            unknown = set(value) - set(merged[key])
+            if unknown:
+                raise ValueError(f'Unknown {key} config keys {sorted(unknown)}')
+            merged[key].update(value)
+        else:
+            merged[key] = value
+
+    unknown = set(merged['contracts']) - set(CONTRACT_LIST)
+    if unknown:
+        raise ValueError(f'Unknown contracts {sorted(unknown)}, expected some of {CONTRACT_LIST}')
+    if merged['order_book'] and merged['order_book']['storage_mode'] not in BOOK_STORAGE_MODES:
+        raise ValueError(f'Unknown storage mode {merged["order_book"]["storage_mode"]}, '
+                         f'expected one of {BOOK_STORAGE_MODES}')
+    for pattern, interval, priority in merged['schedule']:
+        if not interval > 0:
+            raise ValueError(f'Interval of {pattern} must be positive, got {interval}')
+        if isinstance(priority, bool) or not isinstance(priority, (int, float)):
+            raise ValueError(f'Priority of {pattern} must be a number, got {priority}')
+    check_retention(merged['retention'])
+    if merged['schema']:
+        check_schema(merged['schema'])
+    return merged
+
+
+def build_managers(config):
+    """Build the managers of a config with their intervals and priorities set.
+
+    A section set to null, e.g. `"trades": null`, is not collected.  With `"stream": true`
+    the order books are maintained from the exchange's websocket and sampled at their
+    interval, see streaming.StreamingBookManager.
+
+    Parameters
+    ----------
+    config: dict
+        Config returned by `load_config`.
+
+    Returns
+    -------
+    list
+        Order book, index and trades managers.
+    """
+    currencies, contracts = config['currencies'], config['contracts']
+    books, index, trades = config['order_book'], config['index'], config['trades']
+    managers = []
+
+    stream = books is not None and books['stream']
+
+    if books is not None or index is not None:
+        book_config = books or DEFAULT_CONFIG['order_book']
+        for manager in get_managers(book_config['storage_mode'], currencies, contracts,
+                                    book_config['spot_depth'], book_config['future_depth'],
+                                    index=index is not None):
+            section = index if isinstance(manager, IndexManager) else books
+            if section is not None and not (stream and section is books):
+                manager.interval = section['interval']
+                managers.append(manager)
+
+    if stream:
+        for manager in get_streaming_book_managers(currencies, contracts, books['spot_depth'],
+                                                   books['future_depth'],
+                                                   books['storage_mode']):
+            manager.interval = books['interval']
+            managers.append(manager)
+
+    if trades is not None:
+        for manager in get_trades_managers(currencies, contracts, trades['size']):
+            manager.interval = trades['interval']
+            managers.append(manager)
+
+    apply_schedule(managers, config['schedule'])
+    return managers
+
+
+def run_collector(config=None, sinks=(), write_behind=False, spool=None):
+    """Collect every manager type of a config in this process until interrupted.
+
+    Parameters
+    ----------
+    config: dict
+        Config returned by `load_config`, None for the default config.
+    sinks: iterable
+        Additional sinks written to after MySQL, e.g. archive.ParquetSink.
+    write_behind: bool
+        Queue the database writes on a shared write_behind.WriteBehindWriter.
+    spool: str
+        Directory of a spool.WriteAheadSpool the records are written through.
+    """
+    config = merge_config({}) if config is None else config
+    configure_logging()
+    db_managers = build_managers(config)
+    attach_outputs(db_managers, sinks, write_behind, spool)
+    follow_contract_rolls(db_managers)
+    streams = start_book_streams([manager for manager in db_managers
+                                  if isinstance(manager, StreamingBookManager)])
+    log_msg = f'Collecting {len(db_managers)} managers.'
+    try:
+        rate_limited_scheduler(db_managers, logger_collector, time_between_requests=10,
+                               offset=config['offset'], log_msg=log_msg)
+    finally:
+        for stream in streams:
+            stream.stop()
@@ -4,8 +4,6 @@ Constants used in locrian_collect
 from enum import Enum
 import os
 
-from .utils import get_db_login
-
 
 class Side(Enum):
     """Enum of the trade side; either ask or bid."""
@@ -20,6 +18,41 @@ NANOSECOND_FACTOR = 1000000000
 MILLISECONDS_TO_NANOSECONDS = 1000000
 CURRENCY_LIST = ('btc', 'bch', 'ltc', 'etc', 'eth')
 CONTRACT_LIST = ('this_week', 'next_week', 'quarter')
+TRADE_ID_CACHE_SIZE = 2000
+KEYFRAME_INTERVAL = 60  # ticks between full books in delta storage mode
+BOOK_STORAGE_MODES = ('snapshot', 'delta')
+ARCHIVE_ROW_GROUP_SIZE = 50000  # rows
+ARCHIVE_COMPRESSION = 'zstd'
+WRITE_BEHIND_QUEUE_SIZE = 10000  # records
+WRITE_BEHIND_BATCH_SIZE = 100  # records per table
+WRITE_BEHIND_FLUSH_INTERVAL = 5  # seconds
+WRITE_BEHIND_PUT_TIMEOUT = 1  # seconds
+SPOOL_DIRECTORY = f'{BASE_DATA_DIRECTORY}/spool'
+SPOOL_SEGMENT_BYTES = 64 * 2 ** 20  # bytes per segment file
+SPOOL_MAX_BYTES = 4 * 2 ** 30  # bytes on disk before records are dropped
+SPOOL_WARN_FRACTION = 0.8  # of SPOOL_MAX_BYTES before alerting
+SPOOL_BATCH_SIZE = 1000  # records per replay batch
+SPOOL_POLL_INTERVAL = 1  # seconds between replays of an empty spool
+SPOOL_RETRY_INTERVAL = 1  # seconds, doubled after every failed replay
+SPOOL_MAX_RETRY_INTERVAL = 60  # seconds
+SPOOL_MAX_ATTEMPTS = 5  # failed writes of a batch before it is moved to the dead letters
+READ_CHUNK_SIZE = 100000  # rows per chunk streamed from the database
+PARTITION_DAYS_AHEAD = 3  # daily partitions created ahead of today
+PARTITION_HISTORY_DAYS = 365  # days of existing rows given daily partitions, older rows share one
+RETENTION_RAW_DAYS = 30  # days of full books kept before compaction
+COMPACT_DEPTH = 20  # levels per side kept by the downsample compaction
+COMPACT_INTERVAL = 60  # seconds between the books kept by the downsample compaction
+SCHEMA_TABLE_OPTIONS = 'ENGINE=InnoDB ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8'
+MIGRATION_CHUNKS = 100  # key ranges copied per table by schema.migrate_table
+INSTRUMENT_CACHE_TTL = 3600  # seconds
+INSTRUMENT_ROLL_DELAY = 60  # seconds after delivery before refreshing the contracts
+INSTRUMENT_RETRY_INTERVAL = 60  # seconds between refreshes while a delivered contract is listed
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # s
+METRICS_SNAPSHOT_INTERVAL = 60  # seconds
+SHARD_HEARTBEAT_INTERVAL = 5  # seconds
+SHARD_HEARTBEAT_TIMEOUT = 60  # seconds without a heartbeat before a shard is restarted
+SHARD_RESTART_BACKOFF = 10  # seconds between restarts of a shard
+SHARD_STOP_TIMEOUT = 30  # seconds a stopped shard has to flush its outputs before it is killed
 
 # https://www.okcoin.com/api/spot/v3/instruments/btc-usd/book?size=500
 # https://www.okcoin.com/api/spot/v3/instruments/btc-usd/trades?size=500
@@ -29,6 +62,22 @@ CONTRACT_LIST = ('this_week', 'next_week', 'quarter')
 
 BASE_OKCOIN_URL = 'https://www.okcoin.com/api/spot/v3/instruments/'
 BASE_OKEX_URL = 'https://www.okex.com/api/futures/v3/instruments/'
+OKCOIN_WS_URL = 'wss://real.okcoin.com:8443/ws/v3'
+OKEX_WS_URL = 'wss://real.okex.com:8443/ws/v3'
+STREAM_CHECKSUM_DEPTH = 25  # levels per side in the exchange's book checksum
+STREAM_PING_INTERVAL = 25  # seconds, the exchange closes connections idle for 30 seconds
+STREAM_RECONNECT_BACKOFF = 1  # seconds, doubled after each failed connection up to a minute
+STREAM_STALE_AFTER = 30  # seconds without an update before a streamed book is not sampled
+HTTP_POOL_SIZE = 20  # connections per host
+HTTP_RETRIES = 2
+HTTP_BACKOFF = 0.2  # seconds
+HTTP_RETRY_STATUS_CODES = (500, 502, 503, 504)
+HTTP_RATE_LIMIT_STATUS = 429
+HOST_RATE_LIMITS = {'www.okcoin.com': 10, 'www.okex.com': 10}  # requests per second
+DEFAULT_HOST_RATE_LIMIT = 10  # requests per second
+RATE_LIMIT_BURST = 5  # requests
+RATE_LIMIT_BACKOFF = 1  # seconds paused after a 429 without a Retry-After header
+RATE_LIMIT_RECOVERY = 0.05  # fraction of the rate recovered per successful request
 #
 # BASE_URL_SPOT_TRADES = f'{OKCOIN}trades.do'
 # BASE_URL_SPOT_DEPTH = f'{OKCOIN}depth.do'
@@ -37,5 +86,6 @@ BASE_OKEX_URL = 'https://www.okex.com/api/futures/v3/instruments/'
 # BASE_URL_INDEX = f'{OKEX}future_index.do'
 # BASE_URL_FUTURE_DEPTH = f'{OKEX}future_depth.do'
 UNIX_SOCKET = '/var/run/mysqld/mysqld.sock'
-
-DB_USERNAME, DB_PASSWORD = get_db_login()
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 20
+DB_POOL_RECYCLE = 3600  # seconds
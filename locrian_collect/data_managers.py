@@ -1,39 +1,31 @@
 """
 Data Managers that control the collection and storage of data from an exchange to a database.
 """
-import json
 import time
 
 import requests
-import sqlalchemy
 from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 import pandas as pd
 
+from .book_delta import diff_books
+from .bulk_insert import insert_frame
 from .constants import (
-    NANOSECOND_FACTOR, MILLISECONDS_TO_NANOSECONDS, UNIX_SOCKET, DB_USERNAME, DB_PASSWORD,
-    CURRENCY_LIST, CONTRACT_LIST, BASE_OKCOIN_URL, BASE_OKEX_URL
+    NANOSECOND_FACTOR, MILLISECONDS_TO_NANOSECONDS, CURRENCY_LIST, CONTRACT_LIST,
+    BASE_OKCOIN_URL, BASE_OKEX_URL, KEYFRAME_INTERVAL, BOOK_STORAGE_MODES
 )
+from .engines import get_engine
+from .instruments import get_instrument_registry
+from .level_two_book import LevelTwoBook
 from .logs import logger_order_book, logger_index, logger_trades
-from .parse_level_two_book import parse_level_two_book
+from .metrics import METRICS
+from .rate_limit import RateLimited, get_rate_limiter
+from .sessions import get_json
+from .trade_id_cache import TradeIdCache
+from .validation import validate_level_two_book
 
-
-def get_sqlalchemy_engine(database_name):
-    """Get Sqlalchemy engine
-
-    Parameters
-    ----------
-    database_name: str
-        Name of the database to connect to.
-
-    Returns
-    -------
-    Engine for sqlalchemy.
-
-    """
-    host = 'localhost'
-    return sqlalchemy.create_engine(
-        f'mysql://{DB_USERNAME}:{DB_PASSWORD}@{host}:3306/{database_name}'
-        f'?unix_socket={UNIX_SOCKET}')
+TRADES_COLUMNS = ['unixRequestTime', 'unixReturnTime', 'trade_time', 'amount', 'price', 'side',
+                  'tid']
 
 
 class BaseManager:
@@ -49,17 +41,172 @@ class BaseManager:
         The name of the database.
 
     """
+    # Whether `get_data` requests the url, the schedulers only take a rate limit token for
+    # managers that do.
+    uses_rest = True
+
     def __init__(self, mysql_table, url, database_name):
         self.database_name = database_name
         self.mysql_table = mysql_table
         self.url = url
         self.col_name = None
+        self.interval = None
+        self.phase = 0
+        self.priority = 0
+        self.sinks = []
+        self.writer = None
+        self.spool = None
+        self.contract = None
+        self.url_template = None
+
+    def track_contract(self, contract, url_template):
+        """Follow a futures contract alias so the url can be updated when the contract rolls.
+
+        Parameters
+        ----------
+        contract: str
+            The contract alias, one of CONTRACT_LIST.
+        url_template: str
+            The url with a `{delivery}` field for the delivery date of the contract.
+        """
+        self.contract = contract
+        self.url_template = url_template
+        return self
+
+    def roll_contract(self, alias_mapping):
+        """Point the url at the contract now trading under the manager's alias.
+
+        Parameters
+        ----------
+        alias_mapping: dict
+            {alias: delivery}, e.g. {'quarter': '200626', ...}
+
+        Returns
+        -------
+        bool
+            True if the url changed.
+        """
+        if self.contract is None or self.contract not in alias_mapping:
+            return False
+        url = self.url_template.format(delivery=alias_mapping[self.contract])
+        if url == self.url:
+            return False
+        self.url = url
+        return True
 
     def get_data(self):
-        """Helper function to get data and save the results after filtering, not implemented
-        in the base class."""
+        """Helper function to get data and save the results after filtering."""
+        self.handle_result(*self._request_data())
+
+    def handle_result(self, request_time, return_time, result):
+        """Filter and save the result of a request, not implemented in the base class.
+
+        Parameters
+        ----------
+        request_time: int
+            The unix time in nanoseconds the request was made.
+        return_time: int
+            The unix time in nanoseconds the data was returned from the request.
+        result:
+            The decoded json returned by the exchange, None if the request failed.
+        """
         raise NotImplementedError
 
+    def attach_spool(self, spool):
+        """Append the manager's records to a spool.WriteAheadSpool, which writes them to the
+        database, instead of writing them directly."""
+        self.spool = spool
+        for table, write_fn in self.write_functions().items():
+            spool.register((self.database_name, table), self._measured(write_fn))
+        return self
+
+    def write_functions(self):
+        """Get the functions writing batches of the manager's records, by table."""
+        return {}
+
+    def submit_or_write(self, table, record, write_fn):
+        """Write a record now, or queue it on the manager's write-behind writer if it has one.
+        Records are appended to the manager's spool instead if it has one.
+
+        Parameters
+        ----------
+        table: str
+            Name of the table the record is written to.
+        record:
+            The record to write.
+        write_fn: callable
+            Writes a list of records of the table in one batch.
+
+        Returns
+        -------
+        bool
+            False if the writer or spool dropped the record because it was full.
+        """
+        write_fn = self._measured(write_fn)
+        if self.spool is not None:
+            key = (self.database_name, table)
+            self.spool.register(key, write_fn)
+            if not self.spool.append(key, record):
+                self.record_error('dropped')
+                return False
+            return True
+        if self.writer is None:
+            write_fn([record])
+            return True
+        if not self.writer.submit((self.database_name, table), record, write_fn):
+            self.record_error('dropped')
+            return False
+        return True
+
+    def _measured(self, write_fn):
+        """Wrap a write function to record its duration, the rows it returns and its errors."""
+        def write(records, **kwargs):
+            try:
+                with METRICS.timer(self.mysql_table, 'write'):
+                    rows = write_fn(records, **kwargs)
+            except Exception:
+                self.record_error('write')
+                raise
+            if rows is not None:
+                METRICS.increment(self.mysql_table, 'rows_written', rows)
+            return rows
+        return write
+
+    def record_request(self, request_time, return_time):
+        """Record the latency of a successful request and how late it started after the tick.
+
+        Parameters
+        ----------
+        request_time: int
+            The unix time in nanoseconds the request was made.
+        return_time: int
+            The unix time in nanoseconds the data was returned from the request.
+        """
+        METRICS.increment(self.mysql_table, 'requests')
+        METRICS.observe(self.mysql_table, 'http', (return_time - request_time) / NANOSECOND_FACTOR)
+        if self.interval:
+            METRICS.observe(self.mysql_table, 'tick_skew',
+                            (request_time / NANOSECOND_FACTOR - self.phase) % self.interval)
+
+    def record_error(self, kind):
+        """Count an error of a kind, e.g. 'timeout', 'connection' or 'invalid'."""
+        METRICS.increment(self.mysql_table, f'errors_{kind}')
+
+    def write_to_sinks(self, table, frame, timestamp):
+        """Write rows to the additional sinks, such as archive.ParquetSink, after MySQL.
+
+        Parameters
+        ----------
+        table: str
+            Name of the table the rows belong to.
+        frame: pd.DataFrame
+            The rows written to MySQL.
+        timestamp: int
+            The unix time in nanoseconds the request was made.
+        """
+        for sink in self.sinks:
+            sink.write(self.database_name, table, frame, timestamp)
+
     def execute_query_read(self, query):
         """Execute a sql query to read from a database
 
@@ -73,10 +220,8 @@ class BaseManager:
         tuple
             Fetches all from sql query.
         """
-        engine = get_sqlalchemy_engine(self.database_name)
-        result = engine.execute(text(query)).fetchall()
-        engine.dispose()
-        return result
+        engine = get_engine(self.database_name)
+        return engine.execute(text(query)).fetchall()
 
     def execute_query_write(self, query):
         """Execute a sql query to write to a database
@@ -86,27 +231,46 @@ class BaseManager:
         query: str
             SQL query to write to database
         """
-        engine = get_sqlalchemy_engine(self.database_name)
+        engine = get_engine(self.database_name)
         engine.execute(text(query).execution_options(autocommit=True))
-        engine.dispose()
 
     def _request_data(self):
-        """Make a REST request to the url."""
+        """Make a REST request to the url.  Failed requests are retried until the next tick
+        when the manager's `interval` is set by the scheduler."""
         try:
             request_time = int(time.time() * NANOSECOND_FACTOR)
-            result = requests.get(self.url, timeout=8).json()
+            result = get_json(self.url, deadline=self._next_tick())
             return_time = int(time.time() * NANOSECOND_FACTOR)
+            self.record_request(request_time, return_time)
+            get_rate_limiter(self.url).on_success()
             return request_time, return_time, result
 
+        except RateLimited as exc:
+            logger_order_book.warning(f'Rate limited: {self.mysql_table}')
+            self.record_error('rate_limited')
+            get_rate_limiter(self.url).back_off(exc.retry_after)
         except requests.Timeout:
             logger_order_book.warning(f'Timeout error: {self.mysql_table}')
+            self.record_error('timeout')
+        except requests.ConnectionError:
+            logger_order_book.warning(f'Connection error: {self.mysql_table}')
+            self.record_error('connection')
         except RuntimeError:
             logger_order_book.warning(f'Runtime error: {self.mysql_table}')
+            self.record_error('runtime')
         except ValueError as exc:
             logger_order_book.warning(f'{exc}')
+            self.record_error('decode')
 
         return None, None, None
 
+    def _next_tick(self):
+        """The unix time in seconds of the next tick, None if the interval is not known."""
+        if not self.interval:
+            return None
+        now = time.time() - self.phase
+        return self.phase + now + self.interval - now % self.interval
+
 
 class OrderBookManager(BaseManager):
     """Manager for collecting and saving order book data between an exchange and a database.
@@ -117,26 +281,39 @@ class OrderBookManager(BaseManager):
         Name of the database table to connect with.
     url: str
         The exchanges url for requesting data.
+    storage_mode: str
+        'snapshot' writes every book in full, 'delta' writes a full book every
+        `keyframe_interval` ticks and only the changed levels in between, see book_delta.
+    keyframe_interval: int
+        Number of ticks between full books in delta storage mode.
     """
-    def __init__(self, asset_name, mysql_table, url):
+    def __init__(self, asset_name, mysql_table, url, storage_mode='snapshot',
+                 keyframe_interval=KEYFRAME_INTERVAL):
         super().__init__(mysql_table=mysql_table, url=url, database_name='locrian_level_two')
+        if storage_mode not in BOOK_STORAGE_MODES:
+            raise ValueError(f'Unknown storage mode {storage_mode}, '
+                             f'expected one of {BOOK_STORAGE_MODES}')
         self.col_name = 'orderBook'
         self.asset_name = asset_name
-
-    def get_data(self):
-        """Helper function to get data and save the results after filtering."""
-        request_time, _, result = self._request_data()
-
+        self.storage_mode = storage_mode
+        self.keyframe_interval = keyframe_interval
+        self._previous_book = None
+        self._deltas_since_keyframe = 0
+        # Set from the writer's thread when a write fails, the next book is written in full.
+        self._keyframe_due = False
+
+    def handle_result(self, request_time, return_time, result):
+        """Check the book is valid and save it."""
         if result is None:
             return
 
-        book = result
-        result = f"'{json.dumps(result)}'"
+        error = validate_level_two_book(result)
 
-        if 'ask' not in f'{result}' or 'bid' not in f'{result}' or '[]' in f'{result}':
-            logger_order_book.warning(f'Error {self.mysql_table}: {result}')
+        if error is not None:
+            logger_order_book.warning(f'Error {self.mysql_table}: {error}')
+            self.record_error('invalid')
         else:
-            self.add_book_to_db(request_time, book)
+            self.add_book_to_db(request_time, result)
 
     def add_book_to_db(self, timestamp, book):
         """Add level two book to database.
@@ -148,10 +325,65 @@ class OrderBookManager(BaseManager):
         book: dict
             The level two book as a dict; {'side': [price, volume]}
         """
-        level_two_book = parse_level_two_book(timestamp, book)
-        engine = get_sqlalchemy_engine(self.database_name)
-        level_two_book.to_sql(self.asset_name, engine, if_exists='append', index=False)
-        engine.dispose()
+        with METRICS.timer(self.mysql_table, 'parse'):
+            book = LevelTwoBook.from_exchange(timestamp, book)
+            level_two_book = book.to_frame()
+
+        if self.storage_mode == 'snapshot':
+            self.submit_or_write(self.asset_name, level_two_book, self._write_books)
+        else:
+            self._add_book_or_deltas(book, level_two_book)
+
+        self.write_to_sinks(self.asset_name, level_two_book, timestamp)
+
+    def _add_book_or_deltas(self, book, level_two_book):
+        """Write a keyframe or the deltas from the previous book in delta storage mode.  A
+        keyframe is forced after a failed write, the deltas queued since don't follow what was
+        saved."""
+        if (self._previous_book is None or self._keyframe_due
+                or self._deltas_since_keyframe >= self.keyframe_interval - 1):
+            self._keyframe_due = False
+            saved = self.submit_or_write(self.asset_name, level_two_book, self._write_books)
+            deltas_since_keyframe = 0
+        else:
+            deltas = diff_books(self._previous_book, book)
+            saved = self.submit_or_write(f'{self.asset_name}_delta', deltas, self._write_deltas)
+            deltas_since_keyframe = self._deltas_since_keyframe + 1
+
+        # Only updated once the record is accepted, a write failing later forces a keyframe.
+        if saved:
+            self._previous_book = book
+            self._deltas_since_keyframe = deltas_since_keyframe
+
+    def write_functions(self):
+        return {self.asset_name: self._write_books,
+                f'{self.asset_name}_delta': self._write_deltas}
+
+    def _write_books(self, books, check_existing=False):
+        return self._write_frames(self.asset_name, books, check_existing)
+
+    def _write_deltas(self, deltas, check_existing=False):
+        return self._write_frames(f'{self.asset_name}_delta', deltas, check_existing)
+
+    def _write_frames(self, table, frames, check_existing=False):
+        """Append data frames to a table with a single bulk insert, returns the rows written.
+        With `check_existing` the rows of timestamps already in the table are skipped."""
+        frame = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        engine = get_engine(self.database_name)
+
+        try:
+            if check_existing and len(frame):
+                timestamps = ', '.join(str(timestamp)
+                                       for timestamp in frame['timestamp'].unique())
+                saved = [row[0] for row in engine.execute(text(
+                    f'SELECT DISTINCT timestamp FROM {table} WHERE timestamp IN ({timestamps})'
+                )).fetchall()]
+                frame = frame[~frame['timestamp'].isin(saved)]
+
+            return insert_frame(engine, table, frame)
+        except Exception:
+            self._keyframe_due = True
+            raise
 
 
 class IndexManager(BaseManager):
@@ -168,10 +400,8 @@ class IndexManager(BaseManager):
         super().__init__(mysql_table=mysql_table, url=url, database_name='locrian_future_index')
         self.col_name = 'future_index'
 
-    def get_data(self):
-        """Helper function to get data and save the results after filtering."""
-        request_time, return_time, result = self._request_data()
-
+    def handle_result(self, request_time, return_time, result):
+        """Save the futures index from the result."""
         if result is None:
             return
 
@@ -179,6 +409,7 @@ class IndexManager(BaseManager):
             result = result['index']
         except KeyError:
             logger_index.warning(f'Error {self.mysql_table}: {result}')
+            self.record_error('invalid')
             return
 
         self.add_row_to_database(request_time, return_time, result)
@@ -195,10 +426,36 @@ class IndexManager(BaseManager):
         row: str
             A json formatted string of the data to record.
         """
+        self.submit_or_write(self.mysql_table, (request_time, return_time, row), self._write_rows)
+
+        if self.sinks:
+            self.write_to_sinks(self.mysql_table, pd.DataFrame(
+                {'unixRequestTime': [request_time], 'unixReturnTime': [return_time],
+                 self.col_name: [float(row)]}), request_time)
+
+    def write_functions(self):
+        return {self.mysql_table: self._write_rows}
+
+    def _write_rows(self, rows, check_existing=False):
+        """Insert (request_time, return_time, row) tuples with one statement, returns the
+        number of rows.  With `check_existing` the request times already in the table are
+        skipped."""
+        if check_existing:
+            request_times = ', '.join(str(row[0]) for row in rows)
+            saved = {row[0] for row in self.execute_query_read(
+                f'SELECT unixRequestTime FROM {self.mysql_table} '
+                f'WHERE unixRequestTime IN ({request_times})')}
+            rows = [row for row in rows if row[0] not in saved]
+            if not rows:
+                return 0
+
+        values = ', '.join(f'({request_time}, {return_time}, {row})'
+                           for request_time, return_time, row in rows)
         insert_query = (f'INSERT INTO {self.mysql_table} '
                         f'(unixRequestTime, unixReturnTime, {self.col_name}) '
-                        f"Values ({request_time}, {return_time}, {row})")
+                        f'Values {values}')
         self.execute_query_write(insert_query)
+        return len(rows)
 
 
 class TradesManager(BaseManager):
@@ -213,133 +470,354 @@ class TradesManager(BaseManager):
     """
     def __init__(self, mysql_table, url):
         super().__init__(mysql_table=mysql_table, url=url, database_name='locrian_trades')
+        self.tid_cache = TradeIdCache(name=mysql_table)
+        # The unix time in nanoseconds the current contract was first requested, None for
+        # managers not following a contract.
+        self.contract_start = None
+        self._unique_tid = None
+
+    def track_contract(self, contract, url_template):
+        self.contract_start = int(time.time() * NANOSECOND_FACTOR)
+        return super().track_contract(contract, url_template)
+
+    def roll_contract(self, alias_mapping):
+        """Point the url at the contract now trading under the alias.  Trade identifiers are
+        only known to increase within a contract, so the trade identifier cache is cleared to
+        be warmed from the new contract's trades."""
+        rolled = super().roll_contract(alias_mapping)
+        if rolled:
+            self.contract_start = int(time.time() * NANOSECOND_FACTOR)
+            self.tid_cache = TradeIdCache(name=self.mysql_table)
+        return rolled
+
+    def handle_result(self, request_time, return_time, result):
+        """Save the trades in the result not already seen as one batch."""
+        if result is None:
+            return
 
-    def get_data(self):
-        """Override the BaseManager method. Get data from the exchange and check if that data.
-        Already exists in the database before saving."""
+        if not self.tid_cache.is_warm:
+            self.warm_tid_cache()
 
-        request_time, return_time, result = self._request_data()
+        with METRICS.timer(self.mysql_table, 'parse'):
+            rows = self.parse_trades(result)
+        new_tids = set(self.tid_cache.filter_new([row[-1] for row in rows]))
+        rows = [row for row in rows if row[-1] in new_tids]
 
-        if result is None:
+        if rows:
+            self.submit_or_write(self.mysql_table, (request_time, return_time, rows),
+                                 self._write_trades)
+
+            if self.sinks:
+                frame = pd.DataFrame(rows, columns=TRADES_COLUMNS[2:])
+                frame.insert(0, 'unixReturnTime', return_time)
+                frame.insert(0, 'unixRequestTime', request_time)
+                self.write_to_sinks(self.mysql_table, frame, request_time)
+
+    def warm_tid_cache(self):
+        """Load the largest saved trade identifier into the trade identifier cache.  If the
+        database cannot be read the cache stays cold and trades are checked against the table.
+
+        A futures table holds the trades of every contract rolled through under its alias, and
+        the trade identifiers of a new contract may start below those of the old one, so only
+        the trades requested since `contract_start` are read.
+        """
+        query = f'SELECT MAX(tid) FROM {self.mysql_table}'
+        if self.contract_start is not None:
+            query += f' WHERE unixRequestTime >= {self.contract_start}'
+        try:
+            result = self.execute_query_read(query)
+        except SQLAlchemyError as exception_msg:
+            logger_trades.warning(f'Error warming trade id cache {self.mysql_table} | '
+                                  f'{exception_msg}')
             return
+        self.tid_cache.warm(result[0][0] if result else None)
+
+    def has_unique_tid(self):
+        """Whether the table has a unique key on `tid` alone, which `INSERT IGNORE` needs to
+        drop trades already saved.  Tables of the original layout have none until migrated,
+        see schema.migrate_table, and their trades are always checked against the table.
+
+        Returns
+        -------
+        bool
+            The answer once the table could be read, False until then.
+        """
+        if self._unique_tid is None:
+            try:
+                result = self.execute_query_read(
+                    'SELECT COUNT(*) FROM (SELECT index_name FROM information_schema.statistics '
+                    f"WHERE table_schema = DATABASE() AND table_name = '{self.mysql_table}' "
+                    'AND non_unique = 0 GROUP BY index_name '
+                    "HAVING COUNT(*) = 1 AND MAX(column_name) = 'tid') AS unique_keys")
+            except SQLAlchemyError as exception_msg:
+                logger_trades.warning(f'Error reading the keys of {self.mysql_table} | '
+                                      f'{exception_msg}')
+                return False
+            self._unique_tid = bool(result and result[0][0])
+            if not self._unique_tid:
+                logger_trades.warning(f'{self.mysql_table} has no unique key on tid, trades are '
+                                      f'checked against the table until it is migrated')
+        return self._unique_tid
+
+    def parse_trades(self, result):
+        """Parse the trades returned by the exchange into rows, skipping malformed trades, which
+        are counted as `errors_invalid_trade`, and trades repeated within the response.
+
+        Parameters
+        ----------
+        result: list(dict)
+            Trades as returned by the exchange.
+
+        Returns
+        -------
+        list(tuple)
+            [(`trade_time`, `amount`, `price`, `side`, `tid`), ...] ordered by `tid`.
+        """
+        rows = {}
 
         for row in result:
             try:
-                if self.check_tid(row['trade_id']):
-                    continue
+                tid = int(row['trade_id'])
             except KeyError as exception_msg:
                 logger_trades.warning(f'Error no trade_id, {row}  |  {exception_msg}')
+                self.record_error('invalid_trade')
                 continue
             except TypeError as exception_msg:
                 logger_trades.warning(f'Error - trade_id type {row} | {exception_msg}')
+                self.record_error('invalid_trade')
+                continue
+            except ValueError as exception_msg:
+                logger_trades.warning(f'Error - trade_id not a number {row} | {exception_msg}')
+                self.record_error('invalid_trade')
                 continue
-            self.add_row_to_database(request_time, return_time, row)
 
-    def add_row_to_database(self, request_time, return_time, row):
-        """Insert a row into the mysql database.
+            amount = row.get('size', row.get('qty'))
+            if amount is None:
+                logger_trades.warning(f'Error amount is None, cannot get size or qty from {row}')
+                self.record_error('invalid_trade')
+                continue
+
+            try:
+                rows[tid] = (pd.Timestamp(row['timestamp']).value, float(amount),
+                             float(row['price']), f'{row["side"]}', tid)
+            except (KeyError, TypeError, ValueError) as exception_msg:
+                logger_trades.warning(f'Error parsing trade {row} | {exception_msg}')
+                self.record_error('invalid_trade')
+
+        return [rows[tid] for tid in sorted(rows)]
+
+    def write_functions(self):
+        return {self.mysql_table: self._write_trades}
+
+    def _write_trades(self, batches, check_existing=False):
+        """Write batches of trades and add them to the trade identifier cache.  Called once the
+        write-behind writer or spool flushes the batches, so trades of a failed write are not
+        cached and are saved from the next poll.  Trades of a contract rolled from are not
+        cached either, their identifiers say nothing of the new contract's.
+
+        The trades are checked against the table unless the cache is warm and the table has a
+        unique key on `tid`, so records replayed from the spool after a crash are not saved
+        twice in a table that has not been migrated."""
+        check_existing = (check_existing or not self.tid_cache.is_warm
+                          or not self.has_unique_tid())
+        rows = self.add_rows_to_database(batches, check_existing=check_existing)
+        contract_start = self.contract_start or 0
+        self.tid_cache.add([row[-1] for request_time, _, batch_rows in batches
+                            if request_time >= contract_start for row in batch_rows])
+        return rows
+
+    def add_rows_to_database(self, batches, check_existing=True):
+        """Insert the trades not already saved into the mysql database in one transaction.
 
         Parameters
         ----------
-        request_time: int
-            The unix time in nanoseconds the request was made.
-        return_time: int
-            The unix time in nanoseconds the data was returned from the request.
-        row: dict
-            Dictionary of the data columns to save.
+        batches: list(tuple)
+            [(`request_time`, `return_time`, `rows`), ...] where the times are the unix time in
+            nanoseconds the request was made and returned and `rows` are the trades returned
+            by `parse_trades`.
+        check_existing: bool
+            Query the table for trades already saved before inserting.  Only safe to skip when
+            the table has a unique key on `tid`, see `has_unique_tid`, duplicates such as those
+            of a spool replay are then dropped by `INSERT IGNORE`.
+
+        Returns
+        -------
+        int
+            The number of trades inserted.
         """
-        trade_ts = pd.Timestamp(row['timestamp']).value
-        amount = row.get('size', row.get('qty'))
-        if amount is None:
-            raise ValueError(f'amount is None.  Cannot get size or qty from {row}')
-
-        insert_query = (f'INSERT IGNORE INTO {self.mysql_table} '
-                        f'(unixRequestTime, unixReturnTime, trade_time, amount, price, side, tid) '
-                        f'Values ({request_time}, {return_time}, {trade_ts}, {amount}, '
-                        f'{row["price"]}, "{row["side"]}", {row["trade_id"]})')
-        self.execute_query_write(insert_query)
+        rows = [(request_time, return_time, *row)
+                for request_time, return_time, batch_rows in batches for row in batch_rows]
+        engine = get_engine(self.database_name)
 
-    def check_tid(self, tid):
-        """Get all the trade identifiers from the database.
+        with engine.begin() as connection:
+            if check_existing:
+                existing_tids = self.check_tids(connection, [row[-1] for row in rows])
+                rows = [row for row in rows if row[-1] not in existing_tids]
+
+            if rows:
+                connection.execute(text(self.insert_query(rows)))
+
+        return len(rows)
+
+    def insert_query(self, rows):
+        """Build a single multi-row insert for a batch of trades.
+
+        Parameters
+        ----------
+        rows: list(tuple)
+            Rows with the values of `TRADES_COLUMNS`.
+
+        Returns
+        -------
+        str
+            The insert query.
+        """
+        values = ', '.join(
+            f'({request_time}, {return_time}, {trade_ts}, {amount}, {price}, "{side}", {tid})'
+            for request_time, return_time, trade_ts, amount, price, side, tid in rows)
+        return (f'INSERT IGNORE INTO {self.mysql_table} '
+                f'({", ".join(TRADES_COLUMNS)}) '
+                f'Values {values}')
+
+    def check_tids(self, connection, tids):
+        """Get the trade identifiers that already exist in the database with one query.
+
+        Parameters
+        ----------
+        connection:
+            Sqlalchemy connection to query with.
+        tids: list(int)
+            Trade identifiers to look up.
 
         Returns
         -------
-        list(tuples)
-            [(`tid`,), ...]
+        set(int)
+            The trade identifiers already saved.
         """
-        query = f'SELECT tid FROM {self.mysql_table} where tid={tid}'
-        return self.execute_query_read(query)
+        query = f'SELECT tid FROM {self.mysql_table} where tid in ({", ".join(map(str, tids))})'
+        return {row[0] for row in connection.execute(text(query)).fetchall()}
 
 
-def trades_url_mysql_maps():
+def trades_url_mysql_maps(currencies=CURRENCY_LIST, contracts=CONTRACT_LIST, size=200):
     """Return a list of dicts where the dicts have information for the mysql_table and url
-    to get the data."""
+    to get the data.  Futures also have the contract alias and a url template with a
+    `{delivery}` field used when the contract rolls.
+
+    Parameters
+    ----------
+    currencies: iterable
+        Currencies to collect, e.g. ('btc', 'eth').
+    contracts: iterable
+        Futures contract aliases to collect, a subset of CONTRACT_LIST.
+    size: int
+        Number of trades requested.
+    """
     assets = []
     contract_alias_map = get_future_alias_mapping()
 
-    for currency in CURRENCY_LIST:
+    for currency in currencies:
         assets.append({'mysql_table': f'trades_spot_{currency}',
-                       'url': f'{BASE_OKCOIN_URL}{currency.upper()}-USD/trades?size=200'})
-        for contract in CONTRACT_LIST:
+                       'url': f'{BASE_OKCOIN_URL}{currency.upper()}-USD/trades?size={size}'})
+        for contract in contracts:
+            url_template = (f'{BASE_OKEX_URL}{currency.upper()}-USD-{{delivery}}'
+                            f'/trades?size={size}')
             assets.append({
-                'mysql_table':
-                    f'trades_future_{contract}_{currency}',
-                'url':
-                    f'{BASE_OKEX_URL}{currency.upper()}-USD-{contract_alias_map[contract]}/trades?size=200'})
+                'mysql_table': f'trades_future_{contract}_{currency}',
+                'url': url_template.format(delivery=contract_alias_map[contract]),
+                'contract': contract,
+                'url_template': url_template})
     return assets
 
 
-def get_trades_managers():
-    """Get a list of Trades Managers"""
-    assets = trades_url_mysql_maps()
+def get_trades_managers(currencies=CURRENCY_LIST, contracts=CONTRACT_LIST, size=200):
+    """Get a list of Trades Managers, see `trades_url_mysql_maps` for the parameters."""
+    assets = trades_url_mysql_maps(currencies, contracts, size)
 
     trades_managers = []
     for asset in assets:
-        trades_managers.append(TradesManager(**asset))
+        manager = TradesManager(mysql_table=asset['mysql_table'], url=asset['url'])
+        if 'contract' in asset:
+            manager.track_contract(asset['contract'], asset['url_template'])
+        trades_managers.append(manager)
 
     return trades_managers
 
 
 def get_future_alias_mapping():
-    aliases = ['this_week', 'next_week', 'quarter']  # Used in pandas query
-    data = requests.get('https://www.okex.com/api/futures/v3/instruments').json()
-    mapping = (
-        pd.DataFrame(data)
-        .query('alias in @aliases')[['alias', 'delivery']]
-        .drop_duplicates()
-        .set_index('alias')
-        .to_dict()['delivery']
-    )
-    return {alias: _parse_date(date) for alias, date in mapping.items()}
+    """Get the mapping of contract alias to delivery date from the cached instrument registry,
+    e.g. {'quarter': '200626', ...}."""
+    return get_instrument_registry().get_alias_mapping()
+
+
+def update_contract_urls(managers, alias_mapping):
+    """Point the managers following a futures contract at the contracts in a new mapping.
+
+    Parameters
+    ----------
+    managers: list
+        Managers, only those tracking a contract are changed.
+    alias_mapping: dict
+        {alias: delivery}, e.g. {'quarter': '200626', ...}
 
+    Returns
+    -------
+    list
+        The managers whose url changed.
+    """
+    rolled = [manager for manager in managers if manager.roll_contract(alias_mapping)]
+    for manager in rolled:
+        logger_order_book.info(f'{manager.mysql_table} rolled to {manager.url}')
+    return rolled
 
-def _parse_date(date):
-    """2020-01-01 --> 200101"""
-    return date.replace('-', '')[2:]
 
+def get_managers(book_storage_mode='snapshot', currencies=CURRENCY_LIST, contracts=CONTRACT_LIST,
+                 spot_depth=500, future_depth=200, index=True):
+    """Get a list of Managers for order books and future indexes.
 
-def get_managers():
-    """Get a list of Managers for order books and future indexes."""
+    Parameters
+    ----------
+    book_storage_mode: str
+        Storage mode of the order book managers, either 'snapshot' or 'delta'.
+    currencies: iterable
+        Currencies to collect, e.g. ('btc', 'eth').
+    contracts: iterable
+        Futures contract aliases to collect, a subset of CONTRACT_LIST.
+    spot_depth: int
+        Number of levels requested for spot books.
+    future_depth: int
+        Number of levels requested for futures books.
+    index: bool
+        Include a futures index manager per currency.
+    """
     managers = []
 
     contract_alias_map = get_future_alias_mapping()
 
-    for currency in CURRENCY_LIST:
-        print(f'{BASE_OKCOIN_URL}{currency.upper()}-USD/book?size=500')
+    for currency in currencies:
+        url = f'{BASE_OKCOIN_URL}{currency.upper()}-USD/book?size={spot_depth}'
+        print(url)
         managers.append(OrderBookManager(asset_name=f'spot_{currency}',
                                          mysql_table=f'spot_{currency}_usd_orderbook',
-                                         url=f'{BASE_OKCOIN_URL}{currency.upper()}-USD/book?size=500'))
-        print(f'{BASE_OKEX_URL}{currency.upper()}-USD-{contract_alias_map["quarter"]}/index')
-        managers.append(
-            IndexManager(
-                mysql_table=f'future_index_{currency}_usd',
-                url=f'{BASE_OKEX_URL}{currency.upper()}-USD-{contract_alias_map["quarter"]}/index'))
-
-        for contract in CONTRACT_LIST:
-            url = f'{BASE_OKEX_URL}{currency.upper()}-USD-{contract_alias_map[contract]}/book?size=200'
+                                         url=url,
+                                         storage_mode=book_storage_mode))
+        url_template = f'{BASE_OKEX_URL}{currency.upper()}-USD-{{delivery}}/index'
+        url = url_template.format(delivery=contract_alias_map['quarter'])
+        if index:
+            print(url)
+            managers.append(
+                IndexManager(mysql_table=f'future_index_{currency}_usd', url=url)
+                .track_contract('quarter', url_template))
+
+        for contract in contracts:
+            url_template = (f'{BASE_OKEX_URL}{currency.upper()}-USD-{{delivery}}'
+                            f'/book?size={future_depth}')
+            url = url_template.format(delivery=contract_alias_map[contract])
             print(url)
             managers.append(
                 OrderBookManager(asset_name=f'future_{currency}_{contract}',
                                  mysql_table=f'future_{currency}_usd_{contract}_orderbook',
-                                 url=url))
+                                 url=url,
+                                 storage_mode=book_storage_mode)
+                .track_contract(contract, url_template))
 
     return managers
@@ -0,0 +1,94 @@
+"""
+Process wide registry of pooled sqlalchemy engines, one per database.
+"""
+import atexit
+from threading import Lock
+
+import sqlalchemy
+
+from .constants import UNIX_SOCKET, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE
+from .utils import get_db_login
+
+_ENGINES = {}
+_ENGINES_LOCK = Lock()
+
+
+def get_sqlalchemy_engine(database_name, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                          pool_recycle=DB_POOL_RECYCLE):
+    """Create a new pooled sqlalchemy engine.
+
+    Parameters
+    ----------
+    database_name: str
+        Name of the database to connect to.
+    pool_size: int
+        Number of connections kept open in the pool.
+    max_overflow: int
+        Number of connections allowed above `pool_size` during bursts.
+    pool_recycle: int
+        Seconds after which a pooled connection is replaced, this must be less than
+        MySQL's `wait_timeout`.
+
+    Returns
+    -------
+    Engine for sqlalchemy.
+
+    """
+    host = 'localhost'
+    username, password = get_db_login()
+    return sqlalchemy.create_engine(
+        f'mysql://{username}:{password}@{host}:3306/{database_name}'
+        f'?unix_socket={UNIX_SOCKET}',
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=True)
+
+
+def get_engine(database_name):
+    """Get the shared engine for a database, creating it on first use.
+
+    Engines are thread safe and are shared by all managers and scheduler threads, so
+    connections are reused rather than opened and closed for every query.
+
+    Parameters
+    ----------
+    database_name: str
+        Name of the database to connect to.
+
+    Returns
+    -------
+    Engine for sqlalchemy.
+    """
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(database_name)
+        if engine is None:
+            engine = get_sqlalchemy_engine(database_name)
+            _ENGINES[database_name] = engine
+        return engine
+
+
+def set_engine(database_name, engine):
+    """Use an engine for a database instead of the MySQL engine `get_engine` would create,
+    e.g. a local SQLite database for benchmarks.  Replaced engines are not disposed.
+
+    Parameters
+    ----------
+    database_name: str
+        Name of the database.
+    engine:
+        Sqlalchemy engine.
+    """
+    with _ENGINES_LOCK:
+        _ENGINES[database_name] = engine
+
+
+def dispose_engines():
+    """Close all pooled connections and empty the registry."""
+    with _ENGINES_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+
+
+atexit.register(dispose_engines)
@@ -0,0 +1,198 @@
+"""
+Cached registry of the futures contracts listed by Okex.
+
+The registry maps each contract alias (this_week, next_week, quarter) to the delivery date of
+the contract currently trading under it.  The mapping is cached for `ttl` seconds, saved to
+disk as a fallback for cold starts when the exchange is unreachable, and can be refreshed in
+the background when a contract is delivered so managers follow the roll without a restart.
+"""
+import calendar
+import json
+import os
+from threading import Thread, Lock, Event
+import time
+
+import requests
+
+from .constants import (
+    BASE_DATA_DIRECTORY, CONTRACT_LIST, INSTRUMENT_CACHE_TTL, INSTRUMENT_ROLL_DELAY,
+    INSTRUMENT_RETRY_INTERVAL
+)
+from .logs import logger_order_book
+from .sessions import get_json
+
+INSTRUMENTS_URL = 'https://www.okex.com/api/futures/v3/instruments'
+INSTRUMENT_CACHE_PATH = f'{BASE_DATA_DIRECTORY}/instruments.json'
+DELIVERY_HOUR_UTC = 8
+
+
+def fetch_future_deliveries():
+    """Get the delivery date of the contract trading under each alias from the exchange.
+
+    Returns
+    -------
+    dict
+        {alias: delivery date}, e.g. {'quarter': '2020-06-26', ...}
+    """
+    data = get_json(INSTRUMENTS_URL)
+    return {row['alias']: row['delivery'] for row in data if row['alias'] in CONTRACT_LIST}
+
+
+def parse_date(date):
+    """2020-01-01 --> 200101"""
+    return date.replace('-', '')[2:]
+
+
+def delivery_time(date):
+    """Unix time in seconds a contract delivered on a date, 2020-01-01, is settled."""
+    return calendar.timegm(time.strptime(date, '%Y-%m-%d')) + DELIVERY_HOUR_UTC * 3600
+
+
+class InstrumentRegistry:
+    """Cache of the contract alias to delivery date mapping.
+
+    Parameters
+    ----------
+    ttl: float
+        Seconds the mapping is used before it is fetched again.
+    cache_path: str
+        Path of the file the last fetched mapping is saved to.
+    fetch: callable
+        Returns {alias: delivery date}, defaults to `fetch_future_deliveries`.
+    """
+    def __init__(self, ttl=INSTRUMENT_CACHE_TTL, cache_path=INSTRUMENT_CACHE_PATH,
+                 fetch=fetch_future_deliveries):
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self.fetch = fetch
+        self._deliveries = None
+        self._fetched_at = 0
+        self._listeners = []
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def get_alias_mapping(self, refresh=False):
+        """Get the mapping of contract alias to the delivery date used in instrument ids.
+
+        Parameters
+        ----------
+        refresh: bool
+            Fetch the mapping even if the cached one has not expired.
+
+        Returns
+        -------
+        dict
+            {alias: delivery}, e.g. {'quarter': '200626', ...}
+        """
+        return {alias: parse_date(date) for alias, date in self.get_deliveries(refresh).items()}
+
+    def get_deliveries(self, refresh=False):
+        """Get the mapping of contract alias to delivery date, e.g. {'quarter': '2020-06-26'}.
+
+        The cached mapping is returned until it is `ttl` seconds old.  If the exchange cannot
+        be reached the last mapping is used, from memory or from `cache_path`.
+        """
+        with self._lock:
+            if (refresh or self._deliveries is None
+                    or time.time() - self._fetched_at >= self.ttl):
+                self._update()
+            return dict(self._deliveries)
+
+    def _update(self):
+        try:
+            deliveries = self.fetch()
+        except (requests.RequestException, ValueError, KeyError, TypeError) as exc:
+            if self._deliveries is None:
+                if not os.path.exists(self.cache_path):
+                    raise
+                self._deliveries = self._load()
+                logger_order_book.warning(f'Using cached instruments, fetch failed: {exc!r}')
+            else:
+                logger_order_book.warning(f'Keeping instruments, fetch failed: {exc!r}')
+            return
+
+        self._deliveries = deliveries
+        self._fetched_at = time.time()
+        self._save(deliveries)
+
+    def _load(self):
+        with open(self.cache_path, 'r') as f:
+            return json.loads(f.read())
+
+    def _save(self, deliveries):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(f'{self.cache_path}.tmp', 'w') as f:
+                f.write(json.dumps(deliveries))
+            os.replace(f'{self.cache_path}.tmp', self.cache_path)
+        except OSError as exc:
+            logger_order_book.warning(f'Could not save instruments cache: {exc!r}')
+
+    def next_refresh_time(self):
+        """Unix time in seconds of the next background refresh; shortly after the next
+        delivery, when the cache expires, or soon if a delivery has passed without the
+        mapping changing."""
+        with self._lock:
+            deliveries = dict(self._deliveries or {})
+            expires = self._fetched_at + self.ttl
+
+        now = time.time()
+        deliveries_at = [delivery_time(date) + INSTRUMENT_ROLL_DELAY
+                         for date in deliveries.values()]
+        next_time = min(deliveries_at + [expires])
+        if next_time <= now:
+            next_time = now + INSTRUMENT_RETRY_INTERVAL
+        return next_time
+
+    def add_listener(self, listener):
+        """Call `listener(alias_mapping)` whenever a background refresh changes the mapping."""
+        self._listeners.append(listener)
+
+    def start_background_refresh(self):
+        """Start a daemon thread refreshing the mapping at `next_refresh_time`."""
+        if self._thread is None:
+            self.get_deliveries()
+            self._thread = Thread(target=self._run, name='locrian_instruments', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh."""
+        self._stop.set()
+
+    def refresh(self):
+        """Fetch the mapping and notify the listeners if it changed.
+
+        Returns
+        -------
+        bool
+            True if the mapping changed.
+        """
+        with self._lock:
+            previous = self._deliveries
+            self._update()
+            changed = self._deliveries != previous
+
+        if changed:
+            mapping = self.get_alias_mapping()
+            logger_order_book.info(f'Contracts rolled: {mapping}')
+            for listener in self._listeners:
+                listener(mapping)
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(max(self.next_refresh_time() - time.time(), 0)):
+            self.refresh()
+
+
+_REGISTRY = None
+_REGISTRY_LOCK = Lock()
+
+
+def get_instrument_registry():
+    """Get the process wide instrument registry."""
+    global _REGISTRY  # pylint: disable=global-statement
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = InstrumentRegistry()
+        return _REGISTRY
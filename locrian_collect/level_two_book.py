@@ -0,0 +1,258 @@
+"""
+An array backed level two book.
+
+Each side is kept as contiguous float64 price and volume arrays sorted by ascending price, so
+the best ask is the first level of the asks and the best bid the last level of the bids.
+Finding a level is a binary search; adding or removing a level shifts the levels after it in
+place, with spare capacity at the end of the arrays so the arrays are only reallocated when
+they are full.
+"""
+import numpy as np
+import pandas as pd
+
+from .constants import Side
+from .parse_level_two_book import LEVEL_TWO_COLUMNS, _side_to_arrays
+
+_MIN_CAPACITY = 16
+
+
+class LevelTwoBook:
+    """Level two book of one instrument.
+
+    Parameters
+    ----------
+    timestamp: int
+        The unix time in nanoseconds of the book.
+    asks: tuple(np.ndarray, np.ndarray)
+        Prices and volumes of the asks, in any order.
+    bids: tuple(np.ndarray, np.ndarray)
+        Prices and volumes of the bids, in any order.
+    """
+    __slots__ = ('timestamp', '_prices', '_volumes', '_sizes')
+
+    def __init__(self, timestamp=0, asks=None, bids=None):
+        self.timestamp = timestamp
+        self._prices = {}
+        self._volumes = {}
+        self._sizes = {}
+        for side, levels in ((Side.ask, asks), (Side.bid, bids)):
+            prices, volumes = levels if levels is not None else ((), ())
+            self._set_side(side, prices, volumes)
+
+    @classmethod
+    def from_exchange(cls, timestamp, book):
+        """Make a book from json returned by the exchange, see `parse_level_two_book`.
+
+        Parameters
+        ----------
+        timestamp: int
+            The unix time in nanoseconds the request was made.
+        book: dict
+            The level two book as a dict; {'side': [price, volume]}
+        """
+        # The exchange sorts both sides by descending price.
+        return cls(timestamp, asks=_side_to_arrays(book.get('asks', [])[::-1]),
+                   bids=_side_to_arrays(book.get('bids', [])[::-1]))
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Make a book from a dataframe in the format returned by `parse_level_two_book`."""
+        timestamp = int(frame['timestamp'].iloc[0]) if len(frame) else 0
+        side = frame['side'].to_numpy()
+        prices = frame['price'].to_numpy(dtype=np.float64)
+        volumes = frame['volume'].to_numpy(dtype=np.float64)
+        return cls(timestamp,
+                   asks=(prices[side == Side.ask.value], volumes[side == Side.ask.value]),
+                   bids=(prices[side == Side.bid.value], volumes[side == Side.bid.value]))
+
+    def _set_side(self, side, prices, volumes):
+        prices = np.asarray(prices, dtype=np.float64)
+        volumes = np.asarray(volumes, dtype=np.float64)
+        if len(prices) > 1 and not (prices[1:] > prices[:-1]).all():
+            order = np.argsort(prices, kind='stable')
+            prices, volumes = prices[order], volumes[order]
+
+        size = len(prices)
+        capacity = max(_MIN_CAPACITY, size)
+        self._prices[side] = np.empty(capacity, dtype=np.float64)
+        self._volumes[side] = np.empty(capacity, dtype=np.float64)
+        self._prices[side][:size] = prices
+        self._volumes[side][:size] = volumes
+        self._sizes[side] = size
+
+    def update(self, side, price, volume):
+        """Set the volume at a price level, a volume of zero removes the level.
+
+        Parameters
+        ----------
+        side: Side
+            The side of the level.
+        price: float
+            The price of the level.
+        volume: float
+            The new volume at the price.
+        """
+        size = self._sizes[side]
+        prices = self._prices[side]
+        volumes = self._volumes[side]
+        index = int(np.searchsorted(prices[:size], price))
+        found = index < size and prices[index] == price
+
+        if found and volume:
+            volumes[index] = volume
+        elif found:
+            prices[index:size - 1] = prices[index + 1:size]
+            volumes[index:size - 1] = volumes[index + 1:size]
+            self._sizes[side] = size - 1
+        elif volume:
+            if size == len(prices):
+                prices, volumes = self._grow(side)
+            prices[index + 1:size + 1] = prices[index:size]
+            volumes[index + 1:size + 1] = volumes[index:size]
+            prices[index] = price
+            volumes[index] = volume
+            self._sizes[side] = size + 1
+
+    def update_levels(self, side, levels):
+        """Apply `update` to each [price, volume] of an iterable of levels."""
+        for price, volume in levels:
+            self.update(side, float(price), float(volume))
+
+    def _grow(self, side):
+        size = self._sizes[side]
+        capacity = 2 * len(self._prices[side])
+        for arrays in (self._prices, self._volumes):
+            grown = np.empty(capacity, dtype=np.float64)
+            grown[:size] = arrays[side][:size]
+            arrays[side] = grown
+        return self._prices[side], self._volumes[side]
+
+    def volume_at(self, side, price):
+        """The volume at a price level, 0 if there is no level at the price."""
+        size = self._sizes[side]
+        index = int(np.searchsorted(self._prices[side][:size], price))
+        if index < size and self._prices[side][index] == price:
+            return float(self._volumes[side][index])
+        return 0.0
+
+    def levels(self, side, depth=None):
+        """The prices and volumes of a side from the best level, views of the book's arrays.
+
+        Parameters
+        ----------
+        side: Side
+            The side of the book.
+        depth: int
+            Number of levels from the best, None for all levels.
+
+        Returns
+        -------
+        tuple(np.ndarray, np.ndarray)
+            Prices and volumes, valid until the book is next updated.
+        """
+        size = self._sizes[side]
+        depth = size if depth is None else min(depth, size)
+        if side is Side.ask or not depth:
+            levels = slice(0, depth)
+        else:
+            levels = slice(size - 1, size - 1 - depth if depth < size else None, -1)
+        return self._prices[side][levels], self._volumes[side][levels]
+
+    @property
+    def best_ask(self):
+        """The lowest ask price, nan if there are no asks."""
+        return float(self._prices[Side.ask][0]) if self._sizes[Side.ask] else np.nan
+
+    @property
+    def best_bid(self):
+        """The highest bid price, nan if there are no bids."""
+        size = self._sizes[Side.bid]
+        return float(self._prices[Side.bid][size - 1]) if size else np.nan
+
+    @property
+    def mid(self):
+        """The mid price, nan if either side is empty."""
+        return (self.best_ask + self.best_bid) / 2
+
+    @property
+    def spread(self):
+        """The best ask less the best bid, nan if either side is empty."""
+        return self.best_ask - self.best_bid
+
+    def top(self, depth):
+        """A copy of the book with at most `depth` levels per side."""
+        asks = self.levels(Side.ask, depth)
+        bids = self.levels(Side.bid, depth)
+        return LevelTwoBook(self.timestamp, asks=asks, bids=(bids[0][::-1], bids[1][::-1]))
+
+    def copy(self):
+        return self.top(None)
+
+    def to_frame(self, depth=None):
+        """Export the book in the format returned by `parse_level_two_book`.
+
+        Parameters
+        ----------
+        depth: int
+            Number of levels per side, None for all levels.
+        """
+        ask_prices, ask_volumes = self.levels(Side.ask, depth)
+        bid_prices, bid_volumes = self.levels(Side.bid, depth)
+        asks, bids = len(ask_prices), len(bid_prices)
+
+        return pd.DataFrame({
+            'timestamp': np.full(asks + bids, self.timestamp, dtype=np.int64),
+            'side': np.repeat(np.array([Side.ask.value, Side.bid.value], dtype=np.int64),
+                              [asks, bids]),
+            'level': np.concatenate([np.arange(1, asks + 1, dtype=np.int64),
+                                     np.arange(1, bids + 1, dtype=np.int64)]),
+            'price': np.concatenate([ask_prices, bid_prices]),
+            'volume': np.concatenate([ask_volumes, bid_volumes]),
+        }, columns=LEVEL_TWO_COLUMNS)
+
+    def __len__(self):
+        return self._sizes[Side.ask] + self._sizes[Side.bid]
+
+    def __eq__(self, other):
+        if not isinstance(other, LevelTwoBook):
+            return NotImplemented
+        return self.timestamp == other.timestamp and all(
+            np.array_equal(mine, theirs)
+            for side in (Side.ask, Side.bid)
+            for mine, theirs in zip(self.levels(side), other.levels(side)))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f'LevelTwoBook(timestamp={self.timestamp}, asks={self._sizes[Side.ask]}, '
+                f'bids={self._sizes[Side.bid]}, best_bid={self.best_bid}, '
+                f'best_ask={self.best_ask})')
+
+
+def diff_sides(previous, current, side):
+    """The prices whose volume changed on one side between two books and their new volumes.
+
+    Returns
+    -------
+    tuple(np.ndarray, np.ndarray)
+        Prices in ascending order and the volume in `current`, 0 where the level was removed.
+    """
+    previous_prices, previous_volumes = previous.levels(side)
+    current_prices, current_volumes = current.levels(side)
+    if side is Side.bid:
+        previous_prices, previous_volumes = previous_prices[::-1], previous_volumes[::-1]
+        current_prices, current_volumes = current_prices[::-1], current_volumes[::-1]
+
+    prices = np.union1d(previous_prices, current_prices)
+    before = _volumes_at(previous_prices, previous_volumes, prices)
+    after = _volumes_at(current_prices, current_volumes, prices)
+    changed = before != after
+    return prices[changed], after[changed]
+
+
+def _volumes_at(prices, volumes, at):
+    """The volumes at the ascending prices `at`, 0 where there is no level."""
+    if not len(prices):
+        return np.zeros(len(at), dtype=np.float64)
+    index = np.minimum(np.searchsorted(prices, at), len(prices) - 1)
+    return np.where(prices[index] == at, volumes[index], 0.0)
@@ -1,10 +1,16 @@
 """
 Loggers for locrian_collection
+
+The loggers are created without handlers so importing the package does not touch the file
+system; `configure_logging` adds the file and stream handlers when collection starts.
 """
 import logging
+import os
 
 from .constants import BASE_DATA_DIRECTORY
 
+LOG_FILE = f'{BASE_DATA_DIRECTORY}/locrian_collect.log'
+
 
 def get_logger(logger_file, log_name):
     """ Sets up the formatting for the h_logger to output to a file and returns the h_logger."""
@@ -30,9 +36,23 @@ def get_logger(logger_file, log_name):
     return h_logger
 
 
-logger_trades = get_logger(f'{BASE_DATA_DIRECTORY}/locrian_collect.log',
-                           log_name='locrian_collect_trades')
-logger_order_book = get_logger(f'{BASE_DATA_DIRECTORY}/locrian_collect.log',
-                               log_name='locrian_collect_order_book')
-logger_index = get_logger(f'{BASE_DATA_DIRECTORY}/locrian_collect.log',
-                          log_name='locrian_collect_index')
+def configure_logging(logger_file=LOG_FILE):
+    """Add the file and stream handlers to all of the package's loggers.
+
+    Parameters
+    ----------
+    logger_file: str
+        Path of the log file, its directory is created if needed.
+    """
+    os.makedirs(os.path.dirname(logger_file), exist_ok=True)
+    for logger in LOGGERS:
+        get_logger(logger_file, log_name=logger.name)
+
+
+logger_trades = logging.getLogger('locrian_collect_trades')
+logger_order_book = logging.getLogger('locrian_collect_order_book')
+logger_index = logging.getLogger('locrian_collect_index')
+logger_storage = logging.getLogger('locrian_collect_storage')
+logger_collector = logging.getLogger('locrian_collect_collector')
+
+LOGGERS = (logger_trades, logger_order_book, logger_index, logger_storage, logger_collector)
@@ -0,0 +1,212 @@
+"""
+Per-manager latency and throughput metrics.
+
+Managers record the time spent in each stage of a tick (HTTP request, parsing, database
+write), the rows written, errors and how late each request started after its tick.  The
+metrics can be served over HTTP on localhost, in the Prometheus text format at `/metrics` and
+as json at `/metrics.json`, or written to a json snapshot file periodically.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from threading import Thread, Lock, Event
+import time
+
+from .constants import METRICS_BUCKETS, METRICS_SNAPSHOT_INTERVAL
+from .logs import logger_storage
+
+
+class Histogram:
+    """Cumulative histogram of durations in seconds.
+
+    Parameters
+    ----------
+    buckets: tuple(float)
+        Sorted upper bounds of the buckets, an overflow bucket is added above the last one.
+    """
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Add a value to the histogram."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in, the largest value
+        seen for the overflow bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """Get the histogram as a dict of count, sum, max, mean, p50 and p99."""
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99)}
+
+
+class MetricsRegistry:
+    """Thread safe histograms, counters and gauges, grouped by manager (its mysql_table)."""
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def observe(self, manager, stage, seconds):
+        """Record the duration of a stage, e.g. 'http', 'parse', 'write' or 'tick_skew'."""
+        with self._lock:
+            histogram = self._histograms.get((manager, stage))
+            if histogram is None:
+                histogram = self._histograms[(manager, stage)] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, manager, counter, value=1):
+        """Add to a counter, e.g. 'requests', 'rows_written' or 'errors_timeout'."""
+        with self._lock:
+            self._counters[(manager, counter)] = self._counters.get((manager, counter), 0) + value
+
+    def set_gauge(self, manager, gauge, value):
+        """Set the current value of a gauge, e.g. 'queue_depth'."""
+        with self._lock:
+            self._gauges[(manager, gauge)] = value
+
+    @contextmanager
+    def timer(self, manager, stage):
+        """Context manager recording the time spent in the block as a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(manager, stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Get all metrics as
+        {manager: {'counters': {...}, 'gauges': {...}, 'stages': {stage: {...}}}}."""
+        with self._lock:
+            snapshot = {}
+            for (manager, counter), value in self._counters.items():
+                _manager_snapshot(snapshot, manager)['counters'][counter] = value
+            for (manager, gauge), value in self._gauges.items():
+                _manager_snapshot(snapshot, manager)['gauges'][gauge] = value
+            for (manager, stage), histogram in self._histograms.items():
+                _manager_snapshot(snapshot, manager)['stages'][stage] = histogram.snapshot()
+        return snapshot
+
+    def render_prometheus(self):
+        """Get all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for (manager, counter), value in sorted(self._counters.items()):
+                lines.append(f'locrian_{counter}_total{{manager="{manager}"}} {value}')
+            for (manager, gauge), value in sorted(self._gauges.items()):
+                lines.append(f'locrian_{gauge}{{manager="{manager}"}} {value}')
+            for (manager, stage), histogram in sorted(self._histograms.items()):
+                name = f'locrian_{stage}_seconds'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{manager="{manager}",le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_bucket{{manager="{manager}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{manager="{manager}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{manager="{manager}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_snapshot(self, path):
+        """Write the snapshot as json, replacing the file atomically."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(json.dumps({'time': time.time(), 'managers': self.snapshot()}))
+        os.replace(f'{path}.tmp', path)
+
+    def clear(self):
+        """Remove all metrics."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+
+def _manager_snapshot(snapshot, manager):
+    return snapshot.setdefault(manager, {'counters': {}, 'gauges': {}, 'stages': {}})
+
+
+METRICS = MetricsRegistry()
+
+
+def serve_metrics(port, host='127.0.0.1', registry=METRICS):
+    """Serve the metrics over HTTP from a daemon thread.
+
+    Parameters
+    ----------
+    port: int
+        Port to listen on, 0 picks a free port.
+    host: str
+        Address to bind, localhost by default.
+    registry: MetricsRegistry
+        The metrics to serve.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The running server, `shutdown` stops it.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path == '/metrics':
+                body, content_type = registry.render_prometheus(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(registry.snapshot()), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            body = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    Thread(target=server.serve_forever, name='locrian_metrics', daemon=True).start()
+    return server
+
+
+def start_snapshot_writer(path, interval=METRICS_SNAPSHOT_INTERVAL, registry=METRICS):
+    """Write a metrics snapshot to a file every `interval` seconds from a daemon thread.
+
+    Returns
+    -------
+    threading.Event
+        Set it to stop the writer.
+    """
+    stop = Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                registry.write_snapshot(path)
+            except OSError as exc:
+                logger_storage.warning(f'Could not write metrics snapshot: {exc!r}')
+
+    Thread(target=run, name='locrian_metrics_snapshot', daemon=True).start()
+    return stop
@@ -1,14 +1,22 @@
 """
 Parsing the level two book.
 """
+from itertools import chain
+
+import numpy as np
 import pandas as pd
 
 from .constants import ORDER_MAP, Side
 
+LEVEL_TWO_COLUMNS = ['timestamp', 'side', 'level', 'price', 'volume']
+
 
 def parse_level_two_book(timestamp, book):
     """Parse level two book from json returned by exchange to level two dataframe.
 
+    Each side is converted to arrays in one step rather than level by level.  The book passed
+    in is not modified.
+
     Parameters
     ----------
     timestamp: int
@@ -21,21 +29,51 @@ def parse_level_two_book(timestamp, book):
     pd.DataFame
         Level two book as a pandas dataframe.
     """
-    data = []
-    book.pop('timestamp', None)  # Ignore Timestamp returned in book.
-    for side in book:
-        try:
-            ordering = ORDER_MAP[Side[side]]
-        except KeyError as key_error:
-            print(side, book, timestamp)
-            raise KeyError(key_error)
-
-        levels = book[side][::ordering]
-        side_as_value = Side[side].value
-
-        for level_index, level in enumerate(levels, 1):
-            price = level[0]
-            volume = level[1]
-            data.append([timestamp, side_as_value, level_index, price, volume])
-
-    return pd.DataFrame(data, columns=['timestamp', 'side', 'level', 'price', 'volume'])
+    sides = []
+    levels = []
+    prices = []
+    volumes = []
+
+    for side_name, side_levels in book.items():
+        if side_name == 'timestamp':  # Ignore Timestamp returned in book.
+            continue
+
+        side = Side[side_name]
+        price, volume = _side_to_arrays(side_levels[::ORDER_MAP[side]])
+        sides.append(np.full(len(price), side.value, dtype=np.int64))
+        levels.append(np.arange(1, len(price) + 1, dtype=np.int64))
+        prices.append(price)
+        volumes.append(volume)
+
+    side_array = _concatenate(sides, np.int64)
+    return pd.DataFrame({
+        'timestamp': np.full(len(side_array), timestamp, dtype=np.int64),
+        'side': side_array,
+        'level': _concatenate(levels, np.int64),
+        'price': _concatenate(prices, np.float64),
+        'volume': _concatenate(volumes, np.float64),
+    }, columns=LEVEL_TWO_COLUMNS)
+
+
+def _side_to_arrays(side_levels):
+    """Convert the levels of one side, [[price, volume, ...], ...], to price and volume arrays.
+
+    Exchanges may return numbers or numeric strings and extra fields after the volume.
+    """
+    if not side_levels:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+
+    field_counts = set(map(len, side_levels))
+
+    if len(field_counts) == 1:
+        flat = np.array(list(chain.from_iterable(side_levels)), dtype=np.float64)
+        levels = flat.reshape(-1, field_counts.pop())
+    else:  # Levels with differing numbers of fields.
+        levels = np.array([level[:2] for level in side_levels], dtype=np.float64)
+    return levels[:, 0], levels[:, 1]
+
+
+def _concatenate(arrays, dtype):
+    if not arrays:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(arrays)
@@ -0,0 +1,314 @@
+"""
+Daily partitions and retention of the level two tables.
+
+Level two tables are partitioned by day on `timestamp`, with a catch-all `pmax` partition,
+so inserts go to a small partition and range scans only read the days they cover.
+`maintain_partitions`, run daily, keeps `days_ahead` empty partitions ahead of today and
+compacts the partitions older than each table's retention:
+
+    downsample  keep the first book of every `interval` seconds, `depth` levels per side, in
+                `{table}_compact` and drop the partition.
+    archive     move the partition to the local parquet archive, see archive.read_archive.
+    drop        drop the partition.
+    keep        keep every partition.
+
+Retention is configured per table by glob patterns, the first matching entry applies and keys
+it leaves out take their values from `DEFAULT_RETENTION`:
+
+    [["spot_btc", {"raw_days": 90}], ["future_*", {"action": "archive", "raw_days": 7}]]
+
+Delta tables cannot be downsampled without their keyframes, their partitions are dropped
+instead while the keyframe table is downsampled.
+"""
+from datetime import timedelta
+from fnmatch import fnmatch
+
+import numpy as np
+from sqlalchemy import text
+
+from .archive import ARCHIVE_DIRECTORY, HOUR_IN_NANOSECONDS, HourlyParquetWriter, pa
+from .bulk_insert import insert_frame
+from .constants import (
+    NANOSECOND_FACTOR, PARTITION_DAYS_AHEAD, RETENTION_RAW_DAYS, COMPACT_DEPTH, COMPACT_INTERVAL
+)
+from .engines import get_engine
+from .logs import logger_storage
+from .reader import iter_books
+from .schema import (  # noqa: F401  pylint: disable=unused-import
+    DAY_IN_NANOSECONDS, MAX_PARTITION, create_table, day_of, day_start, days_between,
+    partition_days, partition_definitions, partition_name, utc_today
+)
+
+RETENTION_ACTIONS = ('downsample', 'archive', 'drop', 'keep')
+DEFAULT_RETENTION = {'raw_days': RETENTION_RAW_DAYS, 'action': 'downsample',
+                     'depth': COMPACT_DEPTH, 'interval': COMPACT_INTERVAL}
+
+
+def check_retention(retention):
+    """Check retention entries, see the module docstring.
+
+    Raises
+    ------
+    ValueError
+        If an entry has unknown keys or values.
+    """
+    for pattern, policy in retention:
+        unknown = set(policy) - set(DEFAULT_RETENTION)
+        if unknown:
+            raise ValueError(f'Unknown retention keys {sorted(unknown)} for {pattern}')
+        policy = dict(DEFAULT_RETENTION, **policy)
+        if policy['action'] not in RETENTION_ACTIONS:
+            raise ValueError(f'Unknown retention action {policy["action"]} for {pattern}, '
+                             f'expected one of {RETENTION_ACTIONS}')
+        if not (policy['raw_days'] >= 1 and policy['depth'] >= 1 and policy['interval'] > 0):
+            raise ValueError(f'raw_days, depth and interval of {pattern} must be positive')
+
+
+def retention_policy(table, retention=()):
+    """Get the retention policy of a table from the first entry matching it."""
+    for pattern, policy in retention:
+        if fnmatch(table, pattern):
+            return dict(DEFAULT_RETENTION, **policy)
+    return dict(DEFAULT_RETENTION)
+
+
+def create_book_table(table, delta=False, today=None, days_ahead=PARTITION_DAYS_AHEAD,
+                      database_name='locrian_level_two', schema=None):
+    """Create a level two table partitioned by day, if it does not exist.
+
+    Parameters
+    ----------
+    table: str
+        Name of the table, e.g. spot_btc.
+    delta: bool
+        The table is a `{asset_name}_delta` table of the delta storage mode.
+    today: datetime.date
+        The current UTC day, defaults to today.
+    days_ahead: int
+        Number of days after today partitioned in advance.
+    database_name: str
+        The name of the database.
+    schema: dict
+        The `schema` section of the collector config, see schema.py.
+    """
+    today = today or utc_today()
+    create_table(table, 'delta' if delta else 'book', database_name, schema,
+                 days_between(today, today + timedelta(days=days_ahead)))
+
+
+def partition_table(table, today=None, days_ahead=PARTITION_DAYS_AHEAD,
+                    database_name='locrian_level_two'):
+    """Partition an existing unpartitioned table by day.  This rebuilds the table, which
+    is locked while it is copied.
+
+    Rows older than `PARTITION_HISTORY_DAYS` days share one partition, see
+    `schema.partition_days`.
+    """
+    today = today or utc_today()
+    engine = get_engine(database_name)
+    first = engine.execute(text(f'SELECT MIN(timestamp) FROM {table}')).fetchall()[0][0]
+    days, history = partition_days(None if first is None else int(first), today, days_ahead)
+
+    logger_storage.info(f'Partitioning {database_name}.{table} by day from {days[0]}')
+    engine.execute(text(
+        f'ALTER TABLE {table} PARTITION BY RANGE (timestamp) '
+        f'({partition_definitions(days, history)})'
+    ).execution_options(autocommit=True))
+
+
+def get_partitions(table, database_name='locrian_level_two'):
+    """Get the partitions of a table in order.
+
+    Returns
+    -------
+    list(tuple)
+        (name, less than) where less than is the exclusive upper bound of the partition's
+        timestamps, None for `pmax`.  Empty if the table is not partitioned.
+    """
+    rows = get_engine(database_name).execute(text(
+        f'SELECT partition_name, partition_description FROM information_schema.partitions '
+        f'WHERE table_schema = DATABASE() AND table_name = \'{table}\' '
+        f'AND partition_name IS NOT NULL ORDER BY partition_ordinal_position')).fetchall()
+    return [(name, None if description == 'MAXVALUE' else int(description))
+            for name, description in rows]
+
+
+def add_future_partitions(table, today=None, days_ahead=PARTITION_DAYS_AHEAD,
+                          database_name='locrian_level_two'):
+    """Split `pmax` so every day up to `days_ahead` days after today has a partition.
+
+    Returns
+    -------
+    list(str)
+        The names of the partitions added.
+    """
+    today = today or utc_today()
+    bounds = [less_than for _, less_than in get_partitions(table, database_name)
+              if less_than is not None]
+    if not bounds:
+        return []
+
+    # The first day not covered by a daily partition.
+    first_day = day_of(max(bounds))
+    days = days_between(first_day, today + timedelta(days=days_ahead))
+    if not days:
+        return []
+
+    get_engine(database_name).execute(text(
+        f'ALTER TABLE {table} REORGANIZE PARTITION {MAX_PARTITION} INTO '
+        f'({partition_definitions(days)})').execution_options(autocommit=True))
+    return [partition_name(day) for day in days]
+
+
+def downsample_books(books, interval, last_bucket=None):
+    """Keep the first book of every `interval` seconds.
+
+    Parameters
+    ----------
+    books: pd.DataFrame
+        Books in the format returned by `parse_level_two_book`, ordered by timestamp.
+    interval: float
+        Seconds per book kept.
+    last_bucket: int
+        The bucket of the last book kept from an earlier chunk of the same books.
+
+    Returns
+    -------
+    tuple(pd.DataFrame, int)
+        The books kept and the bucket of the last one.
+    """
+    if books.empty:
+        return books, last_bucket
+    timestamps = books['timestamp'].to_numpy()
+    buckets = timestamps // int(interval * NANOSECOND_FACTOR)
+    firsts = timestamps[np.r_[True, buckets[1:] != buckets[:-1]]]
+    firsts = firsts[firsts // int(interval * NANOSECOND_FACTOR) != last_bucket]
+    return books[np.isin(timestamps, firsts)], int(buckets[-1])
+
+
+def compact_partition(table, partition, start, end, policy, database_name='locrian_level_two',
+                      archive_directory=ARCHIVE_DIRECTORY, schema=None):
+    """Compact a partition as its retention policy says and drop it.
+
+    Parameters
+    ----------
+    table: str
+        Name of the table.
+    partition: str
+        Name of the partition.
+    start: int
+        The unix time in nanoseconds of the partition's first possible timestamp.
+    end: int
+        The partition's exclusive upper bound.
+    policy: dict
+        The table's retention policy.
+    database_name: str
+        The name of the database.
+    archive_directory: str
+        Root directory of the parquet archive, for the 'archive' action.
+    schema: dict
+        The `schema` section of the collector config, see schema.py.
+
+    Returns
+    -------
+    int
+        The number of rows kept in the compact table or archive.
+    """
+    engine = get_engine(database_name)
+    action = policy['action']
+    rows = 0
+
+    if action == 'downsample':
+        compact_table = f'{table}_compact'
+        create_table(compact_table, 'book', database_name, schema)
+        # Rows from an earlier, interrupted, compaction of the partition are replaced.
+        engine.execute(text(
+            f'DELETE FROM {compact_table} WHERE timestamp >= {start} AND timestamp < {end}'
+        ).execution_options(autocommit=True))
+        last_bucket = None
+        for books in iter_books(table, start, end, policy['depth'], database_name=database_name):
+            books, last_bucket = downsample_books(books, policy['interval'], last_bucket)
+            rows += insert_frame(engine, compact_table, books)
+
+    elif action == 'archive':
+        if pa is None:
+            raise ImportError('pyarrow is required for the parquet archive')
+        # Files are named after the partition, so an interrupted compaction is resumed by
+        # skipping the hours it finished and rewriting the hour it left unfinished.
+        writer = HourlyParquetWriter(f'{archive_directory}/{database_name}/{table}',
+                                     file_name=partition)
+        for books in iter_books(table, start, end, database_name=database_name):
+            hours = books['timestamp'].to_numpy() // HOUR_IN_NANOSECONDS
+            for hour in np.unique(hours):
+                hour_books = books[hours == hour]
+                timestamp = int(hour_books['timestamp'].iat[0])
+                if not writer.is_finished(timestamp):
+                    writer.append(hour_books, timestamp)
+            rows += len(books)
+        writer.close()
+
+    engine.execute(text(f'ALTER TABLE {table} DROP PARTITION {partition}')
+                   .execution_options(autocommit=True))
+    logger_storage.info(f'Compacted {database_name}.{table} partition {partition} by {action}, '
+                        f'{rows} rows kept')
+    return rows
+
+
+def maintain_partitions(tables, retention=(), today=None, days_ahead=PARTITION_DAYS_AHEAD,
+                        database_name='locrian_level_two', archive_directory=ARCHIVE_DIRECTORY,
+                        schema=None):
+    """Add the future partitions of the tables and compact the partitions past retention.
+
+    Parameters
+    ----------
+    tables: iterable
+        Names of the level two tables, unpartitioned tables are skipped.
+    retention: iterable
+        (pattern, policy) entries, see the module docstring.
+    today: datetime.date
+        The current UTC day, defaults to today.
+    days_ahead: int
+        Number of days after today partitioned in advance.
+    database_name: str
+        The name of the database.
+    archive_directory: str
+        Root directory of the parquet archive, for the 'archive' action.
+    schema: dict
+        The `schema` section of the collector config, for the tables of the 'downsample'
+        action.
+
+    Returns
+    -------
+    list(tuple)
+        (table, partition, action) of every partition added or compacted.
+    """
+    today = today or utc_today()
+    actions = []
+
+    for table in tables:
+        partitions = get_partitions(table, database_name)
+        if not partitions:
+            logger_storage.warning(f'{database_name}.{table} is not partitioned, see '
+                                   f'partitions.partition_table')
+            continue
+
+        actions += [(table, name, 'add') for name in
+                    add_future_partitions(table, today, days_ahead, database_name)]
+
+        policy = retention_policy(table, retention)
+        if policy['action'] == 'keep':
+            continue
+        if table.endswith('_delta'):
+            policy['action'] = 'drop'
+
+        cutoff = day_start(today - timedelta(days=policy['raw_days']))
+        start = 0
+        for name, less_than in partitions:
+            if less_than is None or less_than > cutoff:
+                break
+            compact_partition(table, name, start, less_than, policy, database_name,
+                              archive_directory, schema)
+            actions.append((table, name, policy['action']))
+            start = less_than
+
+    return actions
@@ -0,0 +1,161 @@
+"""
+Token bucket rate limiters, one per exchange host.
+
+Each bucket allows `rate` requests per second with bursts of up to `capacity` requests.  When
+the exchange answers with HTTP 429 the bucket pauses for the `Retry-After` time and halves
+its rate, which then recovers a little with every successful request.
+"""
+from threading import Lock
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from .constants import (
+    HOST_RATE_LIMITS, DEFAULT_HOST_RATE_LIMIT, RATE_LIMIT_BURST, RATE_LIMIT_BACKOFF,
+    RATE_LIMIT_RECOVERY
+)
+
+_LIMITERS = {}
+_LIMITERS_LOCK = Lock()
+_RATE_SHARE = 1.0
+
+
+class RateLimited(requests.HTTPError):
+    """The exchange rejected a request for exceeding its rate limits.
+
+    Parameters
+    ----------
+    url: str
+        The url requested.
+    retry_after: float
+        Seconds to wait before the next request, from the `Retry-After` header, or None.
+    """
+    def __init__(self, url, retry_after=None):
+        super().__init__(f'Rate limited by {urlsplit(url).netloc}, retry after {retry_after}')
+        self.url = url
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a `Retry-After` header, None if missing or not a number."""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket with a rate that backs off when the exchange limits requests.
+
+    Parameters
+    ----------
+    rate: float
+        Requests per second allowed.
+    capacity: float
+        Maximum number of requests in a burst.
+    min_rate: float
+        Lowest rate the bucket backs off to, defaults to 1/16 of `rate`.
+    """
+    def __init__(self, rate, capacity=RATE_LIMIT_BURST, min_rate=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate or rate / 16
+        self.tokens = capacity
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def try_acquire(self):
+        """Take a token if one is available.
+
+        Returns
+        -------
+        float
+            0 if a token was taken, otherwise the seconds until one is available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        """Wait for a token.
+
+        Parameters
+        ----------
+        timeout: float
+            Maximum seconds to wait, None to wait until a token is available.
+
+        Returns
+        -------
+        bool
+            False if no token was available within `timeout`.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            if end is not None and time.monotonic() + wait > end:
+                return False
+            time.sleep(wait)
+
+    def back_off(self, retry_after=None):
+        """Pause requests and halve the rate after the exchange limited a request.
+
+        Parameters
+        ----------
+        retry_after: float
+            Seconds to pause, defaults to `RATE_LIMIT_BACKOFF`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.rate / 2, self.min_rate)
+            self.tokens = 0
+            pause = RATE_LIMIT_BACKOFF if retry_after is None else retry_after
+            self.paused_until = max(self.paused_until, now + pause)
+
+    def on_success(self):
+        """Recover the rate by a fraction of the maximum rate after a successful request."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.rate + self.max_rate * RATE_LIMIT_RECOVERY, self.max_rate)
+
+    def _refill(self, now):
+        self.tokens = min(self.tokens + (now - self._updated) * self.rate, self.capacity)
+        self._updated = now
+
+
+def get_rate_limiter(url):
+    """Get the token bucket of the host of a url, creating it on first use with the host's
+    rate from `HOST_RATE_LIMITS`, scaled by the process's share set by `set_rate_limit_share`."""
+    host = urlsplit(url).netloc
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(host)
+        if limiter is None:
+            rate = HOST_RATE_LIMITS.get(host, DEFAULT_HOST_RATE_LIMIT)
+            limiter = TokenBucket(rate * _RATE_SHARE)
+            _LIMITERS[host] = limiter
+        return limiter
+
+
+def set_rate_limit_share(share):
+    """Set the share of each host's rate limit used by this process, e.g. 1 / number of
+    processes collecting from the same hosts.  Limiters are recreated at the new rate."""
+    global _RATE_SHARE  # pylint: disable=global-statement
+    with _LIMITERS_LOCK:
+        _RATE_SHARE = share
+        _LIMITERS.clear()
+
+
+def reset_rate_limiters():
+    """Remove all rate limiters, they are recreated at their configured rates."""
+    set_rate_limit_share(1.0)
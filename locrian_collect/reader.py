@@ -0,0 +1,282 @@
+"""
+Read the stored books, trades and futures indexes back over a time range.
+
+Rows are streamed from the database with a server side cursor and converted to data frames
+`chunksize` rows at a time, so a day of books is never held as python rows.  The `iter_*`
+functions yield the chunks, the `get_*` functions concatenate them into one frame of compact
+dtypes.  Times are unix nanoseconds or anything `pd.Timestamp` accepts, naive times are UTC,
+and ranges include `start` and exclude `end`.
+
+Range scans need the time indexes created by `ensure_indexes`, without them every query reads
+the whole table.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from .constants import CURRENCY_LIST, CONTRACT_LIST, READ_CHUNK_SIZE
+from .data_managers import TRADES_COLUMNS
+from .engines import get_engine
+from .logs import logger_storage
+from .parse_level_two_book import LEVEL_TWO_COLUMNS
+
+INDEX_COLUMNS = ['unixRequestTime', 'unixReturnTime', 'future_index']
+
+# Indexes by kind of table, (name, columns).  Queries filter on the first column.
+TABLE_INDEXES = {
+    'book': [('ix_timestamp_side_level', ('timestamp', 'side', 'level'))],
+    'delta': [('ix_timestamp_side_price', ('timestamp', 'side', 'price'))],
+    'trades': [('ix_trade_time_tid', ('trade_time', 'tid'))],
+    'index': [('ix_unix_request_time', ('unixRequestTime',))],
+}
+# Primary keys of the tables created by schema.py, which make the indexes on the same columns
+# redundant.
+PRIMARY_KEYS = {'book': ('timestamp', 'side', 'level'), 'delta': ('timestamp', 'side', 'price'),
+                'trades': ('tid',), 'index': ('unixRequestTime',)}
+
+BOOK_DTYPES = {'timestamp': np.int64, 'side': np.int8, 'level': np.int16, 'price': np.float64,
+               'volume': np.float64}
+TRADES_DTYPES = {'unixRequestTime': np.int64, 'unixReturnTime': np.int64,
+                 'trade_time': np.int64, 'amount': np.float64, 'price': np.float64,
+                 'side': 'category', 'tid': np.int64}
+INDEX_DTYPES = {'unixRequestTime': np.int64, 'unixReturnTime': np.int64,
+                'future_index': np.float64}
+
+_TABLE_NAME = re.compile(r'^[A-Za-z0-9_]+$')
+
+
+def collected_tables(currencies=CURRENCY_LIST, contracts=CONTRACT_LIST, delta=False):
+    """Get the tables written by the managers of `data_managers.get_managers` and
+    `get_trades_managers`, by database.
+
+    Parameters
+    ----------
+    currencies: iterable
+        Currencies collected.
+    contracts: iterable
+        Futures contract aliases collected.
+    delta: bool
+        Include the `{table}_delta` tables of the delta storage mode.
+
+    Returns
+    -------
+    dict
+        {database: [(table, kind), ...]} where kind is a key of `TABLE_INDEXES`.
+    """
+    books = [f'spot_{currency}' for currency in currencies]
+    books += [f'future_{currency}_{contract}'
+              for currency in currencies for contract in contracts]
+    trades = [f'trades_spot_{currency}' for currency in currencies]
+    trades += [f'trades_future_{contract}_{currency}'
+               for currency in currencies for contract in contracts]
+
+    tables = {
+        'locrian_level_two': [(table, 'book') for table in books],
+        'locrian_trades': [(table, 'trades') for table in trades],
+        'locrian_future_index': [(f'future_index_{currency}_usd', 'index')
+                                 for currency in currencies],
+    }
+    if delta:
+        tables['locrian_level_two'] += [(f'{table}_delta', 'delta') for table in books]
+    return tables
+
+
+def ensure_indexes(tables=None):
+    """Create the time indexes of `TABLE_INDEXES` missing from existing tables.  Tables
+created by schema.py only lack them if they have no primary key.
+
+    Parameters
+    ----------
+    tables: dict
+        {database: [(table, kind), ...]}, defaults to `collected_tables()`.
+
+    Returns
+    -------
+    list(tuple)
+        (database, table, index) of the indexes created.
+    """
+    tables = collected_tables() if tables is None else tables
+    created = []
+
+    for database_name, database_tables in tables.items():
+        engine = get_engine(database_name)
+        existing = _existing_indexes(engine)
+
+        for table, kind in database_tables:
+            if table not in existing:
+                continue
+            for name, columns in TABLE_INDEXES[kind]:
+                if name in existing[table] or (
+                        'PRIMARY' in existing[table] and columns == PRIMARY_KEYS[kind]):
+                    continue
+                logger_storage.info(f'Creating index {name} on {database_name}.{table}')
+                engine.execute(text(
+                    f'CREATE INDEX {name} ON {_check_table(table)} ({", ".join(columns)})'
+                ).execution_options(autocommit=True))
+                created.append((database_name, table, name))
+
+    return created
+
+
+def _existing_indexes(engine):
+    """Get the names of the indexes of every table in the engine's database, by table."""
+    indexes = {}
+    for table, index in engine.execute(text(
+            'SELECT tables.table_name, statistics.index_name '
+            'FROM information_schema.tables AS tables '
+            'LEFT JOIN information_schema.statistics AS statistics '
+            'ON statistics.table_schema = tables.table_schema '
+            'AND statistics.table_name = tables.table_name '
+            'WHERE tables.table_schema = DATABASE()')).fetchall():
+        indexes.setdefault(table, set())
+        if index is not None:
+            indexes[table].add(index)
+    return indexes
+
+
+def iter_books(asset_name, start, end, depth=None, chunksize=READ_CHUNK_SIZE,
+               database_name='locrian_level_two'):
+    """Stream the level two books of an asset over a time range.
+
+    Parameters
+    ----------
+    asset_name: str
+        Name of the level two table, e.g. spot_btc or future_btc_quarter.
+    start: int or str or pd.Timestamp
+        Start of the range, inclusive.
+    end: int or str or pd.Timestamp
+        End of the range, exclusive.
+    depth: int
+        Number of levels per side, None for every level saved.
+    chunksize: int
+        Approximate number of rows per chunk.
+    database_name: str
+        The name of the database.
+
+    Yields
+    ------
+    pd.DataFrame
+        Whole books in the format returned by `parse_level_two_book`, ordered by timestamp,
+        side and level.  A book is never split across chunks.
+    """
+    query = (f'SELECT {", ".join(LEVEL_TWO_COLUMNS)} FROM {_check_table(asset_name)} '
+             f'WHERE timestamp >= {to_nanoseconds(start)} AND timestamp < {to_nanoseconds(end)}')
+    if depth is not None:
+        query += f' AND level <= {int(depth)}'
+    query += ' ORDER BY timestamp, side, level'
+
+    carry = None
+    for chunk in _read_chunks(database_name, query, chunksize, BOOK_DTYPES):
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        # The last book may continue in the next chunk.
+        last = chunk['timestamp'].to_numpy() == chunk['timestamp'].iat[-1]
+        carry = chunk[last]
+        if not last.all():
+            yield chunk[~last].reset_index(drop=True)
+    if carry is not None and len(carry):
+        yield carry.reset_index(drop=True)
+
+
+def get_books(asset_name, start, end, depth=None, chunksize=READ_CHUNK_SIZE,
+              database_name='locrian_level_two'):
+    """Read the level two books of an asset over a time range, see `iter_books`.
+
+    Returns
+    -------
+    pd.DataFrame
+        The books in the format returned by `parse_level_two_book` with compact dtypes.
+    """
+    return _concatenate(iter_books(asset_name, start, end, depth, chunksize, database_name),
+                        BOOK_DTYPES)
+
+
+def iter_trades(table, start, end, chunksize=READ_CHUNK_SIZE, database_name='locrian_trades'):
+    """Stream the trades of a table with a `trade_time` in a time range.
+
+    Parameters
+    ----------
+    table: str
+        Name of the trades table, e.g. trades_spot_btc.
+    start: int or str or pd.Timestamp
+        Start of the range, inclusive.
+    end: int or str or pd.Timestamp
+        End of the range, exclusive.
+    chunksize: int
+        Number of rows per chunk.
+    database_name: str
+        The name of the database.
+
+    Yields
+    ------
+    pd.DataFrame
+        Trades with the columns `TRADES_COLUMNS` ordered by `trade_time` and `tid`.
+    """
+    query = (f'SELECT {", ".join(TRADES_COLUMNS)} FROM {_check_table(table)} '
+             f'WHERE trade_time >= {to_nanoseconds(start)} '
+             f'AND trade_time < {to_nanoseconds(end)} ORDER BY trade_time, tid')
+    yield from _read_chunks(database_name, query, chunksize, TRADES_DTYPES)
+
+
+def get_trades(table, start, end, chunksize=READ_CHUNK_SIZE, database_name='locrian_trades'):
+    """Read the trades of a table with a `trade_time` in a time range, see `iter_trades`."""
+    return _concatenate(iter_trades(table, start, end, chunksize, database_name),
+                        TRADES_DTYPES)
+
+
+def iter_index(table, start, end, chunksize=READ_CHUNK_SIZE,
+               database_name='locrian_future_index'):
+    """Stream the futures index of a table requested in a time range, see `iter_trades`.
+
+    Yields
+    ------
+    pd.DataFrame
+        Rows with the columns `INDEX_COLUMNS` ordered by `unixRequestTime`.
+    """
+    query = (f'SELECT {", ".join(INDEX_COLUMNS)} FROM {_check_table(table)} '
+             f'WHERE unixRequestTime >= {to_nanoseconds(start)} '
+             f'AND unixRequestTime < {to_nanoseconds(end)} ORDER BY unixRequestTime')
+    yield from _read_chunks(database_name, query, chunksize, INDEX_DTYPES)
+
+
+def get_index(table, start, end, chunksize=READ_CHUNK_SIZE,
+              database_name='locrian_future_index'):
+    """Read the futures index of a table requested in a time range, see `iter_index`."""
+    return _concatenate(iter_index(table, start, end, chunksize, database_name), INDEX_DTYPES)
+
+
+def to_nanoseconds(value):
+    """Convert unix nanoseconds or anything `pd.Timestamp` accepts to unix nanoseconds."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return int(timestamp.value)
+
+
+def _read_chunks(database_name, query, chunksize, dtypes):
+    """Run a query with a server side cursor and yield its rows as data frames."""
+    with get_engine(database_name).connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        for chunk in pd.read_sql(text(query), connection, chunksize=chunksize):
+            yield chunk.astype(dtypes)
+
+
+def _concatenate(chunks, dtypes):
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
+    # Concatenating categoricals with different categories would fall back to object.
+    return pd.concat(chunks, ignore_index=True).astype(dtypes)
+
+
+def _check_table(table):
+    """Table names are interpolated into the queries, so only allow plain identifiers."""
+    if not _TABLE_NAME.match(table):
+        raise ValueError(f'Invalid table name {table!r}')
+    return table
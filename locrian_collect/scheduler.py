@@ -1,36 +1,137 @@
 """
 Schedule the collection of data.
 """
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+import heapq
+import itertools
 import time
-from threading import Thread
+from urllib.parse import urlsplit
 
-from .logs import logger_trades, logger_order_book
-from .data_managers import get_trades_managers, get_managers
+from .logs import logger_trades, logger_order_book, configure_logging
+from .data_managers import get_trades_managers, get_managers, update_contract_urls
+from .instruments import get_instrument_registry
+from .rate_limit import get_rate_limiter
+from .engines import dispose_engines
+from .sessions import close_sessions
+from .spool import WriteAheadSpool
+from .write_behind import WriteBehindWriter
 
 
-def schedule_get_order_book_and_index_data():
-    """Schedule the recording of order book and index data."""
+SCHEDULER_MODES = ('thread', 'async', 'rate_limited')
+
+
+def schedule_get_order_book_and_index_data(mode='thread', sinks=(), write_behind=False,
+                                           schedule=(), spool=None):
+    """Schedule the recording of order book and index data.
+
+    Parameters
+    ----------
+    mode: str
+        Either 'thread' or 'async', see `get_scheduler`.
+    sinks: iterable
+        Additional sinks written to after MySQL, e.g. archive.ParquetSink.
+    write_behind: bool
+        Queue the database writes on a write_behind.WriteBehindWriter instead of writing
+        from the manager's thread.
+    schedule: iterable
+        Per manager intervals and priorities for the 'rate_limited' mode, see `apply_schedule`.
+    spool: str
+        Directory of a write-ahead spool the records are written through, see `attach_outputs`.
+    """
+    configure_logging()
     db_managers = get_managers()
+    apply_schedule(db_managers, schedule)
+    attach_outputs(db_managers, sinks, write_behind, spool)
+    follow_contract_rolls(db_managers)
     logger = logger_order_book
     time_between_requests = 10  # seconds
     offset = 0.001
     log_msg = 'Requesting order book and futures index.'
-    scheduler(db_managers, logger, time_between_requests, offset, log_msg)
+    get_scheduler(mode)(db_managers, logger, time_between_requests, offset, log_msg)
+
 
+def schedule_get_trades(mode='thread', sinks=(), write_behind=False, schedule=(), spool=None):
+    """Schedule the recording of trade data.
 
-def schedule_get_trades():
-    """Schedule the recording of trade data."""
+    Parameters
+    ----------
+    mode: str
+        Either 'thread' or 'async', see `get_scheduler`.
+    sinks: iterable
+        Additional sinks written to after MySQL, e.g. archive.ParquetSink.
+    write_behind: bool
+        Queue the database writes on a write_behind.WriteBehindWriter instead of writing
+        from the manager's thread.
+    schedule: iterable
+        Per manager intervals and priorities for the 'rate_limited' mode, see `apply_schedule`.
+    spool: str
+        Directory of a write-ahead spool the records are written through, see `attach_outputs`.
+    """
+    configure_logging()
     db_managers = get_trades_managers()
+    apply_schedule(db_managers, schedule)
+    attach_outputs(db_managers, sinks, write_behind, spool)
+    follow_contract_rolls(db_managers)
     logger = logger_trades
-    time_between_requests = 100  # seconds
+    time_between_requests = 30  # seconds
     offset = 0.1
     log_msg = 'Requesting trades.'
-    scheduler(db_managers, logger, time_between_requests, offset, log_msg)
+    get_scheduler(mode)(db_managers, logger, time_between_requests, offset, log_msg)
+
 
+def follow_contract_rolls(db_managers, registry=None):
+    """Update the urls of the managers following futures contracts whenever the instrument
+    registry's background refresh sees the contracts roll.
+
+    Parameters
+    ----------
+    db_managers: list
+        List of data managers, see data_managers module.
+    registry: instruments.InstrumentRegistry
+        Defaults to the process wide registry.
+    """
+    registry = registry or get_instrument_registry()
+    registry.add_listener(lambda mapping: update_contract_urls(db_managers, mapping))
+    registry.start_background_refresh()
 
-def scheduler(db_managers, logger, time_between_requests, offset, log_msg):
+
+def get_scheduler(mode):
+    """Get the scheduler function for a mode.
+
+    Parameters
+    ----------
+    mode: str
+        'thread' runs the managers on a pool of worker threads, 'async' drives all managers
+        from one asyncio event loop with a shared HTTP client and 'rate_limited' runs each
+        manager at its own interval, spread over the interval and limited per host by a
+        token bucket.
+
+    Returns
+    -------
+    callable
+        Scheduler with the signature of `scheduler`.
+    """
+    if mode == 'thread':
+        return scheduler
+    if mode == 'async':
+        from .async_scheduler import run_async_scheduler  # pylint: disable=import-outside-toplevel
+        return run_async_scheduler
+    if mode == 'rate_limited':
+        return rate_limited_scheduler
+    raise ValueError(f'Unknown scheduler mode {mode}, expected one of {SCHEDULER_MODES}')
+
+
+def scheduler(db_managers, logger, time_between_requests, offset, log_msg, task_timeout=None,
+              skip_late=True, max_workers=None):
     """Schedule the recording of data (order book, index or trades).
 
+    Managers run on a pool of long lived worker threads.  Each tick waits at most
+    `task_timeout` for the managers, so a hung request does not delay the next tick.  Managers
+    with their own interval, e.g. from the collector config, run on the first tick at or after
+    each of their turns, see `due_managers`; the others run every tick.
+
     Parameters
     ----------
     db_managers: list
@@ -45,6 +146,14 @@ def scheduler(db_managers, logger, time_between_requests, offset, log_msg):
         data will be recorded at 0.1, 10.1, 20.1 ... seconds.
     log_msg: str
         Message to display each time data is requested.
+    task_timeout: float
+        Seconds to wait for the managers each tick, defaults to 80% of
+        `time_between_requests`.
+    skip_late: bool
+        If True a manager still running from a previous tick skips this tick, otherwise
+        another request is made alongside the running one on a spare worker.
+    max_workers: int
+        Number of worker threads, defaults to twice the number of managers.
 
     """
     num_managers = len(db_managers)
@@ -53,21 +162,348 @@ def scheduler(db_managers, logger, time_between_requests, offset, log_msg):
         raise ValueError("Number of requests per second exceeds Okcoin's "
                          "limits (1 request every 0.1 seconds)")
 
-    while True:
-        time.sleep(delta_time_to_sleep(interval=time_between_requests, offset=offset))
-        logger.info(log_msg)
-        thread_list = []
+    if task_timeout is None:
+        task_timeout = 0.8 * time_between_requests
+
+    for manager in db_managers:
+        manager.interval = manager.interval or time_between_requests
+        manager.phase = offset
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or 2 * max(num_managers, 1),
+                                  thread_name_prefix='locrian_collect')
+    in_flight = {}
+
+    try:
+        while True:
+            time.sleep(delta_time_to_sleep(interval=time_between_requests, offset=offset))
+            logger.info(log_msg)
+            run_tick(due_managers(db_managers, time.time(), time_between_requests), executor,
+                     in_flight, logger, task_timeout, skip_late)
+    finally:
+        executor.shutdown(wait=False)
+        close_outputs(db_managers)
+        close_sessions()
+        dispose_engines()
+
+
+def due_managers(db_managers, now, time_between_requests):
+    """Get the managers with a turn, at `phase + k * interval` seconds of unix time, since the
+    previous tick.  Managers with an interval shorter than the ticks run every tick.
+
+    Parameters
+    ----------
+    db_managers: list
+        Managers with their `interval` and `phase` set.
+    now: float
+        The unix time in seconds of the tick.
+    time_between_requests: float
+        Seconds between the ticks.
+
+    Returns
+    -------
+    list
+        The managers to run this tick.
+    """
+    return [manager for manager in db_managers
+            if (now - manager.phase) % manager.interval < time_between_requests]
+
+
+def run_tick(db_managers, executor, in_flight, logger, task_timeout, skip_late=True):
+    """Run `get_data` for each manager on the executor and report the tick's timings.
+
+    Parameters
+    ----------
+    db_managers: list
+        List of data managers, see data_managers module.
+    executor: concurrent.futures.Executor
+        The worker pool.
+    in_flight: dict
+        Maps each manager to the future of its last submitted task, updated in place.
+    logger:
+        logger object for logging info and warnings.
+    task_timeout: float
+        Seconds to wait for the managers to finish.
+    skip_late: bool
+        If True a manager still running from a previous tick is skipped.
+
+    Returns
+    -------
+    tuple
+        (wall time of the tick in seconds, mysql_table of the slowest manager, its time in
+        seconds).  Managers that did not finish count as taking `task_timeout`.
+    """
+    tick_start = time.time()
+    futures = {}
+
+    for manager in db_managers:
+        previous = in_flight.get(manager)
+        if skip_late and previous is not None and not previous.done():
+            logger.warning(f'Skipping {manager.mysql_table}, previous request still running.')
+            continue
+        future = executor.submit(_timed_get_data, manager)
+        futures[future] = manager
+        in_flight[manager] = future
+
+    done, not_done = wait(futures, timeout=task_timeout)
+    durations = {}
+
+    for future in done:
+        manager = futures[future]
+        if future.exception() is not None:
+            logger.warning(f'Error {manager.mysql_table}: {future.exception()!r}')
+        else:
+            durations[manager.mysql_table] = future.result()
+
+    for future in not_done:
+        manager = futures[future]
+        logger.warning(f'{manager.mysql_table} did not finish within {task_timeout:.3f}s')
+        durations[manager.mysql_table] = task_timeout
+
+    wall_time = time.time() - tick_start
+    slowest_table, slowest_time = max(durations.items(), key=lambda item: item[1],
+                                      default=(None, 0.0))
+    logger.info(f'Tick took {wall_time:.3f}s, slowest {slowest_table} {slowest_time:.3f}s')
+    return wall_time, slowest_table, slowest_time
+
+
+def apply_schedule(db_managers, schedule):
+    """Set the interval and priority of the managers matching a schedule.
+
+    Parameters
+    ----------
+    db_managers: list
+        List of data managers, see data_managers module.
+    schedule: iterable
+        (pattern, interval, priority) entries, the first entry whose glob pattern matches a
+        manager's mysql_table applies, e.g. [('spot_btc_*', 2, 10), ('*quarter*', 30, 0)].
+        Managers not matched keep the interval they are given by the scheduler.
+    """
+    schedule = list(schedule)
+    for manager in db_managers:
+        for pattern, interval, priority in schedule:
+            if fnmatch(manager.mysql_table, pattern):
+                manager.interval = interval
+                manager.priority = priority
+                break
+
+
+def rate_limited_scheduler(db_managers, logger, time_between_requests, offset, log_msg,
+                           max_workers=None, spread=True, on_turn=None):
+    """Schedule the recording of data with each manager at its own interval.
+
+    Managers sharing an interval are spread evenly across it, rather than all requesting at
+    the start of the tick, and every request takes a token from its host's rate limiter.
+    When the exchange limits requests the host's managers are delayed, highest priority
+    first, and skip their turn rather than fall behind by more than an interval.
+
+    Parameters
+    ----------
+    db_managers: list
+        List of data managers, see data_managers module.
+    logger:
+        logger object for logging info and warnings.
+    time_between_requests: float
+        Interval of the managers without one from `apply_schedule`.
+    offset: float
+        Offset of the first request of each interval.
+    log_msg: str
+        Message displayed when the scheduler starts.
+    max_workers: int
+        Number of worker threads, defaults to twice the number of managers.
+    spread: bool
+        Spread the managers with `spread_phases`, False if their phases are already set.
+    on_turn: callable
+        Called with the manager from its worker thread each time a manager finishes a turn.
+    """
+    for manager in db_managers:
+        manager.interval = manager.interval or time_between_requests
+    if spread:
+        spread_phases(db_managers, offset)
+
+    _warn_over_rate_limit(db_managers, logger)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or 2 * max(len(db_managers), 1),
+                                  thread_name_prefix='locrian_collect')
+    queue = initial_schedule(db_managers, time.time())
+    in_flight = {}
+    logger.info(log_msg)
+
+    try:
+        while True:
+            time.sleep(max(queue[0][0] - time.time(), 0))
+            dispatch_due(queue, executor, in_flight, logger, time.time(), on_turn)
+    finally:
+        executor.shutdown(wait=False)
+        close_outputs(db_managers)
+        close_sessions()
+        dispose_engines()
+
+
+_SEQUENCE = itertools.count()
+
+
+def spread_phases(db_managers, offset):
+    """Set the phase of the managers, spreading the managers that share an interval evenly
+    across it, highest priority first.  The phases only depend on the order of the managers,
+    so processes given the same managers agree on them.
+
+    Parameters
+    ----------
+    db_managers: list
+        Managers with their `interval` set.
+    offset: float
+        Offset in seconds of the first manager of each interval.
+    """
+    by_interval = {}
+    for manager in sorted(db_managers, key=lambda manager: -manager.priority):
+        by_interval.setdefault(manager.interval, []).append(manager)
+
+    for interval, managers in by_interval.items():
+        for i, manager in enumerate(managers):
+            manager.phase = offset + i * interval / len(managers)
+
+
+def initial_schedule(db_managers, now):
+    """Build the queue of the managers' first requests, each on its grid of turns at
+    `phase + k * interval` seconds of unix time.
+
+    Parameters
+    ----------
+    db_managers: list
+        Managers with their `interval` and `phase` set.
+    now: float
+        The current unix time in seconds.
+
+    Returns
+    -------
+    list
+        Heap of [due time, -priority, sequence, manager] entries.
+    """
+    queue = []
+    for manager in db_managers:
+        due = now - (now - manager.phase) % manager.interval + manager.interval
+        queue.append([due, -manager.priority, next(_SEQUENCE), manager])
+    heapq.heapify(queue)
+    return queue
+
+
+def dispatch_due(queue, executor, in_flight, logger, now, on_turn=None):
+    """Submit the managers that are due, highest priority first, to the executor.
+
+    A manager still running from its previous turn skips this turn.  A manager whose host
+    has no rate limit token is retried once one is available, or skips this turn if that is
+    after its next turn.  Managers not making REST requests, such as streaming managers, take
+    no token.
+
+    Parameters
+    ----------
+    queue: list
+        Heap built by `initial_schedule`, updated in place.
+    executor: concurrent.futures.Executor
+        The worker pool.
+    in_flight: dict
+        Maps each manager to the future of its last submitted task, updated in place.
+    logger:
+        logger object for logging info and warnings.
+    now: float
+        The current unix time in seconds.
+    on_turn: callable
+        Called with the manager each time a submitted manager finishes, see
+        `rate_limited_scheduler`.
+    """
+    while queue and queue[0][0] <= now:
+        due, priority, _, manager = heapq.heappop(queue)
+        next_due = _next_due(due, manager.interval, now)
+
+        previous = in_flight.get(manager)
+        if previous is not None and not previous.done():
+            logger.warning(f'Skipping {manager.mysql_table}, previous request still running.')
+        else:
+            delay = get_rate_limiter(manager.url).try_acquire() if manager.uses_rest else 0
+            if not delay:
+                future = executor.submit(manager.get_data)
+                future.add_done_callback(lambda future, manager=manager:
+                                         _log_exception(future, manager, logger))
+                if on_turn is not None:
+                    future.add_done_callback(lambda future, manager=manager: on_turn(manager))
+                in_flight[manager] = future
+            elif now + delay < next_due:
+                heapq.heappush(queue, [now + delay, priority, next(_SEQUENCE), manager])
+                continue
+            else:
+                logger.warning(f'Skipping {manager.mysql_table}, rate limited.')
+
+        heapq.heappush(queue, [next_due, priority, next(_SEQUENCE), manager])
+
+
+def _next_due(due, interval, now):
+    """The first turn after `now` on the manager's grid of turns."""
+    return due + interval * ((now - due) // interval + 1)
+
+
+def _log_exception(future, manager, logger):
+    if future.exception() is not None:
+        logger.warning(f'Error {manager.mysql_table}: {future.exception()!r}')
+
+
+def _warn_over_rate_limit(db_managers, logger):
+    """Warn when the managers of a host request more often than its rate limit allows."""
+    demand = Counter()
+    for manager in db_managers:
+        if manager.uses_rest:
+            demand[urlsplit(manager.url).netloc] += 1 / manager.interval
+    for host, rate in demand.items():
+        limit = get_rate_limiter(f'https://{host}').max_rate
+        if rate > limit:
+            logger.warning(f'Managers request {host} {rate:.2f} times per second, above its '
+                           f'limit of {limit}, some requests will be skipped.')
+
+
+def attach_outputs(db_managers, sinks=(), write_behind=False, spool=None):
+    """Give the managers additional sinks, a shared write-behind writer and a shared spool.
+
+    Parameters
+    ----------
+    db_managers: list
+        List of data managers, see data_managers module.
+    sinks: iterable
+        Additional sinks written to after MySQL, e.g. archive.ParquetSink.
+    write_behind: bool
+        If True the managers share a started write_behind.WriteBehindWriter.
+    spool: str
+        Directory of a spool.WriteAheadSpool the managers append their records to, which
+        then writes them to the database.  None to write to the database directly.
+    """
+    writer = WriteBehindWriter().start() if write_behind else None
+    spool = WriteAheadSpool(spool) if spool is not None else None
+    for manager in db_managers:
+        manager.sinks.extend(sinks)
+        if writer is not None:
+            manager.writer = writer
+        if spool is not None:
+            manager.attach_spool(spool)
+    # Started once every manager is registered so earlier runs' records can be replayed.
+    if spool is not None:
+        spool.start()
+
 
-        for database_manager in db_managers:
-            thread_list.append(Thread(target=database_manager.get_data))
+def close_outputs(db_managers):
+    """Flush and close the managers' write-behind writers and spools and then their sinks,
+    each once."""
+    writers = {id(writer): writer for manager in db_managers
+               for writer in (manager.writer, manager.spool) if writer is not None}
+    for writer in writers.values():
+        writer.close()
 
-        for thread in thread_list:
-            thread.start()
+    sinks = {id(sink): sink for manager in db_managers for sink in manager.sinks}
+    for sink in sinks.values():
+        sink.close()
 
-        for thread in thread_list:
-            thread.join()
 
-        del thread_list
+def _timed_get_data(manager):
+    start = time.time()
+    manager.get_data()
+    return time.time() - start
 
 
 def delta_time_to_sleep(interval, offset):
@@ -0,0 +1,315 @@
+"""
+Create the tables of the three databases and migrate tables from the original layout.
+
+Tables use compact types and primary keys that make duplicates cheap to detect, partitioned
+tables need the partitioning column in their primary key:
+
+    level two books   (timestamp, side, level), partitioned by day, see partitions.py
+    level two deltas  (timestamp, side, price), partitioned by day
+    trades            (tid), with `side` an ENUM rather than varchar(4)
+    futures indexes   (unixRequestTime)
+
+Prices are DOUBLE unless a fixed-point type is configured for the table.  The storage engine
+and row compression are given by the `table_options` of every CREATE TABLE, by default
+compressed InnoDB.  The schema is configured by the `schema` section of the collector config:
+
+    "schema": {"table_options": "ENGINE=InnoDB ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8",
+               "price_types": [["spot_*", "DECIMAL(16,8)"]], "partition_books": true}
+
+The databases themselves must exist.
+"""
+from datetime import date, datetime, timedelta, timezone
+from fnmatch import fnmatch
+import re
+
+from sqlalchemy import text
+
+from .constants import (
+    NANOSECOND_FACTOR, PARTITION_DAYS_AHEAD, PARTITION_HISTORY_DAYS, SCHEMA_TABLE_OPTIONS,
+    MIGRATION_CHUNKS
+)
+from .engines import get_engine
+from .logs import logger_storage
+from .reader import PRIMARY_KEYS, TABLE_INDEXES
+
+DAY_IN_NANOSECONDS = 86400 * NANOSECOND_FACTOR
+MAX_PARTITION = 'pmax'
+HISTORY_PARTITION = 'phistory'
+
+TABLE_COLUMNS = {
+    'book': [('timestamp', 'BIGINT NOT NULL'), ('side', 'TINYINT UNSIGNED NOT NULL'),
+             ('level', 'SMALLINT UNSIGNED NOT NULL'), ('price', '{price} NOT NULL'),
+             ('volume', 'DOUBLE NOT NULL')],
+    'delta': [('timestamp', 'BIGINT NOT NULL'), ('side', 'TINYINT UNSIGNED NOT NULL'),
+              ('price', '{price} NOT NULL'), ('volume', 'DOUBLE NOT NULL')],
+    'trades': [('unixRequestTime', 'BIGINT NOT NULL'), ('unixReturnTime', 'BIGINT NOT NULL'),
+               ('trade_time', 'BIGINT NOT NULL'), ('amount', 'DOUBLE NOT NULL'),
+               ('price', '{price} NOT NULL'), ('side', "ENUM('buy', 'sell') NOT NULL"),
+               ('tid', 'BIGINT NOT NULL')],
+    'index': [('unixRequestTime', 'BIGINT NOT NULL'), ('unixReturnTime', 'BIGINT NOT NULL'),
+              ('future_index', 'DOUBLE NOT NULL')],
+}
+PARTITIONED_KINDS = ('book', 'delta')
+
+DEFAULT_SCHEMA = {'table_options': SCHEMA_TABLE_OPTIONS, 'price_types': [],
+                  'partition_books': True}
+
+_PRICE_TYPE = re.compile(r'^(DOUBLE|FLOAT|DECIMAL\(\d+, ?\d+\))$', re.IGNORECASE)
+
+
+def check_schema(schema):
+    """Check the price types of a schema config.
+
+    Raises
+    ------
+    ValueError
+        If a price type is not DOUBLE, FLOAT or DECIMAL(precision, scale).
+    """
+    for pattern, price_type in schema['price_types']:
+        if not _PRICE_TYPE.match(price_type):
+            raise ValueError(f'Unsupported price type {price_type} for {pattern}, expected '
+                             f'DOUBLE, FLOAT or DECIMAL(precision, scale)')
+
+
+def price_type(table, price_types=()):
+    """Get the price type of a table from the first (pattern, type) entry matching it."""
+    for pattern, sql_type in price_types:
+        if fnmatch(table, pattern):
+            return sql_type
+    return 'DOUBLE'
+
+
+def table_definition(table, kind, schema=None, partitions=None, history=False):
+    """Build the CREATE TABLE statement of a table.
+
+    Parameters
+    ----------
+    table: str
+        Name of the table.
+    kind: str
+        'book', 'delta', 'trades' or 'index'.
+    schema: dict
+        The `schema` section of the collector config, defaults to `DEFAULT_SCHEMA`.
+    partitions: list(datetime.date)
+        Days partitioned in advance, None for an unpartitioned table.
+    history: bool
+        Add a `phistory` partition for the rows before the first day, see `partition_days`.
+
+    Returns
+    -------
+    str
+        The statement.
+    """
+    schema = schema or DEFAULT_SCHEMA
+    sql_price_type = price_type(table, schema['price_types'])
+    columns = [f'{column} {sql_type.format(price=sql_price_type)}'
+               for column, sql_type in TABLE_COLUMNS[kind]]
+    columns.append(f'PRIMARY KEY ({", ".join(PRIMARY_KEYS[kind])})')
+    # The read indexes not covered by the primary key.
+    columns += [f'INDEX {name} ({", ".join(index_columns)})'
+                for name, index_columns in TABLE_INDEXES[kind]
+                if index_columns != PRIMARY_KEYS[kind]]
+
+    statement = f'CREATE TABLE IF NOT EXISTS {table} ({", ".join(columns)})'
+    if schema['table_options']:
+        statement += f' {schema["table_options"]}'
+    if partitions is not None:
+        statement += (f' PARTITION BY RANGE (timestamp) '
+                      f'({partition_definitions(partitions, history)})')
+    return statement
+
+
+def create_table(table, kind, database_name, schema=None, partitions=None, history=False):
+    """Create a table if it does not exist, see `table_definition`."""
+    get_engine(database_name).execute(text(
+        table_definition(table, kind, schema, partitions, history)
+    ).execution_options(autocommit=True))
+
+
+def create_tables(tables, schema=None, today=None, days_ahead=PARTITION_DAYS_AHEAD):
+    """Create the tables that do not exist.
+
+    Parameters
+    ----------
+    tables: dict
+        {database: [(table, kind), ...]}, e.g. from reader.collected_tables.
+    schema: dict
+        The `schema` section of the collector config, defaults to `DEFAULT_SCHEMA`.
+    today: datetime.date
+        The current UTC day, defaults to today.
+    days_ahead: int
+        Number of days after today partitioned in advance.
+
+    Returns
+    -------
+    list(tuple)
+        (database, table) of the tables created.
+    """
+    schema = schema or DEFAULT_SCHEMA
+    today = today or utc_today()
+    created = []
+
+    for database_name, database_tables in tables.items():
+        existing = _existing_tables(database_name)
+        for table, kind in database_tables:
+            if table in existing:
+                continue
+            partitions = None
+            if schema['partition_books'] and kind in PARTITIONED_KINDS:
+                partitions = days_between(today, today + timedelta(days=days_ahead))
+            logger_storage.info(f'Creating table {database_name}.{table}')
+            create_table(table, kind, database_name, schema, partitions)
+            created.append((database_name, table))
+
+    return created
+
+
+def migrate_table(table, kind, database_name, schema=None, today=None,
+                  days_ahead=PARTITION_DAYS_AHEAD):
+    """Move a table of the original layout, without a primary key, to the current schema.
+
+    The rows are copied to `{table}__new` in ranges of the primary key's first column with
+    `INSERT IGNORE`, which drops duplicate rows, then the tables are swapped atomically and the
+    original is kept as `{table}__old` to be dropped once checked.  Rows written during the
+    copy are caught by a final pass just before the swap, still the collectors are best
+    stopped or writing through a spool while migrating.
+
+    Returns
+    -------
+    int
+        The number of rows copied.
+    """
+    schema = schema or DEFAULT_SCHEMA
+    today = today or utc_today()
+    engine = get_engine(database_name)
+    key = PRIMARY_KEYS[kind][0]
+    columns = ', '.join(column for column, _ in TABLE_COLUMNS[kind])
+    new_table, old_table = f'{table}__new', f'{table}__old'
+
+    low, high = engine.execute(text(f'SELECT MIN({key}), MAX({key}) FROM {table}')).fetchall()[0]
+    partitions, history = None, False
+    if schema['partition_books'] and kind in PARTITIONED_KINDS:
+        partitions, history = partition_days(None if low is None else int(low), today,
+                                             days_ahead)
+    create_table(new_table, kind, database_name, schema, partitions, history)
+
+    logger_storage.info(f'Migrating {database_name}.{table} to the current schema')
+    rows = 0
+    if low is not None:
+        step = max((int(high) - int(low)) // MIGRATION_CHUNKS + 1, 1)
+        for start in range(int(low), int(high) + 1, step):
+            rows += _copy_rows(engine, table, new_table, columns,
+                               f'{key} >= {start} AND {key} < {start + step}')
+
+    # Catch the rows written since the copy started.
+    last = engine.execute(text(f'SELECT MAX({key}) FROM {new_table}')).fetchall()[0][0]
+    rows += _copy_rows(engine, table, new_table, columns,
+                       '1 = 1' if last is None else f'{key} >= {last}')
+    engine.execute(text(f'RENAME TABLE {table} TO {old_table}, {new_table} TO {table}')
+                   .execution_options(autocommit=True))
+    logger_storage.info(f'Migrated {rows} rows of {database_name}.{table}, the original '
+                        f'table is kept as {old_table}')
+    return rows
+
+
+def migrate_tables(tables, schema=None, today=None, days_ahead=PARTITION_DAYS_AHEAD):
+    """Migrate the existing tables without a primary key, see `migrate_table`.
+
+    Returns
+    -------
+    list(tuple)
+        (database, table, rows copied) of the tables migrated.
+    """
+    migrated = []
+    for database_name, database_tables in tables.items():
+        existing = _existing_tables(database_name)
+        for table, kind in database_tables:
+            if table in existing and not existing[table]:
+                rows = migrate_table(table, kind, database_name, schema, today, days_ahead)
+                migrated.append((database_name, table, rows))
+    return migrated
+
+
+def _copy_rows(engine, table, new_table, columns, condition):
+    return engine.execute(text(
+        f'INSERT IGNORE INTO {new_table} ({columns}) SELECT {columns} FROM {table} '
+        f'WHERE {condition}').execution_options(autocommit=True)).rowcount
+
+
+def _existing_tables(database_name):
+    """Get the tables of a database and whether they have a primary key, by table."""
+    rows = get_engine(database_name).execute(text(
+        'SELECT tables.table_name, COUNT(constraints.constraint_name) '
+        'FROM information_schema.tables AS tables '
+        'LEFT JOIN information_schema.table_constraints AS constraints '
+        'ON constraints.table_schema = tables.table_schema '
+        'AND constraints.table_name = tables.table_name '
+        "AND constraints.constraint_type = 'PRIMARY KEY' "
+        'WHERE tables.table_schema = DATABASE() GROUP BY tables.table_name')).fetchall()
+    return {table: bool(primary_keys) for table, primary_keys in rows}
+
+
+def partition_name(day):
+    """Name of the partition of a day, e.g. p20200101."""
+    return f'p{day:%Y%m%d}'
+
+
+def day_start(day):
+    """The unix time in nanoseconds of the start of a UTC day."""
+    return (day - date(1970, 1, 1)).days * DAY_IN_NANOSECONDS
+
+
+def day_of(timestamp):
+    """The UTC day of a unix time in nanoseconds."""
+    return date(1970, 1, 1) + timedelta(days=timestamp // DAY_IN_NANOSECONDS)
+
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+def days_between(first, last):
+    """The days from `first` to `last`, inclusive."""
+    return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+
+def partition_days(first_timestamp, today, days_ahead=PARTITION_DAYS_AHEAD,
+                   history_days=PARTITION_HISTORY_DAYS):
+    """Get the daily partitions of a table partitioned with rows already in it.
+
+    MySQL allows 8192 partitions per table, so only the last `history_days` days before today
+    get a daily partition and older rows share the `phistory` partition, which retention
+    compacts as a whole.
+
+    Parameters
+    ----------
+    first_timestamp: int
+        The table's smallest timestamp, None if it is empty.
+    today: datetime.date
+        The current UTC day.
+    days_ahead: int
+        Number of days after today partitioned in advance.
+    history_days: int
+        Number of days before today given a daily partition.
+
+    Returns
+    -------
+    tuple
+        (days, history) the days partitioned and whether a `phistory` partition is needed.
+    """
+    first_day = today if first_timestamp is None else min(day_of(first_timestamp), today)
+    history_start = today - timedelta(days=history_days)
+    return (days_between(max(first_day, history_start), today + timedelta(days=days_ahead)),
+            first_day < history_start)
+
+
+def partition_definitions(days, history=False):
+    """Partition definitions for each day followed by `pmax`, preceded by `phistory` for the
+    rows before the first day if `history`."""
+    partitions = [f'PARTITION {partition_name(day)} VALUES LESS THAN '
+                  f'({day_start(day + timedelta(days=1))})' for day in days]
+    if history:
+        partitions.insert(0, f'PARTITION {HISTORY_PARTITION} VALUES LESS THAN '
+                             f'({day_start(days[0])})')
+    partitions.append(f'PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE')
+    return ', '.join(partitions)
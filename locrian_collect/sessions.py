@@ -0,0 +1,158 @@
+"""
+Keep-alive HTTP sessions shared by all managers, one per exchange host.
+"""
+import json
+import random
+from threading import Lock
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from .constants import (
+    HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_BACKOFF, HTTP_RETRY_STATUS_CODES, HTTP_RATE_LIMIT_STATUS
+)
+from .rate_limit import RateLimited, parse_retry_after
+
+REQUEST_TIMEOUT = 8  # seconds
+
+_SESSIONS = {}
+_SESSIONS_LOCK = Lock()
+
+
+def loads(body):
+    """Decode json, with orjson when it is installed.
+
+    Parameters
+    ----------
+    body: bytes or str
+        The json document.
+
+    Raises
+    ------
+    ValueError
+        If the body is not valid json.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def get_session(url):
+    """Get the shared session for the host of a url, creating it on first use.
+
+    Parameters
+    ----------
+    url: str
+        Url to be requested.
+
+    Returns
+    -------
+    requests.Session
+        Session with a connection pool of `HTTP_POOL_SIZE` connections to the host.
+    """
+    host = urlsplit(url).netloc
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(host)
+        if session is None:
+            session = _create_session()
+            _SESSIONS[host] = session
+        return session
+
+
+def _create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+
+def close_sessions():
+    """Close all sessions and empty the registry."""
+    with _SESSIONS_LOCK:
+        for session in _SESSIONS.values():
+            session.close()
+        _SESSIONS.clear()
+
+
+def get_json(url, timeout=REQUEST_TIMEOUT, deadline=None, retries=HTTP_RETRIES,
+             backoff=HTTP_BACKOFF):
+    """Make a GET request with the host's shared session and decode the json response.
+
+    Connection errors, timeouts and `HTTP_RETRY_STATUS_CODES` are retried with jittered
+    exponential backoff, as long as the retry can start before `deadline`.  Rate limited
+    requests are not retried, the caller backs off.
+
+    Parameters
+    ----------
+    url: str
+        Url to request.
+    timeout: float
+        Timeout in seconds of each attempt.
+    deadline: float
+        Unix time in seconds after which no more attempts are made, for example the time of
+        the next tick.  None for no deadline.
+    retries: int
+        Maximum number of retries after the first attempt.
+    backoff: float
+        Base backoff in seconds, attempt n waits a random time up to backoff * 2 ** n.
+
+    Returns
+    -------
+    The decoded json.
+
+    Raises
+    ------
+    requests.Timeout, requests.ConnectionError
+        If the last attempt failed.
+    rate_limit.RateLimited
+        If the exchange answered with HTTP 429.
+    ValueError
+        If the response is not valid json.
+    """
+    session = get_session(url)
+    attempt = 0
+
+    while True:
+        attempt_timeout = timeout
+        if deadline is not None:
+            attempt_timeout = max(min(timeout, deadline - time.time()), 0.001)
+
+        try:
+            response = session.get(url, timeout=attempt_timeout)
+        except (requests.Timeout, requests.ConnectionError):
+            if not _wait_to_retry(attempt, retries, backoff, deadline):
+                raise
+            attempt += 1
+            continue
+
+        if (response.status_code in HTTP_RETRY_STATUS_CODES
+                and _wait_to_retry(attempt, retries, backoff, deadline)):
+            attempt += 1
+            continue
+
+        if response.status_code == HTTP_RATE_LIMIT_STATUS:
+            raise RateLimited(url, parse_retry_after(response.headers.get('Retry-After')))
+
+        return loads(response.content)
+
+
+def _wait_to_retry(attempt, retries, backoff, deadline):
+    """Sleep before the next attempt, returning False if there should be no more attempts."""
+    if attempt >= retries:
+        return False
+
+    delay = random.uniform(0, backoff * 2 ** attempt)
+    if deadline is not None and time.time() + delay >= deadline:
+        return False
+
+    time.sleep(delay)
+    return True
@@ -0,0 +1,305 @@
+"""
+Collect with the managers partitioned across worker processes.
+
+Each worker builds the managers of the collector config, spreads their phases over the same
+wall clock grid as a single process would and then runs only the managers of its shard, so
+the shards together make the same requests at the same times.  Tables are assigned to shards
+by rendezvous hashing of their names, so changing the number of shards only moves the tables
+of the shards added or removed.
+
+A supervisor starts the workers, restarts any that die or stop making progress and aggregates
+their health.  A worker's heartbeats carry the time its scheduler last finished a manager's
+turn, so a worker whose requests all hang is restarted even though it is alive.  Workers are
+stopped with SIGTERM, which lets them flush their write-behind writers, spools and archive
+sinks, and killed if they have not exited after `SHARD_STOP_TIMEOUT` seconds.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+from threading import Thread, Event
+import time
+
+from .constants import (
+    SHARD_HEARTBEAT_INTERVAL, SHARD_HEARTBEAT_TIMEOUT, SHARD_RESTART_BACKOFF, SHARD_STOP_TIMEOUT
+)
+from .logs import logger_collector, configure_logging
+from .metrics import METRICS
+
+
+def shard_for(table, num_shards):
+    """Get the shard of a table, stable across processes and runs.
+
+    Parameters
+    ----------
+    table: str
+        The manager's mysql_table.
+    num_shards: int
+        Number of shards.
+
+    Returns
+    -------
+    int
+        The shard, from 0 to num_shards - 1.
+    """
+    return max(range(num_shards), key=lambda shard: hashlib.md5(
+        f'{table}:{shard}'.encode()).digest())
+
+
+def partition_managers(db_managers, num_shards):
+    """Group managers by shard.
+
+    Returns
+    -------
+    list(list)
+        The managers of each shard.
+    """
+    shards = [[] for _ in range(num_shards)]
+    for manager in db_managers:
+        shards[shard_for(manager.mysql_table, num_shards)].append(manager)
+    return shards
+
+
+def health_summary(db_managers):
+    """Summarise the metrics of the managers of this process for a heartbeat."""
+    snapshot = METRICS.snapshot()
+    summary = {'managers': len(db_managers), 'requests': 0, 'errors': 0, 'rows_written': 0}
+    for manager in db_managers:
+        counters = snapshot.get(manager.mysql_table, {}).get('counters', {})
+        summary['requests'] += counters.get('requests', 0)
+        summary['rows_written'] += counters.get('rows_written', 0)
+        summary['errors'] += sum(value for name, value in counters.items()
+                                 if name.startswith('errors_'))
+    return summary
+
+
+def exit_on_terminate():
+    """Raise SystemExit in the main thread on SIGTERM, so the scheduler's `finally` flushes and
+    closes the outputs before the worker exits."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+def run_shard(config, shard, num_shards, health_queue, archive=False, write_behind=False,
+              spool=None):
+    """Collect the managers of one shard, the target of the worker processes.
+
+    Parameters
+    ----------
+    config: dict
+        Collector config, see collector.load_config.
+    shard: int
+        The shard of this worker.
+    num_shards: int
+        Number of shards.
+    health_queue: multiprocessing.Queue
+        Queue the worker's heartbeats are put on.
+    archive: bool
+        Also write the data to a local archive.ParquetSink.
+    write_behind: bool
+        Queue the database writes on a write_behind.WriteBehindWriter.
+    spool: str
+        Directory of the spools, each shard writes through a spool.WriteAheadSpool in its
+        own subdirectory.
+    """
+    # pylint: disable=import-outside-toplevel
+    from .collector import build_managers
+    from .rate_limit import set_rate_limit_share
+    from .scheduler import (
+        attach_outputs, follow_contract_rolls, rate_limited_scheduler, spread_phases
+    )
+    from .streaming import StreamingBookManager, start_book_streams
+
+    configure_logging()
+    exit_on_terminate()
+    set_rate_limit_share(1 / num_shards)
+
+    db_managers = build_managers(config)
+    spread_phases(db_managers, config['offset'])
+    db_managers = partition_managers(db_managers, num_shards)[shard]
+
+    sinks = []
+    if archive:
+        from .archive import ParquetSink
+        sinks.append(ParquetSink())
+    attach_outputs(db_managers, sinks, write_behind,
+                   None if spool is None else os.path.join(spool, f'shard_{shard}'))
+    follow_contract_rolls(db_managers)
+    start_book_streams([manager for manager in db_managers
+                        if isinstance(manager, StreamingBookManager)])
+
+    # Time the scheduler last finished a manager's turn, the shard's progress.
+    progress = {'time': time.time()}
+
+    def heartbeat():
+        while True:
+            health_queue.put({'shard': shard, 'pid': os.getpid(), 'time': time.time(),
+                              'progress': progress['time'], **health_summary(db_managers)})
+            time.sleep(SHARD_HEARTBEAT_INTERVAL)
+
+    Thread(target=heartbeat, name='locrian_heartbeat', daemon=True).start()
+    rate_limited_scheduler(db_managers, logger_collector, time_between_requests=10,
+                           offset=config['offset'],
+                           log_msg=f'Shard {shard} collecting {len(db_managers)} managers.',
+                           spread=False,
+                           on_turn=lambda manager: progress.update(time=time.time()))
+
+
+class Supervisor:
+    """Start a worker process per shard and restart the workers that die or hang.
+
+    Parameters
+    ----------
+    num_shards: int
+        Number of worker processes.
+    target: callable
+        Called in each worker as target(*args, shard, num_shards, health_queue), e.g.
+        `run_shard` with args (config,).
+    args: tuple
+        Arguments passed to target before the shard.
+    kwargs: dict
+        Keyword arguments passed to target.
+    heartbeat_timeout: float
+        Seconds without progress, a finished turn of a manager, after which a worker is
+        considered hung and restarted.  Must be longer than the managers' intervals.
+    restart_backoff: float
+        Minimum seconds between restarts of the same shard.
+    stop_timeout: float
+        Seconds a worker has to exit after SIGTERM before it is killed.
+    """
+    def __init__(self, num_shards, target=run_shard, args=(), kwargs=None,
+                 heartbeat_timeout=SHARD_HEARTBEAT_TIMEOUT,
+                 restart_backoff=SHARD_RESTART_BACKOFF, stop_timeout=SHARD_STOP_TIMEOUT):
+        self.num_shards = num_shards
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.heartbeat_timeout = heartbeat_timeout
+        self.restart_backoff = restart_backoff
+        self.stop_timeout = stop_timeout
+        # Workers run threads, spawn rather than fork the supervisor.
+        self._context = multiprocessing.get_context('spawn')
+        self.health_queue = self._context.Queue()
+        self.processes = {}
+        self.status = {shard: {'restarts': 0, 'started': None, 'heartbeat': None}
+                       for shard in range(num_shards)}
+        self._stop = Event()
+
+    def start(self):
+        """Start a worker for every shard."""
+        for shard in range(self.num_shards):
+            self._start(shard)
+        return self
+
+    def _start(self, shard):
+        process = self._context.Process(
+            target=self.target,
+            args=(*self.args, shard, self.num_shards, self.health_queue),
+            kwargs=self.kwargs, name=f'locrian_shard_{shard}', daemon=True)
+        process.start()
+        self.processes[shard] = process
+        self.status[shard].update({'pid': process.pid, 'started': time.time(),
+                                   'heartbeat': None})
+
+    def check(self):
+        """Read the heartbeats and restart the workers that died or stopped making progress.
+
+        Returns
+        -------
+        list(int)
+            The shards restarted.
+        """
+        self._read_heartbeats()
+        now = time.time()
+        restarted = []
+
+        for shard, process in self.processes.items():
+            status = self.status[shard]
+            last_seen = status['heartbeat'] or status['started']
+            if process.is_alive() and now - last_seen < self.heartbeat_timeout:
+                continue
+            if now - status['started'] < self.restart_backoff:
+                continue
+
+            if process.is_alive():
+                logger_collector.warning(f'Shard {shard} made no progress for '
+                                         f'{now - last_seen:.0f}s, restarting.')
+                self._stop_processes([process])
+            else:
+                logger_collector.warning(f'Shard {shard} exited with {process.exitcode}, '
+                                         f'restarting.')
+                process.join(5)
+            status['restarts'] += 1
+            self._start(shard)
+            restarted.append(shard)
+
+        return restarted
+
+    def _read_heartbeats(self):
+        while True:
+            try:
+                heartbeat = self.health_queue.get_nowait()
+            except queue.Empty:
+                return
+            status = self.status[heartbeat['shard']]
+            if heartbeat['pid'] == status.get('pid'):
+                status.update(heartbeat)
+                status['heartbeat'] = heartbeat.get('progress', heartbeat['time'])
+
+    def health(self):
+        """Get the status of every shard and the totals of their last heartbeats."""
+        shards = {shard: dict(status, alive=self.processes[shard].is_alive())
+                  for shard, status in self.status.items()}
+        totals = {name: sum(status.get(name, 0) for status in shards.values())
+                  for name in ('managers', 'requests', 'errors', 'rows_written', 'restarts')}
+        totals['alive'] = sum(status['alive'] for status in shards.values())
+        return {'time': time.time(), 'totals': totals, 'shards': shards}
+
+    def run(self, check_interval=SHARD_HEARTBEAT_INTERVAL, health_path=None):
+        """Supervise the workers until `stop` is called or the process is interrupted.
+
+        Parameters
+        ----------
+        check_interval: float
+            Seconds between checks of the workers.
+        health_path: str
+            File the aggregated health is written to as json after every check.
+        """
+        try:
+            while not self._stop.wait(check_interval):
+                self.check()
+                health = self.health()
+                logger_collector.info(f'Shards alive {health["totals"]["alive"]}/'
+                                      f'{self.num_shards}, {health["totals"]}')
+                if health_path is not None:
+                    with open(f'{health_path}.tmp', 'w') as f:
+                        f.write(json.dumps(health))
+                    os.replace(f'{health_path}.tmp', health_path)
+        finally:
+            self.close()
+
+    def stop(self):
+        """Stop `run`."""
+        self._stop.set()
+
+    def close(self):
+        """Stop the workers, letting them flush their outputs."""
+        self._stop_processes(self.processes.values())
+
+    def _stop_processes(self, processes):
+        """Send SIGTERM, wait up to `stop_timeout` seconds for the workers to exit and kill
+        the ones still running."""
+        processes = [process for process in processes if process.is_alive()]
+        for process in processes:
+            process.terminate()
+        deadline = time.time() + self.stop_timeout
+        for process in processes:
+            process.join(max(deadline - time.time(), 0))
+        for process in processes:
+            if process.is_alive():
+                logger_collector.warning(f'{process.name} did not exit within '
+                                         f'{self.stop_timeout}s, killing it.')
+                process.kill()
+                process.join()
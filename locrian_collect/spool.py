@@ -0,0 +1,450 @@
+"""
+Crash-safe local write-ahead spool in front of MySQL.
+
+Managers append their records to the spool, which returns once the record is on disk, and a
+replayer thread writes the spooled records to MySQL in batches.  While MySQL is down or slow
+the records accumulate on disk and the replayer retries with a growing delay, draining the
+spool once the database recovers.
+
+The spool is a directory of append-only segment files, each record framed by its length and
+crc32 so a record torn by a crash is detected and skipped.  The position of the last record
+written to MySQL is checkpointed after every batch and fully written segments are deleted.
+A crash between a batch's write and its checkpoint replays the batch, so after a failure or
+a restart the replayer asks the write functions to skip rows already saved: trades by `tid`,
+books by `timestamp` and indexes by `unixRequestTime`.
+
+Disk usage is bounded by `max_bytes`; an error is logged once the spool is `warn_fraction`
+full and new records are dropped, and counted, while it is full.  Use one spool directory
+per process.
+
+Connection errors are retried until the database is back.  A key's batch failing with any
+other error `max_attempts` times, e.g. a record the database rejects, is moved to the
+`dead_letters` file of the directory so it does not hold back the other keys; so is a record
+that cannot be unpickled.  The dead letters are framed like the segments, see `read_dead_letters`.
+"""
+import json
+import os
+import pickle
+import struct
+from threading import Thread, Event, Lock
+import zlib
+
+from sqlalchemy import exc as sqlalchemy_exc
+
+from .constants import (
+    SPOOL_DIRECTORY, SPOOL_SEGMENT_BYTES, SPOOL_MAX_BYTES, SPOOL_WARN_FRACTION,
+    SPOOL_BATCH_SIZE, SPOOL_POLL_INTERVAL, SPOOL_RETRY_INTERVAL, SPOOL_MAX_RETRY_INTERVAL,
+    SPOOL_MAX_ATTEMPTS
+)
+from .logs import logger_storage
+from .metrics import METRICS
+
+_HEADER = struct.Struct('<II')  # payload length, crc32 of the payload
+_SEGMENT_SUFFIX = '.spool'
+_CHECKPOINT = 'checkpoint.json'
+DEAD_LETTERS = 'dead_letters'
+# Key of the payloads that could not be unpickled.
+UNREADABLE = 'unreadable'
+# Errors of an unreachable database, retried until it is back rather than counted as attempts.
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, sqlalchemy_exc.OperationalError,
+                    sqlalchemy_exc.InterfaceError, sqlalchemy_exc.TimeoutError)
+
+
+class WriteAheadSpool:
+    """Append-only spool of records replayed into the database by a background thread.
+
+    Parameters
+    ----------
+    directory: str
+        Directory of the segment files and checkpoint, created if missing.
+    segment_bytes: int
+        Size after which a new segment file is started.
+    max_bytes: int
+        Maximum size of the spool on disk, records appended to a full spool are dropped.
+    warn_fraction: float
+        Fraction of `max_bytes` at which an error is logged.
+    batch_size: int
+        Maximum number of records replayed per batch.
+    poll_interval: float
+        Seconds between replays once the spool is drained.
+    retry_interval: float
+        Seconds before retrying a failed replay, doubled after every failure.
+    max_retry_interval: float
+        Maximum seconds between retries.
+    max_attempts: int
+        Failed writes of a key's batch, other than connection errors, before the batch is
+        moved to the dead letters.
+    fsync: bool
+        Sync every record to disk before `append` returns.
+    """
+    def __init__(self, directory=SPOOL_DIRECTORY, segment_bytes=SPOOL_SEGMENT_BYTES,
+                 max_bytes=SPOOL_MAX_BYTES, warn_fraction=SPOOL_WARN_FRACTION,
+                 batch_size=SPOOL_BATCH_SIZE, poll_interval=SPOOL_POLL_INTERVAL,
+                 retry_interval=SPOOL_RETRY_INTERVAL, max_retry_interval=SPOOL_MAX_RETRY_INTERVAL,
+                 max_attempts=SPOOL_MAX_ATTEMPTS, fsync=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.warn_fraction = warn_fraction
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.max_attempts = max_attempts
+        self.fsync = fsync
+
+        self._write_fns = {}
+        self._lock = Lock()
+        segments = self._segments()
+        self._bytes = sum(os.path.getsize(self._path(segment)) for segment in segments)
+        # Appends always go to a new segment, never after a tail a crash may have torn.
+        self._segment = segments[-1] + 1 if segments else 0
+        self._file = None
+        self._position = self._read_checkpoint(segments)
+        self._warned = False
+        self._full = False
+        # The checkpoint may lag the records the previous run wrote before it stopped.
+        self._check_existing = bool(segments)
+        # Records of each key of the batch at the checkpoint already written and the failed
+        # attempts of the others, cleared once the checkpoint moves past the batch.
+        self._written = {}
+        self._attempts = {}
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name='locrian_spool', daemon=True)
+
+    def register(self, key, write_fn):
+        """Set the function writing the records of a key.
+
+        Parameters
+        ----------
+        key: hashable
+            (database, table) the records are written to.
+        write_fn: callable
+            Called as write_fn(records, check_existing=bool) with a list of records.
+        """
+        self._write_fns[key] = write_fn
+
+    def append(self, key, record):
+        """Append a record to the spool.
+
+        Parameters
+        ----------
+        key: hashable
+            (database, table) the record is written to.
+        record:
+            The record, anything that can be pickled.
+
+        Returns
+        -------
+        bool
+            False if the spool is full and the record was dropped.
+        """
+        data = _frame(key, record)
+
+        with self._lock:
+            if self._bytes + len(data) > self.max_bytes:
+                if not self._full:
+                    logger_storage.error(f'Spool {self.directory} is full, dropping records '
+                                         f'until it drains')
+                    self._full = True
+                METRICS.increment('spool', 'errors_full')
+                return False
+
+            if self._file is None or self._file.tell() >= self.segment_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._bytes += len(data)
+
+            if not self._warned and self._bytes >= self.warn_fraction * self.max_bytes:
+                logger_storage.error(f'Spool {self.directory} is {self.usage:.0%} full, '
+                                     f'the database may be down')
+                self._warned = True
+
+        METRICS.increment('spool', 'records_spooled')
+        return True
+
+    @property
+    def size(self):
+        """int: Bytes on disk."""
+        return self._bytes
+
+    @property
+    def usage(self):
+        """float: Fraction of `max_bytes` used."""
+        return self._bytes / self.max_bytes
+
+    def start(self):
+        """Start the replayer thread."""
+        self._thread.start()
+        return self
+
+    def close(self, timeout=None):
+        """Stop the replayer, write what the database accepts and close the segment.  Records
+        not written stay in the spool for the next run.
+
+        Parameters
+        ----------
+        timeout: float
+            Seconds to wait for the replayer thread, None to wait until it finishes.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        try:
+            while self.replay(self._check_existing):
+                self._check_existing = False
+        except Exception as exc:  # pylint: disable=broad-except
+            logger_storage.warning(f'Error replaying spool {self.directory} on close, '
+                                   f'{self.size} bytes left: {exc!r}')
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def replay(self, check_existing=False):
+        """Write the next batch of spooled records and checkpoint past them.
+
+        Each key's records are written separately.  A key whose write fails is retried by the
+        next replay, without writing the other keys again, until it succeeds or has failed
+        `max_attempts` times with errors other than `TRANSIENT_ERRORS` and is moved to the
+        dead letters.
+
+        Parameters
+        ----------
+        check_existing: bool
+            Ask the write functions to skip rows already saved.
+
+        Returns
+        -------
+        int
+            The number of records replayed.
+
+        Raises
+        ------
+        Exception
+            The first error a write function raised, the checkpoint then stays at the batch.
+        """
+        records, position, finished = self._read_batch()
+
+        batches = {}
+        for key, record in records:
+            batches.setdefault(key, []).append(record)
+
+        error = None
+        for key, batch in batches.items():
+            # A retried batch may have grown since, its first records were already handled.
+            done = self._written.get(key, 0)
+            batch = batch[done:]
+            if not batch:
+                continue
+            write_fn = self._write_fns.get(key)
+            if key == UNREADABLE:
+                self._dead_letter(key, batch, 'records could not be unpickled')
+            elif write_fn is None:
+                logger_storage.error(f'No writer for {key}, dropped {len(batch)} spooled '
+                                     f'records')
+                METRICS.increment('spool', 'errors_unroutable', len(batch))
+            else:
+                try:
+                    write_fn(batch, check_existing=check_existing)
+                except Exception as exc:  # pylint: disable=broad-except
+                    if not isinstance(exc, TRANSIENT_ERRORS):
+                        self._attempts[key] = self._attempts.get(key, 0) + 1
+                    if self._attempts.get(key, 0) < self.max_attempts:
+                        error = error or exc
+                        continue
+                    self._dead_letter(key, batch, f'{self.max_attempts} failed writes, last '
+                                                  f'{exc!r}')
+                    self._attempts.pop(key)
+            self._written[key] = done + len(batch)
+
+        if error is not None:
+            raise error
+
+        self._commit(position, finished)
+        self._written.clear()
+        self._attempts.clear()
+        if records:
+            METRICS.increment('spool', 'records_replayed', len(records))
+        return len(records)
+
+    def _dead_letter(self, key, batch, reason):
+        """Append a key's batch to the dead letters."""
+        with open(os.path.join(self.directory, DEAD_LETTERS), 'ab') as f:
+            for record in batch:
+                f.write(_frame(key, record))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        logger_storage.error(f'Moved {len(batch)} spooled records of {key} to the dead letters '
+                             f'of {self.directory}: {reason}')
+        METRICS.increment('spool', 'errors_poisoned', len(batch))
+
+    def _run(self):
+        retry_interval = self.retry_interval
+        while not self._stop.is_set():
+            try:
+                replayed = self.replay(self._check_existing)
+            except Exception as exc:  # pylint: disable=broad-except
+                # Most likely the database is down, the records stay spooled until it is back.
+                self._check_existing = True
+                METRICS.increment('spool', 'errors_replay')
+                logger_storage.warning(f'Error replaying spool {self.directory}, '
+                                       f'{self.size} bytes waiting, retrying in '
+                                       f'{retry_interval}s: {exc!r}')
+                self._stop.wait(retry_interval)
+                retry_interval = min(retry_interval * 2, self.max_retry_interval)
+                continue
+
+            retry_interval = self.retry_interval
+            if replayed:
+                self._check_existing = False
+            if replayed < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+    def _read_batch(self):
+        """Read up to `batch_size` records from the checkpoint.
+
+        Returns
+        -------
+        tuple
+            The records, the position after them and the segments read to the end.
+        """
+        with self._lock:
+            active = self._segment
+            segments = self._segments()
+
+        segment, offset = self._position
+        records = []
+        finished = []
+
+        for next_segment in segments:
+            if next_segment < segment:
+                continue
+            if next_segment > segment:
+                segment, offset = next_segment, 0
+
+            with open(self._path(segment), 'rb') as f:
+                f.seek(offset)
+                status = None
+                while len(records) < self.batch_size:
+                    record, status = _read_record(f)
+                    if record is None:
+                        break
+                    records.append(record)
+                    offset += status
+
+            if len(records) >= self.batch_size or segment >= active:
+                break
+            if status in ('partial', 'corrupt'):
+                logger_storage.warning(f'Skipping the torn end of spool segment '
+                                       f'{self._path(segment)} at byte {offset}')
+            finished.append(segment)
+
+        return records, (segment, offset), finished
+
+    def _commit(self, position, finished):
+        if position != self._position:
+            self._position = position
+            path = os.path.join(self.directory, _CHECKPOINT)
+            with open(f'{path}.tmp', 'w') as f:
+                f.write(json.dumps({'segment': position[0], 'offset': position[1]}))
+            os.replace(f'{path}.tmp', path)
+
+        with self._lock:
+            # A drained spool that is filling up starts a new segment so the drained one can
+            # be deleted, without waiting for it to reach `segment_bytes`.
+            if (self._file is not None and position == (self._segment, self._file.tell())
+                    and self._bytes >= self.warn_fraction * self.max_bytes):
+                self._rotate()
+                finished = finished + [position[0]]
+
+        for segment in finished:
+            path = self._path(segment)
+            size = os.path.getsize(path)
+            os.remove(path)
+            with self._lock:
+                self._bytes -= size
+                if self._bytes < self.warn_fraction * self.max_bytes:
+                    self._warned = False
+                    self._full = False
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._segment += 1
+        self._file = open(self._path(self._segment), 'ab')  # pylint: disable=consider-using-with
+
+    def _segments(self):
+        return sorted(int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(_SEGMENT_SUFFIX))
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f'{segment:012d}{_SEGMENT_SUFFIX}')
+
+    def _read_checkpoint(self, segments):
+        try:
+            with open(os.path.join(self.directory, _CHECKPOINT)) as f:
+                checkpoint = json.loads(f.read())
+            return checkpoint['segment'], checkpoint['offset']
+        except (OSError, ValueError, KeyError):
+            return (segments[0] if segments else 0), 0
+
+
+def read_dead_letters(directory=SPOOL_DIRECTORY):
+    """Read the records moved to the dead letters of a spool directory.
+
+    Returns
+    -------
+    list(tuple)
+        (key, record) in the order they were moved, (UNREADABLE, payload) for the records
+        that could not be unpickled.
+    """
+    records = []
+    path = os.path.join(directory, DEAD_LETTERS)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            while True:
+                record, _ = _read_record(f)
+                if record is None:
+                    break
+                records.append(record)
+    return records
+
+
+def _frame(key, record):
+    payload = pickle.dumps((key, record), protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_record(f):
+    """Read the next record of a segment.
+
+    Returns
+    -------
+    tuple
+        (record, bytes read), or (None, status) where status is 'end' at the end of the
+        segment, 'partial' for a record not completely written yet or torn by a crash and
+        'corrupt' for a record failing its checksum.  A record that passes its checksum but
+        cannot be unpickled, e.g. of a class since removed, is (UNREADABLE, payload).
+    """
+    header = f.read(_HEADER.size)
+    if not header:
+        return None, 'end'
+    if len(header) < _HEADER.size:
+        return None, 'partial'
+    length, crc = _HEADER.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length:
+        return None, 'partial'
+    if zlib.crc32(payload) != crc:
+        return None, 'corrupt'
+    try:
+        record = pickle.loads(payload)
+    except Exception:  # pylint: disable=broad-except
+        record = (UNREADABLE, payload)
+    return record, _HEADER.size + length
@@ -0,0 +1,432 @@
+"""
+Stream order books over the exchange's websocket and sample them into the level two tables.
+
+A `BookStream` holds one websocket connection per exchange, subscribes to the depth channel
+of each `StreamingBookManager` and applies every update to the manager's `LocalBook`.  After
+each update the book's checksum is compared with the exchange's; on a mismatch, or an update
+arriving before the initial snapshot, the book is dropped and the manager resubscribed, the
+exchange answering a subscription with a fresh `partial` snapshot.  Updates are dropped until
+it arrives.
+
+The managers are run by the schedulers like any other manager, `get_data` samples the local
+book at the manager's interval and saves it with `OrderBookManager.add_book_to_db`.
+"""
+import asyncio
+from bisect import bisect_left, insort
+from threading import Lock, Thread
+import time
+import zlib
+
+import aiohttp
+
+from .constants import (
+    Side, NANOSECOND_FACTOR, CURRENCY_LIST, CONTRACT_LIST, BASE_OKCOIN_URL, BASE_OKEX_URL,
+    OKCOIN_WS_URL, OKEX_WS_URL, STREAM_CHECKSUM_DEPTH, STREAM_PING_INTERVAL,
+    STREAM_RECONNECT_BACKOFF, STREAM_STALE_AFTER
+)
+from .data_managers import OrderBookManager, get_future_alias_mapping
+from .logs import logger_order_book
+from .metrics import METRICS
+from .sessions import loads
+
+
+class LocalBook:
+    """Level two book kept sorted as updates are applied.
+
+    Levels are kept as the strings sent by the exchange, which the checksum is computed from.
+    """
+    def __init__(self):
+        self._levels = None
+        self._prices = None
+        self.synced = False
+        self.updated_at = None
+        self.clear()
+
+    def clear(self):
+        """Empty the book, it is not synced until the next snapshot."""
+        self._levels = {Side.asks: {}, Side.bids: {}}
+        self._prices = {Side.asks: [], Side.bids: []}
+        self.synced = False
+
+    def apply_snapshot(self, asks, bids):
+        """Replace the book with a full snapshot, [[price, size, ...], ...] per side."""
+        self.clear()
+        self.apply_update(asks, bids)
+        self.synced = True
+
+    def apply_update(self, asks, bids):
+        """Apply changed levels, [[price, size, ...], ...] per side, a size of 0 removes the
+        level."""
+        self._apply(Side.asks, asks)
+        self._apply(Side.bids, bids)
+        self.updated_at = time.time()
+
+    def _apply(self, side, levels):
+        book = self._levels[side]
+        prices = self._prices[side]
+        for level in levels:
+            price = float(level[0])
+            if float(level[1]) == 0:
+                if book.pop(price, None) is not None:
+                    del prices[bisect_left(prices, price)]
+            else:
+                if price not in book:
+                    insort(prices, price)
+                book[price] = (str(level[0]), str(level[1]))
+
+    def best(self, side, depth=None):
+        """Get the levels of a side from the best price, [(price, size), ...] as strings."""
+        prices = self._prices[side]
+        if side is Side.asks:
+            selected = prices[:depth]
+        else:
+            selected = prices[::-1][:depth]
+        book = self._levels[side]
+        return [book[price] for price in selected]
+
+    def checksum(self, depth=STREAM_CHECKSUM_DEPTH):
+        """The exchange's checksum of the book; the signed crc32 of the best `depth` bids and
+        asks interleaved as 'bid price:bid size:ask price:ask size:...'."""
+        bids = self.best(Side.bids, depth)
+        asks = self.best(Side.asks, depth)
+        fields = []
+        for i in range(max(len(bids), len(asks))):
+            if i < len(bids):
+                fields.extend(bids[i])
+            if i < len(asks):
+                fields.extend(asks[i])
+        crc = zlib.crc32(':'.join(fields).encode())
+        return crc - 2 ** 32 if crc >= 2 ** 31 else crc
+
+    def to_book(self, depth=None):
+        """Get the book in the order returned by the REST api, asks from the worst price and
+        bids from the best, as accepted by `parse_level_two_book`.
+
+        Parameters
+        ----------
+        depth: int
+            Number of levels of each side, None for all levels.
+        """
+        return {'asks': [[float(price), float(size)]
+                         for price, size in self.best(Side.asks, depth)[::-1]],
+                'bids': [[float(price), float(size)]
+                         for price, size in self.best(Side.bids, depth)]}
+
+    def __len__(self):
+        return len(self._prices[Side.asks]) + len(self._prices[Side.bids])
+
+
+class StreamingBookManager(OrderBookManager):
+    """Order book manager sampling a book maintained from the exchange's websocket.
+
+    Parameters
+    ----------
+    asset_name: str
+        Name of the asset, e.g. 'spot_btc', the table the books are written to.
+    mysql_table: str
+        Name of the table used to identify the manager.
+    url: str
+        REST url of the book, identifies the manager like the polling managers' url.
+    ws_url: str
+        Websocket url of the exchange, e.g. constants.OKEX_WS_URL.
+    channel: str
+        Websocket channel, e.g. 'spot/depth' or 'futures/depth'.
+    instrument_id: str
+        Instrument of the channel, e.g. 'BTC-USD' or 'BTC-USD-200626'.
+    depth: int
+        Number of levels of each side sampled, None for all levels.
+    storage_mode: str
+        See OrderBookManager.
+    """
+    uses_rest = False
+
+    def __init__(self, asset_name, mysql_table, url, ws_url, channel, instrument_id, depth=None,
+                 storage_mode='snapshot'):
+        super().__init__(asset_name=asset_name, mysql_table=mysql_table, url=url,
+                         storage_mode=storage_mode)
+        self.ws_url = ws_url
+        self.channel = channel
+        self.instrument_id = instrument_id
+        self.depth = depth
+        self.book = LocalBook()
+        self.stream = None
+        self.instrument_template = None
+        self._book_lock = Lock()
+        # A partial is expected after subscribing, until it arrives updates are dropped.
+        self._awaiting_partial = True
+
+    @property
+    def subscription(self):
+        """str: The channel and instrument subscribed to, e.g. 'spot/depth:BTC-USD'."""
+        return f'{self.channel}:{self.instrument_id}'
+
+    def handle_message(self, action, data):
+        """Apply a depth message to the local book, resubscribing on a gap.
+
+        Parameters
+        ----------
+        action: str
+            'partial' for a snapshot, 'update' for changed levels.
+        data: dict
+            The book data with 'asks', 'bids' and 'checksum'.
+        """
+        with self._book_lock:
+            if action == 'partial':
+                self.book.apply_snapshot(data.get('asks', []), data.get('bids', []))
+                self._awaiting_partial = False
+            elif self.book.synced:
+                self.book.apply_update(data.get('asks', []), data.get('bids', []))
+            else:
+                if not self._awaiting_partial:
+                    self._resync('update before snapshot')
+                return
+
+            checksum = data.get('checksum')
+            if checksum is not None and self.book.checksum() != checksum:
+                self._resync('checksum mismatch')
+
+    def _resync(self, reason):
+        """Drop the book and resubscribe for a fresh partial, called with the book lock held.
+
+        The REST snapshot is not used, its levels can't be lined up with the stream's
+        checksums and it is deeper than the levels the stream updates.  Resubscribing only
+        queues messages on the stream's loop, nothing blocks the loop's thread.
+        """
+        logger_order_book.warning(f'Resyncing {self.mysql_table}: {reason}')
+        self.record_error('stream_gap')
+        self.book.clear()
+        self._awaiting_partial = True
+        if self.stream is not None:
+            self.stream.resync(self)
+
+    def mark_unsynced(self):
+        """Drop the book after a disconnection, the next partial message rebuilds it."""
+        with self._book_lock:
+            self.book.clear()
+            self._awaiting_partial = True
+
+    def get_data(self):
+        """Sample the local book and save it, skipping books not synced or not updated
+        within `STREAM_STALE_AFTER` seconds."""
+        with self._book_lock:
+            if not self.book.synced or time.time() - self.book.updated_at > STREAM_STALE_AFTER:
+                logger_order_book.warning(f'Not sampling {self.mysql_table}, stream is stale.')
+                self.record_error('stream_stale')
+                return
+            book = self.book.to_book(self.depth)
+
+        self.handle_result(int(time.time() * NANOSECOND_FACTOR), None, book)
+
+    def track_instrument(self, contract, url_template, instrument_template):
+        """Follow a futures contract alias, see `BaseManager.track_contract`.
+
+        Parameters
+        ----------
+        instrument_template: str
+            The instrument id with a `{delivery}` field, e.g. 'BTC-USD-{delivery}'.
+        """
+        self.instrument_template = instrument_template
+        return self.track_contract(contract, url_template)
+
+    def roll_contract(self, alias_mapping):
+        """Point the url and subscription at the contract now trading under the alias."""
+        rolled = super().roll_contract(alias_mapping)
+        if rolled:
+            previous = self.subscription
+            self.instrument_id = self.instrument_template.format(
+                delivery=alias_mapping[self.contract])
+            self.mark_unsynced()
+            if self.stream is not None:
+                self.stream.resubscribe(previous, self)
+        return rolled
+
+
+class BookStream:
+    """Websocket connection to an exchange feeding the books of streaming managers.
+
+    Parameters
+    ----------
+    url: str
+        Websocket url, e.g. constants.OKEX_WS_URL.
+    managers: list(StreamingBookManager)
+        Managers whose books are fed by the connection.
+    """
+    def __init__(self, url, managers):
+        self.url = url
+        self.managers = {manager.subscription: manager for manager in managers}
+        for manager in managers:
+            manager.stream = self
+        self.messages = 0
+        self._loop = None
+        self._websocket = None
+        self._stop = None
+        self._thread = None
+
+    def start(self):
+        """Run the connection in a daemon thread with its own event loop."""
+        self._thread = Thread(target=asyncio.run, args=(self.run(),), name='locrian_stream',
+                              daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """Close the connection and stop `run`."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def resubscribe(self, previous, manager):
+        """Move a manager to its new subscription, e.g. after its contract rolled."""
+        self.managers.pop(previous, None)
+        self.managers[manager.subscription] = manager
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._send_resubscribe(previous, manager),
+                                             self._loop)
+
+    def resync(self, manager):
+        """Unsubscribe and subscribe a manager again, the exchange answering with a partial.
+        Safe to call from the stream's loop, the messages are sent by a separate task."""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(
+                self._send_resubscribe(manager.subscription, manager), self._loop)
+
+    async def _send_resubscribe(self, previous, manager):
+        if self._websocket is not None and not self._websocket.closed:
+            await self._websocket.send_json({'op': 'unsubscribe', 'args': [previous]})
+            await self._websocket.send_json({'op': 'subscribe',
+                                             'args': [manager.subscription]})
+
+    async def run(self):
+        """Connect, subscribe and apply messages until `stop`, reconnecting after errors with
+        exponential backoff."""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        backoff = STREAM_RECONNECT_BACKOFF
+
+        async with aiohttp.ClientSession() as session:
+            while not self._stop.is_set():
+                try:
+                    await self._connect(session)
+                    backoff = STREAM_RECONNECT_BACKOFF
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as exc:
+                    logger_order_book.warning(f'Stream {self.url} disconnected: {exc!r}')
+                for manager in self.managers.values():
+                    manager.mark_unsynced()
+                if not self._stop.is_set():
+                    try:
+                        await asyncio.wait_for(self._stop.wait(), backoff)
+                    except asyncio.TimeoutError:
+                        pass
+                    backoff = min(backoff * 2, 60)
+
+    async def _connect(self, session):
+        async with session.ws_connect(self.url, heartbeat=None) as websocket:
+            self._websocket = websocket
+            await websocket.send_json({'op': 'subscribe', 'args': list(self.managers)})
+            ping = asyncio.ensure_future(self._ping(websocket))
+            stop = asyncio.ensure_future(self._stop.wait())
+            try:
+                while not self._stop.is_set():
+                    receive = asyncio.ensure_future(websocket.receive())
+                    await asyncio.wait({receive, stop}, return_when=asyncio.FIRST_COMPLETED)
+                    if not receive.done():
+                        receive.cancel()
+                        break
+                    message = receive.result()
+                    if message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED,
+                                        aiohttp.WSMsgType.ERROR):
+                        raise aiohttp.ClientConnectionError(f'websocket closed {message.data}')
+                    self.handle_raw(message.data)
+            finally:
+                ping.cancel()
+                stop.cancel()
+                self._websocket = None
+
+    async def _ping(self, websocket):
+        while True:
+            await asyncio.sleep(STREAM_PING_INTERVAL)
+            await websocket.send_str('ping')
+
+    def handle_raw(self, raw):
+        """Decode a websocket message, deflate compressed binary or text, and apply it."""
+        if isinstance(raw, bytes):
+            raw = zlib.decompress(raw, -zlib.MAX_WBITS)
+        if raw in ('pong', b'pong'):
+            return
+        try:
+            message = loads(raw)
+        except ValueError:
+            logger_order_book.warning(f'Stream {self.url} sent invalid json {raw[:100]!r}')
+            return
+
+        if 'event' in message:
+            if message['event'] == 'error':
+                logger_order_book.warning(f'Stream {self.url} error: {message}')
+            return
+
+        for data in message.get('data', []):
+            manager = self.managers.get(f'{message.get("table")}:{data.get("instrument_id")}')
+            if manager is not None:
+                self.messages += 1
+                with METRICS.timer(manager.mysql_table, 'stream_apply'):
+                    manager.handle_message(message.get('action'), data)
+
+
+def get_streaming_book_managers(currencies=CURRENCY_LIST, contracts=CONTRACT_LIST,
+                                spot_depth=500, future_depth=200, storage_mode='snapshot'):
+    """Get streaming order book managers for the spot and futures books, the streaming
+    version of `data_managers.get_managers`.
+
+    Parameters
+    ----------
+    currencies: iterable
+        Currencies to collect, e.g. ('btc', 'eth').
+    contracts: iterable
+        Futures contract aliases to collect, a subset of CONTRACT_LIST.
+    spot_depth: int
+        Number of levels of spot books sampled, at most the levels sent by the stream.
+    future_depth: int
+        Number of levels of futures books sampled.
+    storage_mode: str
+        Storage mode of the managers, either 'snapshot' or 'delta'.
+    """
+    managers = []
+    contract_alias_map = get_future_alias_mapping()
+
+    for currency in currencies:
+        managers.append(StreamingBookManager(
+            asset_name=f'spot_{currency}', mysql_table=f'spot_{currency}_usd_orderbook',
+            url=f'{BASE_OKCOIN_URL}{currency.upper()}-USD/book?size={spot_depth}',
+            ws_url=OKCOIN_WS_URL, channel='spot/depth', instrument_id=f'{currency.upper()}-USD',
+            depth=spot_depth, storage_mode=storage_mode))
+
+        for contract in contracts:
+            url_template = (f'{BASE_OKEX_URL}{currency.upper()}-USD-{{delivery}}'
+                            f'/book?size={future_depth}')
+            instrument_template = f'{currency.upper()}-USD-{{delivery}}'
+            delivery = contract_alias_map[contract]
+            managers.append(StreamingBookManager(
+                asset_name=f'future_{currency}_{contract}',
+                mysql_table=f'future_{currency}_usd_{contract}_orderbook',
+                url=url_template.format(delivery=delivery), ws_url=OKEX_WS_URL,
+                channel='futures/depth', instrument_id=instrument_template.format(
+                    delivery=delivery),
+                depth=future_depth, storage_mode=storage_mode)
+                .track_instrument(contract, url_template, instrument_template))
+
+    return managers
+
+
+def start_book_streams(managers):
+    """Start a `BookStream` per exchange for the streaming managers.
+
+    Returns
+    -------
+    list(BookStream)
+        The running streams.
+    """
+    by_url = {}
+    for manager in managers:
+        by_url.setdefault(manager.ws_url, []).append(manager)
+    return [BookStream(url, url_managers).start() for url, url_managers in by_url.items()]
@@ -0,0 +1,115 @@
+"""
+Cache of recently saved trade identifiers used to drop repeated trades without querying the
+database.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+from .constants import TRADE_ID_CACHE_SIZE
+from .metrics import METRICS
+
+
+class TradeIdCache:
+    """Bounded cache of the trade identifiers saved for one table.
+
+    Trade identifiers increase over time, so the cache keeps the largest identifier saved (the
+    high water mark), loaded from the table when warmed and raised as trades are saved, and a
+    ring of the most recently saved identifiers.  A trade is considered seen if it is in the
+    ring or at or below the high water mark.
+
+    Parameters
+    ----------
+    max_size: int
+        The number of recent trade identifiers to keep.
+    name: str
+        Name the hits, misses and size are published under in the metrics, e.g. the table,
+        None to not publish them.
+    """
+    def __init__(self, max_size=TRADE_ID_CACHE_SIZE, name=None):
+        self.max_size = max_size
+        self.name = name
+        self.high_water_mark = None
+        self.hits = 0
+        self.misses = 0
+        self._recent = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def is_warm(self):
+        """bool: True once the high water mark has been loaded from the database."""
+        return self.high_water_mark is not None
+
+    def warm(self, max_tid):
+        """Set the high water mark from the largest trade identifier in the table.
+
+        Parameters
+        ----------
+        max_tid: int or None
+            The largest saved trade identifier, None if the table is empty.
+        """
+        with self._lock:
+            self.high_water_mark = -1 if max_tid is None else int(max_tid)
+
+    def filter_new(self, tids):
+        """Get the trade identifiers that have not been seen, counting hits and misses.
+
+        Parameters
+        ----------
+        tids: list(int)
+            Trade identifiers to check.
+
+        Returns
+        -------
+        list(int)
+            The trade identifiers not in the cache, in the order given.
+        """
+        new_tids = []
+        with self._lock:
+            for tid in tids:
+                if tid in self._recent or (self.is_warm and tid <= self.high_water_mark):
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    new_tids.append(tid)
+
+        if self.name is not None:
+            METRICS.increment(self.name, 'tid_cache_hits', len(tids) - len(new_tids))
+            METRICS.increment(self.name, 'tid_cache_misses', len(new_tids))
+        return new_tids
+
+    def add(self, tids):
+        """Record trade identifiers as saved, evicting the oldest beyond `max_size`, and raise
+        the high water mark of a warm cache.
+
+        Parameters
+        ----------
+        tids: list(int)
+            Trade identifiers that have been saved.
+        """
+        with self._lock:
+            for tid in tids:
+                self._recent[tid] = None
+                self._recent.move_to_end(tid)
+            while len(self._recent) > self.max_size:
+                self._recent.popitem(last=False)
+            if self.is_warm and tids:
+                self.high_water_mark = max(self.high_water_mark, max(tids))
+            size = len(self._recent)
+
+        if self.name is not None:
+            METRICS.set_gauge(self.name, 'tid_cache_size', size)
+
+    def stats(self):
+        """Get the cache counters.
+
+        Returns
+        -------
+        dict
+            Hits (database lookups saved), misses, size and high water mark.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._recent),
+                    'high_water_mark': self.high_water_mark}
+
+    def __len__(self):
+        return len(self._recent)
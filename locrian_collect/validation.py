@@ -0,0 +1,57 @@
+"""
+Validation of the data returned by the exchange.
+"""
+from .constants import Side
+
+
+def validate_level_two_book(book):
+    """Check a level two book.
+
+    Checks both sides are present and not empty, every level has a price and volume that are
+    numbers, no price appears twice on a side and the book is not crossed.  The levels may come
+    in any order, `LevelTwoBook` sorts them, so the checks are made on the sorted prices.
+
+    Parameters
+    ----------
+    book: dict
+        The level two book as a dict; {'side': [price, volume]}
+
+    Returns
+    -------
+    str or None
+        Description of the first problem found, None if the book is valid.
+    """
+    if not isinstance(book, dict):
+        return f'book is a {type(book).__name__} not a dict'
+
+    best_prices = {}
+
+    for side in (Side.asks, Side.bids):
+        levels = book.get(side.name)
+        if not isinstance(levels, list) or not levels:
+            return f'{side.name} missing or empty'
+
+        prices = []
+        for level in levels:
+            try:
+                price = float(level[0])
+                volume = float(level[1])
+            except (TypeError, ValueError, IndexError, KeyError):
+                return f'{side.name} level {level} is not [price, volume, ...]'
+
+            if not price > 0 or not volume >= 0:
+                return f'{side.name} level {level} has a non positive price or negative volume'
+            prices.append(price)
+
+        # Sorting the exchange's descending or ascending order is linear.
+        prices.sort()
+        for previous_price, price in zip(prices, prices[1:]):
+            if price == previous_price:
+                return f'{side.name} price {price} appears more than once'
+        best_prices[side] = prices[0] if side is Side.asks else prices[-1]
+
+    if best_prices[Side.bids] >= best_prices[Side.asks]:
+        return (f'book is crossed, best bid {best_prices[Side.bids]} >= '
+                f'best ask {best_prices[Side.asks]}')
+
+    return None
@@ -0,0 +1,169 @@
+"""
+Write-behind buffer decoupling requests to the exchange from writes to the database.
+
+Managers submit parsed records to a bounded queue and return straight away.  A dedicated
+writer thread groups the records by table and writes each table's records in one batch
+once `batch_size` records are waiting or every `flush_interval` seconds.  The queue depth,
+flush durations and counters are published in the metrics under `write_behind`.
+"""
+import queue
+from threading import Thread, Lock
+import time
+
+from .constants import (
+    WRITE_BEHIND_QUEUE_SIZE, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_INTERVAL,
+    WRITE_BEHIND_PUT_TIMEOUT
+)
+from .logs import logger_storage
+from .metrics import METRICS
+
+METRICS_NAME = 'write_behind'
+_STOP = object()
+
+
+class WriteBehindWriter:
+    """Bounded queue of records flushed in batches by a writer thread.
+
+    Parameters
+    ----------
+    max_queue_size: int
+        Maximum number of records waiting in the queue.  When full, `submit` blocks for up
+        to `put_timeout` seconds and then drops the record.
+    batch_size: int
+        Number of records of a table that triggers a flush of that table.
+    flush_interval: float
+        Maximum number of seconds a record waits before it is flushed.
+    put_timeout: float
+        Seconds `submit` waits for space in a full queue.
+    """
+    def __init__(self, max_queue_size=WRITE_BEHIND_QUEUE_SIZE, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL, put_timeout=WRITE_BEHIND_PUT_TIMEOUT):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._pending = {}
+        self._thread = Thread(target=self._run, name='locrian_write_behind', daemon=True)
+        self._stats_lock = Lock()
+        self._stats = {'submitted': 0, 'dropped': 0, 'flushes': 0, 'flushed_records': 0,
+                       'flush_errors': 0, 'last_flush_seconds': 0.0, 'max_flush_seconds': 0.0}
+
+    def start(self):
+        """Start the writer thread."""
+        self._thread.start()
+        return self
+
+    def submit(self, key, record, flush_fn):
+        """Queue a record to be written.
+
+        Parameters
+        ----------
+        key: hashable
+            Records with the same key are flushed together, e.g. (database, table).
+        record:
+            The record to write.
+        flush_fn: callable
+            Called from the writer thread with the list of records of a key.
+
+        Returns
+        -------
+        bool
+            False if the queue stayed full for `put_timeout` seconds and the record was dropped.
+        """
+        try:
+            self._queue.put((key, record, flush_fn), timeout=self.put_timeout)
+        except queue.Full:
+            self._increment('dropped')
+            METRICS.increment(METRICS_NAME, 'errors_dropped')
+            logger_storage.warning(f'Write-behind queue full, dropped a record for {key}')
+            return False
+        self._increment('submitted')
+        METRICS.increment(METRICS_NAME, 'records_submitted')
+        METRICS.set_gauge(METRICS_NAME, 'queue_depth', self.queue_depth)
+        return True
+
+    def close(self, timeout=None):
+        """Flush every queued record and stop the writer thread.
+
+        Parameters
+        ----------
+        timeout: float
+            Seconds to wait for the writer thread, None to wait until it finishes.
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    @property
+    def queue_depth(self):
+        """int: Number of records waiting in the queue."""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Get the writer's counters, queue depth and flush latencies in seconds."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self.queue_depth
+        return stats
+
+    def _run(self):
+        next_flush = time.time() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(next_flush - time.time(), 0))
+            except queue.Empty:
+                item = None
+            METRICS.set_gauge(METRICS_NAME, 'queue_depth', self.queue_depth)
+
+            if item is _STOP:
+                self._drain()
+                self._flush_all()
+                return
+
+            if item is not None:
+                key, record, flush_fn = item
+                records = self._pending.setdefault(key, (flush_fn, []))[1]
+                records.append(record)
+                if len(records) >= self.batch_size:
+                    self._flush(key)
+
+            if time.time() >= next_flush:
+                self._flush_all()
+                next_flush = time.time() + self.flush_interval
+
+    def _drain(self):
+        while True:
+            try:
+                key, record, flush_fn = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._pending.setdefault(key, (flush_fn, []))[1].append(record)
+
+    def _flush_all(self):
+        for key in list(self._pending):
+            self._flush(key)
+
+    def _flush(self, key):
+        flush_fn, records = self._pending.pop(key)
+        start = time.time()
+        try:
+            flush_fn(records)
+        except Exception as exc:  # pylint: disable=broad-except
+            # The writer thread must survive a failed write, the batch is lost.
+            self._increment('flush_errors')
+            METRICS.increment(METRICS_NAME, 'errors_flush')
+            logger_storage.warning(f'Error flushing {len(records)} records for {key}: {exc!r}')
+            return
+        elapsed = time.time() - start
+
+        with self._stats_lock:
+            self._stats['flushes'] += 1
+            self._stats['flushed_records'] += len(records)
+            self._stats['last_flush_seconds'] = elapsed
+            self._stats['max_flush_seconds'] = max(self._stats['max_flush_seconds'], elapsed)
+        METRICS.observe(METRICS_NAME, 'flush', elapsed)
+        METRICS.increment(METRICS_NAME, 'records_flushed', len(records))
+
+    def _increment(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
@@ -0,0 +1,36 @@
+import argparse
+
+from locrian_collect.collector import load_config, run_collector
+
+
+parser = argparse.ArgumentParser(
+    description='Collect order books, futures indexes and trades in one process.')
+parser.add_argument('--config', help='Path of the json collector config, see collector.py.')
+parser.add_argument('--archive', action='store_true',
+                    help='Also write the data to the local parquet archive.')
+parser.add_argument('--write-behind', action='store_true',
+                    help='Queue database writes and flush them in batches from a writer thread.')
+parser.add_argument('--spool',
+                    help='Write records through a crash-safe spool in this directory, which '
+                         'keeps them on disk while the database is unavailable.')
+parser.add_argument('--metrics-port', type=int,
+                    help='Serve latency and throughput metrics on localhost at this port.')
+parser.add_argument('--metrics-file',
+                    help='Write a json snapshot of the metrics to this file every minute.')
+args = parser.parse_args()
+
+config = load_config(args.config)
+
+if args.metrics_port is not None:
+    from locrian_collect.metrics import serve_metrics
+    serve_metrics(args.metrics_port)
+if args.metrics_file:
+    from locrian_collect.metrics import start_snapshot_writer
+    start_snapshot_writer(args.metrics_file)
+
+sinks = []
+if args.archive:
+    from locrian_collect.archive import ParquetSink
+    sinks.append(ParquetSink())
+
+run_collector(config, sinks=sinks, write_behind=args.write_behind, spool=args.spool)
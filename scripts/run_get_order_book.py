@@ -1,4 +1,34 @@
-from locrian_collect.scheduler import schedule_get_order_book_and_index_data
+import argparse
 
+from locrian_collect.scheduler import schedule_get_order_book_and_index_data, SCHEDULER_MODES
 
-schedule_get_order_book_and_index_data()
+
+parser = argparse.ArgumentParser(description='Collect order book and futures index data.')
+parser.add_argument('--mode', choices=SCHEDULER_MODES, default='thread')
+parser.add_argument('--archive', action='store_true',
+                    help='Also write the data to the local parquet archive.')
+parser.add_argument('--write-behind', action='store_true',
+                    help='Queue database writes and flush them in batches from a writer thread.')
+parser.add_argument('--spool',
+                    help='Write records through a crash-safe spool in this directory, which '
+                         'keeps them on disk while the database is unavailable.')
+parser.add_argument('--metrics-port', type=int,
+                    help='Serve latency and throughput metrics on localhost at this port.')
+parser.add_argument('--metrics-file',
+                    help='Write a json snapshot of the metrics to this file every minute.')
+args = parser.parse_args()
+
+if args.metrics_port is not None:
+    from locrian_collect.metrics import serve_metrics
+    serve_metrics(args.metrics_port)
+if args.metrics_file:
+    from locrian_collect.metrics import start_snapshot_writer
+    start_snapshot_writer(args.metrics_file)
+
+sinks = []
+if args.archive:
+    from locrian_collect.archive import ParquetSink
+    sinks.append(ParquetSink())
+
+schedule_get_order_book_and_index_data(mode=args.mode, sinks=sinks,
+                                       write_behind=args.write_behind, spool=args.spool)
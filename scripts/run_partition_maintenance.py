@@ -0,0 +1,39 @@
+import argparse
+
+from locrian_collect.archive import ARCHIVE_DIRECTORY
+from locrian_collect.collector import load_config
+from locrian_collect.logs import configure_logging
+from locrian_collect.partitions import (
+    create_book_table, get_partitions, maintain_partitions, partition_table
+)
+from locrian_collect.reader import collected_tables
+
+
+parser = argparse.ArgumentParser(
+    description='Add daily partitions to the level two tables and compact old partitions, '
+                'run daily.')
+parser.add_argument('--config', help='Path of the json collector config, see collector.py.')
+parser.add_argument('--create', action='store_true',
+                    help='Create the missing level two tables, partitioned by day.')
+parser.add_argument('--partition-existing', action='store_true',
+                    help='Partition existing unpartitioned tables, this rebuilds the tables.')
+parser.add_argument('--archive-directory', default=ARCHIVE_DIRECTORY,
+                    help='Root directory of the parquet archive for the archive retention.')
+args = parser.parse_args()
+
+configure_logging()
+config = load_config(args.config)
+delta = config['order_book'] is not None and config['order_book']['storage_mode'] == 'delta'
+tables = collected_tables(config['currencies'], config['contracts'], delta)['locrian_level_two']
+
+for table, kind in tables:
+    if args.create:
+        create_book_table(table, delta=kind == 'delta', schema=config['schema'])
+    if args.partition_existing and not get_partitions(table):
+        partition_table(table)
+
+for table, partition, action in maintain_partitions([table for table, _ in tables],
+                                                    config['retention'],
+                                                    archive_directory=args.archive_directory,
+                                                    schema=config['schema']):
+    print(f'{table} {partition} {action}')
@@ -0,0 +1,27 @@
+import argparse
+
+from locrian_collect.collector import load_config
+from locrian_collect.logs import configure_logging
+from locrian_collect.reader import collected_tables
+from locrian_collect.schema import create_tables, migrate_tables
+
+
+parser = argparse.ArgumentParser(
+    description='Create the missing tables of the collected instruments, run before the first '
+                'collection.')
+parser.add_argument('--config', help='Path of the json collector config, see collector.py.')
+parser.add_argument('--migrate', action='store_true',
+                    help='Copy existing tables without a primary key to the current schema, '
+                         'keeping the originals as {table}__old.  Stop the collectors first.')
+args = parser.parse_args()
+
+configure_logging()
+config = load_config(args.config)
+delta = config['order_book'] is not None and config['order_book']['storage_mode'] == 'delta'
+tables = collected_tables(config['currencies'], config['contracts'], delta)
+
+if args.migrate:
+    for database_name, table, rows in migrate_tables(tables, config['schema']):
+        print(f'migrated {database_name}.{table} {rows} rows')
+for database_name, table in create_tables(tables, config['schema']):
+    print(f'created {database_name}.{table}')
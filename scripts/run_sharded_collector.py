@@ -0,0 +1,35 @@
+import argparse
+
+from locrian_collect.collector import load_config
+from locrian_collect.logs import configure_logging
+from locrian_collect.sharding import Supervisor
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Collect with the managers partitioned across worker processes.')
+    parser.add_argument('--config', help='Path of the json collector config, see collector.py.')
+    parser.add_argument('--shards', type=int, default=4, help='Number of worker processes.')
+    parser.add_argument('--archive', action='store_true',
+                        help='Also write the data to the local parquet archive.')
+    parser.add_argument('--write-behind', action='store_true',
+                        help='Queue database writes and flush them in batches from a writer '
+                             'thread.')
+    parser.add_argument('--spool',
+                        help='Write records through a crash-safe spool per shard in this '
+                             'directory, which keeps them on disk while the database is '
+                             'unavailable.')
+    parser.add_argument('--health-file',
+                        help='Write the aggregated health of the shards to this json file.')
+    args = parser.parse_args()
+
+    configure_logging()
+    supervisor = Supervisor(args.shards, args=(load_config(args.config),),
+                            kwargs={'archive': args.archive, 'write_behind': args.write_behind,
+                                    'spool': args.spool})
+    supervisor.start().run(health_path=args.health_file)
+
+
+# Workers are spawned and import this module, only the supervisor runs main.
+if __name__ == '__main__':
+    main()
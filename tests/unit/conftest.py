@@ -1 +1,14 @@
-from .test_parse_level_two_book import mock_book
\ No newline at end of file
+import pytest
+
+from locrian_collect.metrics import METRICS
+from locrian_collect.rate_limit import reset_rate_limiters
+
+from .test_parse_level_two_book import mock_book
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    """Start every test with empty metrics and rate limiters."""
+    METRICS.clear()
+    reset_rate_limiters()
+    yield
@@ -0,0 +1,54 @@
+"""
+Test the parquet archive.
+"""
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from locrian_collect.archive import ParquetSink, read_archive, HOUR_IN_NANOSECONDS
+
+pytest.importorskip('pyarrow')
+
+
+def frame(timestamp, rows=2):
+    return pd.DataFrame({'timestamp': [timestamp] * rows, 'price': [1.5] * rows})
+
+
+def test_write_and_read(tmp_path):
+    """Test rows are partitioned by hour and only complete files are visible."""
+    sink = ParquetSink(base_directory=f'{tmp_path}', row_group_size=3)
+    sink.write('locrian_level_two', 'spot_btc', frame(1), 1)
+    sink.write('locrian_level_two', 'spot_btc', frame(2), 2)
+
+    # The first hour is still open so is only written to a temporary file.
+    assert read_archive('locrian_level_two', 'spot_btc', f'{tmp_path}').empty
+    assert glob.glob(f'{tmp_path}/**/*.tmp', recursive=True)
+
+    sink.write('locrian_level_two', 'spot_btc', frame(HOUR_IN_NANOSECONDS), HOUR_IN_NANOSECONDS)
+    sink.close()
+
+    paths = sorted(glob.glob(f'{tmp_path}/locrian_level_two/spot_btc/*/*/*.parquet'))
+    assert [os.path.relpath(path, tmp_path) for path in paths] == [
+        'locrian_level_two/spot_btc/date=1970-01-01/hour=00/part-1.parquet',
+        'locrian_level_two/spot_btc/date=1970-01-01/hour=01/part-3600000000000.parquet']
+    assert not glob.glob(f'{tmp_path}/**/*.tmp', recursive=True)
+
+    result = read_archive('locrian_level_two', 'spot_btc', f'{tmp_path}')
+    assert result['timestamp'].tolist() == [1, 1, 2, 2, HOUR_IN_NANOSECONDS, HOUR_IN_NANOSECONDS]
+
+
+def test_manager_writes_to_sink(mocker, mock_book):
+    """Test an order book manager writes the parsed book to its sinks."""
+    from locrian_collect.data_managers import OrderBookManager
+
+    mocker.patch('locrian_collect.data_managers.get_engine')
+    mocker.patch('locrian_collect.data_managers.insert_frame')
+    sink = mocker.Mock()
+    manager = OrderBookManager('spot_btc', 'test_table', 'test_url')
+    manager.sinks.append(sink)
+    manager.add_book_to_db(123, mock_book)
+
+    dataset, table, book, timestamp = sink.write.call_args[0]
+    assert (dataset, table, len(book), timestamp) == ('locrian_level_two', 'spot_btc', 20, 123)
@@ -0,0 +1,116 @@
+"""
+Test the asyncio scheduler against a local HTTP server.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import pytest
+
+from locrian_collect.async_scheduler import collect_tick
+from locrian_collect.data_managers import BaseManager
+from locrian_collect.metrics import METRICS
+
+
+class RecordingManager(BaseManager):
+    """Manager recording the results it is given."""
+    def __init__(self, url):
+        super().__init__(mysql_table=url.rsplit('/', 1)[-1], url=url, database_name='test')
+        self.results = []
+
+    def handle_result(self, request_time, return_time, result):
+        if result == {'sleep': True}:
+            time.sleep(0.5)
+        self.results.append(result)
+        if result == {'raise': True}:
+            raise RuntimeError('write failed')
+
+
+class SamplingManager(BaseManager):
+    """Manager sampling local state rather than requesting its url, like a streaming
+    manager."""
+    uses_rest = False
+
+    def __init__(self):
+        super().__init__(mysql_table='sampled', url='http://unreachable', database_name='test')
+        self.calls = 0
+
+    def get_data(self):
+        self.calls += 1
+
+
+async def _run_tick(routes, paths, max_concurrent_requests=2, extra_managers=()):
+    app = web.Application()
+    app.add_routes(routes)
+    server = TestServer(app)
+    await server.start_server()
+    managers = [RecordingManager(f'{server.make_url(path)}') for path in paths]
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        async with aiohttp.ClientSession() as session:
+            start = time.time()
+            writes = await collect_tick(managers + list(extra_managers), session,
+                                        asyncio.Semaphore(max_concurrent_requests), executor)
+            tick_time = time.time() - start
+            await asyncio.wait(writes)
+    finally:
+        executor.shutdown()
+        await server.close()
+    return managers, tick_time
+
+
+@pytest.fixture
+def patch_loggers(mocker):
+    mocker.patch('locrian_collect.async_scheduler.logger_order_book', logging.getLogger())
+
+
+def test_collect_tick(patch_loggers):
+    """Test every manager gets the decoded result of its own request."""
+    async def book(request):
+        return web.json_response({'path': request.path})
+
+    routes = [web.get('/book_a', book), web.get('/book_b', book)]
+    managers, _ = asyncio.run(_run_tick(routes, ['/book_a', '/book_b']))
+
+    assert [manager.results for manager in managers] == [[{'path': '/book_a'}],
+                                                         [{'path': '/book_b'}]]
+
+
+def test_collect_tick_failures(patch_loggers, caplog):
+    """Test a bad response and a failing write are logged without stopping the tick."""
+    async def not_json(request):
+        return web.Response(text='not json')
+
+    async def raises(request):
+        return web.json_response({'raise': True})
+
+    async def book(request):
+        return web.json_response({'asks': []})
+
+    routes = [web.get('/not_json', not_json), web.get('/raises', raises), web.get('/book', book)]
+    managers, _ = asyncio.run(_run_tick(routes, ['/not_json', '/raises', '/book']))
+
+    assert [manager.results for manager in managers] == [[None], [{'raise': True}],
+                                                         [{'asks': []}]]
+    messages = [record[2] for record in caplog.record_tuples]
+    assert "Error saving raises: RuntimeError('write failed')" in messages
+    assert METRICS.snapshot()['not_json']['counters'] == {'errors_decode': 1}
+
+
+def test_collect_tick_does_not_wait_for_writes(patch_loggers):
+    """Test a slow write does not hold up the tick, and managers not making REST requests run
+    get_data in the executor."""
+    async def slow_write(request):
+        return web.json_response({'sleep': True})
+
+    sampled = SamplingManager()
+    managers, tick_time = asyncio.run(_run_tick([web.get('/slow', slow_write)], ['/slow'],
+                                                extra_managers=[sampled]))
+
+    assert tick_time < 0.4
+    assert managers[0].results == [{'sleep': True}]
+    assert sampled.calls == 1
@@ -0,0 +1,45 @@
+"""
+Test delta encoding of level two books.
+"""
+import pandas as pd
+
+from locrian_collect.book_delta import diff_books, reconstruct_book
+from locrian_collect.parse_level_two_book import parse_level_two_book
+
+
+BOOKS = [
+    {'asks': [[3.0, 1.0], [2.0, 1.0]], 'bids': [[1.0, 1.0], [0.5, 2.0]]},
+    {'asks': [[3.0, 1.0], [2.0, 4.0]], 'bids': [[1.0, 1.0], [0.5, 2.0]]},
+    {'asks': [[3.0, 1.0], [2.5, 1.0], [2.0, 4.0]], 'bids': [[0.5, 2.0]]},
+    {'asks': [[2.5, 1.0]], 'bids': [[1.5, 3.0], [0.5, 2.0]]},
+]
+
+
+def test_diff_books():
+    """Test changed, added and removed levels are in the delta."""
+    previous = parse_level_two_book(1, BOOKS[1])
+    current = parse_level_two_book(2, BOOKS[2])
+    deltas = diff_books(previous, current).sort_values(['side', 'price'])
+
+    assert deltas.values.tolist() == [[2, 1, 2.5, 1.0], [2, 2, 1.0, 0.0]]
+    assert diff_books(current, current).empty
+
+
+def test_reconstruct_book():
+    """Test books rebuilt from a keyframe and deltas equal the original books."""
+    books = [parse_level_two_book(timestamp, book) for timestamp, book in enumerate(BOOKS)]
+    deltas = pd.concat([diff_books(previous, current)
+                        for previous, current in zip(books, books[1:])], ignore_index=True)
+
+    for timestamp, book in enumerate(books):
+        assert reconstruct_book(books[0], deltas, timestamp).equals(book)
+
+
+def test_reconstruct_book_ignores_deltas_outside_range():
+    """Test deltas before the keyframe or after the timestamp are not applied."""
+    books = [parse_level_two_book(timestamp, book) for timestamp, book in enumerate(BOOKS)]
+    deltas = pd.concat([diff_books(previous, current)
+                        for previous, current in zip(books, books[1:])], ignore_index=True)
+
+    assert reconstruct_book(books[2], deltas, 2).equals(books[2])
+    assert reconstruct_book(books[2], deltas, 3).equals(books[3])
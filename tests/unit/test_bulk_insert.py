@@ -0,0 +1,41 @@
+"""
+Test bulk inserts against an in-memory SQLite database.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+
+from locrian_collect.bulk_insert import insert_frame, insert_arrays
+from locrian_collect.parse_level_two_book import parse_level_two_book
+
+
+@pytest.fixture
+def engine():
+    engine = sqlalchemy.create_engine('sqlite://')
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text(
+            'CREATE TABLE spot_btc (timestamp BIGINT, side TINYINT, level SMALLINT, '
+            'price DOUBLE, volume DOUBLE)'))
+    yield engine
+    engine.dispose()
+
+
+def test_insert_frame(engine, mock_book):
+    """Test a parsed book is inserted unchanged."""
+    book = parse_level_two_book(12345, mock_book)
+    assert insert_frame(engine, 'spot_btc', book) == 20
+
+    result = pd.read_sql('SELECT * FROM spot_btc', engine)
+    assert result.equals(book)
+
+
+def test_insert_arrays_empty(engine):
+    assert insert_arrays(engine, 'spot_btc', ['timestamp'], [np.array([])]) == 0
+
+
+def test_unsupported_paramstyle(mocker):
+    mock_engine = mocker.Mock()
+    mock_engine.dialect.paramstyle = 'named'
+    with pytest.raises(ValueError):
+        insert_arrays(mock_engine, 'table', ['a'], [np.array([1])])
@@ -0,0 +1,92 @@
+"""
+Test the unified collector's config and managers.
+"""
+import json
+
+import pytest
+
+from locrian_collect.collector import DEFAULT_CONFIG, build_managers, load_config, merge_config
+from locrian_collect.data_managers import IndexManager, OrderBookManager, TradesManager
+from locrian_collect.streaming import StreamingBookManager
+
+
+@pytest.fixture(autouse=True)
+def patch_alias_mapping(mocker):
+    mapping = {'this_week': '200515', 'next_week': '200522', 'quarter': '200626'}
+    mocker.patch('locrian_collect.data_managers.get_future_alias_mapping', return_value=mapping)
+    mocker.patch('locrian_collect.streaming.get_future_alias_mapping', return_value=mapping)
+    mocker.patch('builtins.print')
+
+
+def test_load_default_config():
+    assert load_config() == DEFAULT_CONFIG
+
+
+def test_load_config(tmp_path):
+    """Test keys left out of a config file keep their defaults."""
+    path = tmp_path / 'collector.json'
+    path.write_text(json.dumps({'currencies': ['btc'], 'trades': {'interval': 60}}))
+
+    config = load_config(str(path))
+    assert config['currencies'] == ['btc']
+    assert config['trades'] == {'interval': 60, 'size': 200}
+    assert config['order_book'] == DEFAULT_CONFIG['order_book']
+
+
+@pytest.mark.parametrize('config', [
+    {'currency': ['btc']},
+    {'trades': {'depth': 10}},
+    {'contracts': ['perpetual']},
+    {'order_book': {'storage_mode': 'columnar'}},
+    {'schedule': [['spot_*', 0, 1]]},
+    {'schedule': [['spot_*', 1, 'high']]},
+    {'retention': [['spot_*', {'action': 'delete'}]]},
+    {'schema': {'price_types': [['spot_*', 'TEXT']]}},
+])
+def test_merge_config_invalid(config):
+    with pytest.raises(ValueError):
+        merge_config(config)
+
+
+def test_build_managers():
+    """Test every manager type is built with its section's interval, depth and size."""
+    config = merge_config({'currencies': ['btc'], 'contracts': ['quarter'],
+                           'order_book': {'interval': 5, 'future_depth': 50},
+                           'schedule': [['spot_btc_*', 2, 10]]})
+    managers = {manager.mysql_table: manager for manager in build_managers(config)}
+
+    assert sorted(managers) == ['future_btc_usd_quarter_orderbook', 'future_index_btc_usd',
+                                'spot_btc_usd_orderbook', 'trades_future_quarter_btc',
+                                'trades_spot_btc']
+    spot = managers['spot_btc_usd_orderbook']
+    assert (spot.interval, spot.priority) == (2, 10)
+    future = managers['future_btc_usd_quarter_orderbook']
+    assert future.interval == 5
+    assert future.url.endswith('BTC-USD-200626/book?size=50')
+    assert future.contract == 'quarter'
+    assert isinstance(managers['future_index_btc_usd'], IndexManager)
+    assert managers['future_index_btc_usd'].interval == 10
+    assert managers['trades_spot_btc'].interval == 30
+
+
+def test_build_managers_sections_disabled():
+    """Test sections set to None are not collected."""
+    config = merge_config({'currencies': ['eth'], 'order_book': None, 'trades': None})
+    managers = build_managers(config)
+    assert [type(manager) for manager in managers] == [IndexManager]
+
+    config = merge_config({'currencies': ['eth'], 'contracts': [], 'index': None})
+    managers = build_managers(config)
+    assert [type(manager) for manager in managers] == [OrderBookManager, TradesManager]
+
+
+def test_build_managers_stream():
+    """Test streamed books replace the polled books."""
+    config = merge_config({'currencies': ['btc'], 'contracts': ['quarter'], 'trades': None,
+                           'order_book': {'stream': True, 'interval': 1}})
+    managers = build_managers(config)
+
+    assert [type(manager) for manager in managers] == [
+        IndexManager, StreamingBookManager, StreamingBookManager]
+    assert managers[2].subscription == 'futures/depth:BTC-USD-200626'
+    assert managers[2].interval == 1
@@ -0,0 +1,35 @@
+"""
+Test importing the package is cheap and has no side effects.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ('pandas', 'numpy', 'sqlalchemy', 'requests', 'aiohttp', 'pyarrow')
+LIGHT_MODULES = ('locrian_collect', 'locrian_collect.constants', 'locrian_collect.logs',
+                 'locrian_collect.utils', 'locrian_collect.validation',
+                 'locrian_collect.trade_id_cache', 'locrian_collect.write_behind')
+
+
+def run_python(code, home):
+    """Run python code in a fresh interpreter with an empty home directory."""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, HOME=f'{home}', PYTHONPATH=root)
+    return subprocess.run([sys.executable, '-c', code], env=env, capture_output=True,
+                          text=True, check=True).stdout
+
+
+def test_light_modules_do_not_import_heavy_dependencies(tmp_path):
+    code = (f'import sys\n'
+            f'for module in {LIGHT_MODULES!r}: __import__(module)\n'
+            f'print(sorted(set({HEAVY_MODULES!r}) & set(sys.modules)))')
+    assert run_python(code, tmp_path).strip() == '[]'
+
+
+@pytest.mark.parametrize('module', ['locrian_collect.data_managers', 'locrian_collect.scheduler'])
+def test_import_without_credentials_or_log_directory(module, tmp_path):
+    """Test modules import without ~/.db_login and without creating log files."""
+    run_python(f'import {module}', tmp_path)
+    assert os.listdir(tmp_path) == []
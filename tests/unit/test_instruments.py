@@ -0,0 +1,156 @@
+"""
+Test the instrument registry.
+"""
+import logging
+
+import pytest
+import requests
+
+from locrian_collect.data_managers import (
+    OrderBookManager, TradesManager, update_contract_urls
+)
+from locrian_collect.instruments import InstrumentRegistry, delivery_time, parse_date
+
+DELIVERIES = {'this_week': '2020-05-15', 'next_week': '2020-05-22', 'quarter': '2020-06-26'}
+ROLLED = {'this_week': '2020-05-22', 'next_week': '2020-05-29', 'quarter': '2020-06-26'}
+
+
+@pytest.fixture(autouse=True)
+def patch_loggers(mocker):
+    mocker.patch('locrian_collect.instruments.logger_order_book', logging.getLogger())
+    mocker.patch('locrian_collect.data_managers.logger_order_book', logging.getLogger())
+
+
+class FakeFetch:
+    """Returns the queued mappings in order, raising exceptions that are queued."""
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return dict(result)
+
+
+def test_parse_date():
+    assert parse_date('2020-05-15') == '200515'
+
+
+def test_delivery_time():
+    """Test contracts are delivered at 08:00 UTC."""
+    assert delivery_time('2020-05-15') == 1589529600
+
+
+def test_alias_mapping_cached(tmp_path):
+    """Test the mapping is fetched once within the ttl and saved to disk."""
+    fetch = FakeFetch(DELIVERIES)
+    registry = InstrumentRegistry(ttl=60, cache_path=f'{tmp_path}/instruments.json', fetch=fetch)
+
+    assert registry.get_alias_mapping() == {'this_week': '200515', 'next_week': '200522',
+                                            'quarter': '200626'}
+    registry.get_alias_mapping()
+    assert fetch.calls == 1
+    assert (tmp_path / 'instruments.json').exists()
+
+    registry.get_alias_mapping(refresh=True)
+    assert fetch.calls == 2
+
+
+def test_alias_mapping_expires(tmp_path, mocker):
+    """Test the mapping is fetched again once the ttl has passed."""
+    mock_time = mocker.patch('locrian_collect.instruments.time.time', return_value=1000)
+    fetch = FakeFetch(DELIVERIES)
+    registry = InstrumentRegistry(ttl=60, cache_path=f'{tmp_path}/instruments.json', fetch=fetch)
+
+    registry.get_alias_mapping()
+    mock_time.return_value = 1061
+    registry.get_alias_mapping()
+    assert fetch.calls == 2
+
+
+def test_cold_start_from_disk(tmp_path):
+    """Test a new registry falls back to the saved mapping when the exchange is down."""
+    cache_path = f'{tmp_path}/instruments.json'
+    InstrumentRegistry(cache_path=cache_path, fetch=FakeFetch(DELIVERIES)).get_deliveries()
+
+    registry = InstrumentRegistry(cache_path=cache_path,
+                                  fetch=FakeFetch(requests.ConnectionError()))
+    assert registry.get_deliveries() == DELIVERIES
+
+
+def test_keeps_stale_mapping(tmp_path):
+    """Test an expired mapping is kept when a refresh fails."""
+    fetch = FakeFetch(DELIVERIES, requests.Timeout())
+    registry = InstrumentRegistry(ttl=0, cache_path=f'{tmp_path}/instruments.json', fetch=fetch)
+
+    registry.get_deliveries()
+    assert registry.get_deliveries() == DELIVERIES
+    assert fetch.calls == 2
+
+
+def test_refresh_notifies_listeners(tmp_path):
+    """Test listeners are called only when the mapping changes."""
+    registry = InstrumentRegistry(cache_path=f'{tmp_path}/instruments.json',
+                                  fetch=FakeFetch(DELIVERIES, DELIVERIES, ROLLED))
+    mappings = []
+    registry.add_listener(mappings.append)
+    registry.get_deliveries()
+
+    assert not registry.refresh()
+    assert registry.refresh()
+    assert mappings == [{'this_week': '200522', 'next_week': '200529', 'quarter': '200626'}]
+
+
+def test_next_refresh_time(tmp_path, mocker):
+    """Test the next refresh is after the next delivery, or soon if it has already passed."""
+    mocker.patch('locrian_collect.instruments.INSTRUMENT_ROLL_DELAY', 60)
+    mocker.patch('locrian_collect.instruments.INSTRUMENT_RETRY_INTERVAL', 30)
+    mock_time = mocker.patch('locrian_collect.instruments.time.time', return_value=1589500000)
+    registry = InstrumentRegistry(ttl=10 ** 6, cache_path=f'{tmp_path}/instruments.json',
+                                  fetch=FakeFetch(DELIVERIES))
+    registry.get_deliveries()
+
+    assert registry.next_refresh_time() == delivery_time('2020-05-15') + 60
+
+    mock_time.return_value = delivery_time('2020-05-15') + 600
+    assert registry.next_refresh_time() == mock_time.return_value + 30
+
+
+def test_update_contract_urls():
+    """Test only managers following a rolled contract get a new url."""
+    template = 'https://okex/BTC-USD-{delivery}/book'
+    spot = OrderBookManager('spot_btc', 'spot_table', 'https://okcoin/BTC-USD/book')
+    quarter = OrderBookManager('future_btc_quarter', 'quarter_table',
+                               template.format(delivery='200626')).track_contract('quarter',
+                                                                                  template)
+    this_week = OrderBookManager('future_btc_this_week', 'this_week_table',
+                                 template.format(delivery='200515')).track_contract('this_week',
+                                                                                    template)
+
+    rolled = update_contract_urls([spot, quarter, this_week],
+                                  {'this_week': '200522', 'quarter': '200626'})
+
+    assert rolled == [this_week]
+    assert this_week.url == 'https://okex/BTC-USD-200522/book'
+    assert spot.url == 'https://okcoin/BTC-USD/book'
+
+
+def test_trades_roll_resets_tid_cache(mocker):
+    """Test a rolled trades manager forgets the trade identifiers of the old contract and is
+    warmed from the trades requested since the roll."""
+    mocker.patch('locrian_collect.data_managers.time.time', return_value=100)
+    template = 'https://okex/BTC-USD-{delivery}/trades'
+    manager = TradesManager('trades_table', template.format(delivery='200515'))
+    manager.track_contract('this_week', template)
+    manager.tid_cache.warm(500)
+    manager.tid_cache.add([501])
+
+    mocker.patch('locrian_collect.data_managers.time.time', return_value=200)
+    assert manager.roll_contract({'this_week': '200522'})
+    assert manager.url == 'https://okex/BTC-USD-200522/trades'
+    assert not manager.tid_cache.is_warm
+    assert len(manager.tid_cache) == 0
+    assert manager.contract_start == 200 * 10 ** 9
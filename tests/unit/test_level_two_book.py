@@ -0,0 +1,75 @@
+"""
+Test the array backed level two book.
+"""
+import math
+
+import numpy as np
+import pytest
+
+from locrian_collect.constants import Side
+from locrian_collect.level_two_book import LevelTwoBook
+from locrian_collect.parse_level_two_book import parse_level_two_book
+
+
+def test_from_exchange_matches_parse(mock_book):
+    """Test the exported book equals the book parsed from the exchange's json."""
+    book = LevelTwoBook.from_exchange(12345, mock_book)
+
+    assert book.to_frame().equals(parse_level_two_book(12345, mock_book))
+    assert LevelTwoBook.from_frame(book.to_frame()) == book
+    assert len(book) == 20
+
+
+def test_best_mid_spread(mock_book):
+    book = LevelTwoBook.from_exchange(1, mock_book)
+
+    assert (book.best_ask, book.best_bid) == (3999.85, 3999.05)
+    assert book.mid == pytest.approx(3999.45)
+    assert book.spread == pytest.approx(0.8)
+    assert math.isnan(LevelTwoBook().mid)
+
+
+def test_update():
+    """Test levels are changed, added in price order and removed."""
+    book = LevelTwoBook(1, asks=([102.0, 101.0], [2.0, 1.0]), bids=([99.0, 100.0], [3.0, 4.0]))
+    book.update(Side.ask, 101.0, 5.0)
+    book.update(Side.ask, 101.5, 6.0)
+    book.update(Side.ask, 102.0, 0.0)
+    book.update(Side.ask, 103.0, 0.0)
+    book.update_levels(Side.bid, [['100.5', '7'], ['99', '0']])
+
+    prices, volumes = book.levels(Side.ask)
+    assert (prices.tolist(), volumes.tolist()) == ([101.0, 101.5], [5.0, 6.0])
+    prices, volumes = book.levels(Side.bid)
+    assert (prices.tolist(), volumes.tolist()) == ([100.5, 100.0], [7.0, 4.0])
+    assert book.volume_at(Side.bid, 100.0) == 4.0
+    assert book.volume_at(Side.bid, 99.0) == 0.0
+
+
+def test_update_grows_arrays():
+    """Test levels can be added past the initial capacity."""
+    book = LevelTwoBook()
+    for price in np.random.default_rng(0).permutation(100):
+        book.update(Side.bid, float(price), 1.0)
+
+    assert book.levels(Side.bid)[0].tolist() == list(range(99, -1, -1))
+    assert book.best_bid == 99.0
+
+
+def test_top(mock_book):
+    book = LevelTwoBook.from_exchange(1, mock_book)
+    top = book.top(2)
+
+    assert top.to_frame().equals(book.to_frame(depth=2))
+    assert top.levels(Side.bid)[0].tolist() == [3999.05, 3999.03]
+    assert book.top(0).to_frame().empty
+    assert len(book.top(50)) == 20
+
+
+def test_levels_are_views(mock_book):
+    """Test the levels of a side are exported without copying the book's arrays."""
+    book = LevelTwoBook.from_exchange(1, mock_book)
+    for side in (Side.ask, Side.bid):
+        prices, volumes = book.levels(side, 5)
+        assert prices.base is not None and volumes.base is not None
+        assert len(prices) == 5
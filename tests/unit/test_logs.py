@@ -20,3 +20,15 @@ def test_get_logger():
 
             assert loggers[index].handlers[0].baseFilename == expected_dir
             assert loggers[index].handlers[1].formatter._fmt == expected_fmt
+
+
+def test_configure_logging(tmp_path):
+    """Test configure_logging creates the log directory and adds handlers to every logger."""
+    from locrian_collect.logs import configure_logging, LOGGERS
+
+    log_file = f'{tmp_path}/logs/locrian_collect.log'
+    configure_logging(log_file)
+
+    for logger in LOGGERS:
+        assert logger.handlers[0].baseFilename == log_file
+        logger.handlers = []
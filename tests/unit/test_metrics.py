@@ -0,0 +1,107 @@
+"""
+Test the latency and throughput metrics.
+"""
+import json
+import urllib.request
+
+import pytest
+
+from locrian_collect.data_managers import OrderBookManager
+from locrian_collect.metrics import Histogram, MetricsRegistry, METRICS, serve_metrics
+
+
+def test_histogram():
+    """Test counts, sum, max and quantiles estimated from the buckets."""
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.05, 0.5, 3):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.snapshot() == {'count': 4, 'sum': 3.6, 'max': 3, 'mean': 0.9,
+                                    'p50': 0.1, 'p99': 3}
+
+
+def test_histogram_empty():
+    assert Histogram().snapshot()['p99'] == 0.0
+
+
+def test_registry_snapshot():
+    """Test metrics are grouped by manager."""
+    registry = MetricsRegistry()
+    registry.observe('table_a', 'http', 0.2)
+    registry.increment('table_a', 'rows_written', 10)
+    registry.increment('table_a', 'rows_written', 5)
+    registry.increment('table_b', 'errors_timeout')
+
+    snapshot = registry.snapshot()
+    assert snapshot['table_a']['counters'] == {'rows_written': 15}
+    assert snapshot['table_a']['stages']['http']['count'] == 1
+    assert snapshot['table_b'] == {'counters': {'errors_timeout': 1}, 'gauges': {},
+                                   'stages': {}}
+
+
+def test_render_prometheus():
+    registry = MetricsRegistry()
+    registry.increment('table_a', 'requests', 2)
+    registry.observe('table_a', 'write', 0.5)
+    registry.set_gauge('write_behind', 'queue_depth', 3)
+    registry.set_gauge('write_behind', 'queue_depth', 1)
+
+    lines = registry.render_prometheus().splitlines()
+    assert 'locrian_requests_total{manager="table_a"} 2' in lines
+    assert 'locrian_queue_depth{manager="write_behind"} 1' in lines
+    assert 'locrian_write_seconds_bucket{manager="table_a",le="0.25"} 0' in lines
+    assert 'locrian_write_seconds_bucket{manager="table_a",le="0.5"} 1' in lines
+    assert 'locrian_write_seconds_count{manager="table_a"} 1' in lines
+
+
+def test_write_snapshot(tmp_path):
+    registry = MetricsRegistry()
+    registry.increment('table_a', 'requests')
+    registry.write_snapshot(f'{tmp_path}/metrics/metrics.json')
+
+    with open(f'{tmp_path}/metrics/metrics.json') as f:
+        snapshot = json.loads(f.read())
+    assert snapshot['managers'] == {'table_a': {'counters': {'requests': 1}, 'gauges': {},
+                                                'stages': {}}}
+
+
+def test_serve_metrics():
+    """Test the endpoints of the local metrics server."""
+    registry = MetricsRegistry()
+    registry.increment('table_a', 'requests')
+    server = serve_metrics(0, registry=registry)
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        with urllib.request.urlopen(f'{url}/metrics') as response:
+            assert b'locrian_requests_total{manager="table_a"} 1' in response.read()
+        with urllib.request.urlopen(f'{url}/metrics.json') as response:
+            assert json.loads(response.read())['table_a']['counters'] == {'requests': 1}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_manager_metrics(mocker, mock_book):
+    """Test a manager records the request, parse and write stages and the rows written."""
+    mocker.patch('locrian_collect.data_managers.get_json', return_value=mock_book)
+    mocker.patch('locrian_collect.data_managers.get_engine')
+    mocker.patch('locrian_collect.data_managers.insert_frame', return_value=4)
+
+    manager = OrderBookManager('spot_btc', 'spot_btc_usd_orderbook', 'test_url')
+    manager.interval = 10
+    manager.get_data()
+
+    metrics = METRICS.snapshot()['spot_btc_usd_orderbook']
+    assert metrics['counters'] == {'requests': 1, 'rows_written': 4}
+    assert set(metrics['stages']) == {'http', 'tick_skew', 'parse', 'write'}
+
+
+def test_manager_write_error(mocker):
+    """Test a failed write is counted and raised."""
+    manager = OrderBookManager('spot_btc', 'spot_btc_usd_orderbook', 'test_url')
+    mocker.patch.object(manager, '_write_books', side_effect=RuntimeError('down'))
+
+    with pytest.raises(RuntimeError):
+        manager.submit_or_write('spot_btc', None, manager._write_books)
+    assert METRICS.snapshot()['spot_btc_usd_orderbook']['counters'] == {'errors_write': 1}
@@ -47,3 +47,35 @@ def test_parse_level_two_book(mock_book):
             15: 1.5635, 16: 0.203, 17: 1.8945, 18: 0.275, 19: 1.8672}})
 
     assert parse_level_two_book(12345, mock_book).equals(expected)
+
+
+def test_parse_level_two_book_does_not_mutate(mock_book):
+    """Test the book passed in is not modified."""
+    book = dict(mock_book, timestamp='2020-01-01T00:00:00.000Z')
+    parse_level_two_book(12345, book)
+    assert 'timestamp' in book
+    assert book['asks'] == mock_book['asks']
+
+
+def test_parse_level_two_book_strings():
+    """Test levels returned as strings with extra fields are parsed to floats."""
+    book = {'asks': [['2.5', '3', '0', '1'], ['2', '1', '0', '2']],
+            'bids': [['1.5', '4', '0', '1']]}
+    result = parse_level_two_book(1, book)
+
+    assert result['price'].tolist() == [2.0, 2.5, 1.5]
+    assert result['volume'].tolist() == [1.0, 3.0, 4.0]
+    assert result['level'].tolist() == [1, 2, 1]
+    assert result.dtypes.tolist() == ['int64', 'int64', 'int64', 'float64', 'float64']
+
+
+def test_parse_level_two_book_empty_side():
+    """Test an empty side gives no rows for that side."""
+    result = parse_level_two_book(1, {'asks': [], 'bids': [[1.0, 2.0]]})
+    assert result['side'].tolist() == [2]
+
+
+def test_parse_level_two_book_unknown_side():
+    """Test an unknown side raises a KeyError."""
+    with pytest.raises(KeyError):
+        parse_level_two_book(1, {'unknown': [[1.0, 2.0]]})
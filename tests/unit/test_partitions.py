@@ -0,0 +1,155 @@
+"""
+Test daily partitions and retention of the level two tables.
+"""
+from datetime import date
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from locrian_collect.parse_level_two_book import parse_level_two_book
+from locrian_collect.partitions import (
+    DAY_IN_NANOSECONDS, add_future_partitions, check_retention, create_book_table, day_start,
+    downsample_books, maintain_partitions, retention_policy
+)
+
+TODAY = date(2020, 5, 10)
+
+
+@pytest.fixture
+def mock_engine(mocker):
+    mock_engine = mocker.MagicMock()
+    mocker.patch('locrian_collect.partitions.get_engine', return_value=mock_engine)
+    mocker.patch('locrian_collect.schema.get_engine', return_value=mock_engine)
+    return mock_engine
+
+
+def executed(mock_engine):
+    return [str(call[0][0]) for call in mock_engine.execute.call_args_list]
+
+
+def partitions(*days):
+    rows = [(f'p202005{day:02d}', str(day_start(date(2020, 5, day + 1)))) for day in days]
+    return rows + [('pmax', 'MAXVALUE')]
+
+
+def test_create_book_table(mock_engine):
+    create_book_table('spot_btc', today=TODAY, days_ahead=1)
+
+    query = executed(mock_engine)[0]
+    assert query.startswith('CREATE TABLE IF NOT EXISTS spot_btc (timestamp BIGINT NOT NULL')
+    assert query.endswith(
+        f'PARTITION BY RANGE (timestamp) ('
+        f'PARTITION p20200510 VALUES LESS THAN ({day_start(date(2020, 5, 11))}), '
+        f'PARTITION p20200511 VALUES LESS THAN ({day_start(date(2020, 5, 12))}), '
+        f'PARTITION pmax VALUES LESS THAN MAXVALUE)')
+
+
+def test_add_future_partitions(mock_engine):
+    """Test pmax is split into the days missing up to days_ahead."""
+    mock_engine.execute.return_value.fetchall.return_value = partitions(9, 10)
+
+    assert add_future_partitions('spot_btc', TODAY, days_ahead=2) == ['p20200511', 'p20200512']
+    assert executed(mock_engine)[1].startswith(
+        'ALTER TABLE spot_btc REORGANIZE PARTITION pmax INTO (PARTITION p20200511 ')
+
+    mock_engine.execute.return_value.fetchall.return_value = partitions(10, 11, 12)
+    assert add_future_partitions('spot_btc', TODAY, days_ahead=2) == []
+
+
+def test_downsample_books(mock_book):
+    """Test the first book of every interval is kept, also across chunks."""
+    second = 10 ** 9
+    books = pd.concat([parse_level_two_book(timestamp * second, mock_book)
+                       for timestamp in (0, 30, 60, 61, 130)], ignore_index=True)
+
+    kept, bucket = downsample_books(books[books['timestamp'] < 61 * second], 60)
+    assert kept['timestamp'].unique().tolist() == [0, 60 * second]
+    kept, bucket = downsample_books(books[books['timestamp'] >= 61 * second], 60, bucket)
+    assert kept['timestamp'].unique().tolist() == [130 * second]
+    assert bucket == 2
+
+
+def test_retention_policy():
+    retention = [('spot_btc', {'raw_days': 90}), ('future_*', {'action': 'archive'})]
+
+    assert retention_policy('spot_btc', retention)['raw_days'] == 90
+    assert retention_policy('future_btc_quarter', retention)['action'] == 'archive'
+    assert retention_policy('spot_eth', retention)['action'] == 'downsample'
+
+
+@pytest.mark.parametrize('retention', [
+    [('spot_*', {'days': 3})],
+    [('spot_*', {'action': 'delete'})],
+    [('spot_*', {'raw_days': 0})],
+])
+def test_check_retention_invalid(retention):
+    with pytest.raises(ValueError):
+        check_retention(retention)
+
+
+def test_maintain_partitions(mocker, mock_engine, mock_book):
+    """Test partitions past retention are downsampled into the compact table and dropped,
+    and the partitions of delta tables are dropped."""
+    mock_engine.execute.return_value.fetchall.return_value = partitions(7, 8, 9, 10, 11)
+    start = day_start(date(2020, 5, 7))
+    books = pd.concat([parse_level_two_book(start + offset * 10 ** 9, mock_book)
+                       for offset in (0, 10, 70)], ignore_index=True)
+    mock_iter_books = mocker.patch('locrian_collect.partitions.iter_books', return_value=[books])
+    mock_insert = mocker.patch('locrian_collect.partitions.insert_frame',
+                               side_effect=lambda engine, table, frame: len(frame))
+
+    retention = [('*_delta', {'raw_days': 1}), ('spot_btc', {'raw_days': 2})]
+    actions = maintain_partitions(['spot_btc', 'spot_btc_delta'], retention, today=TODAY,
+                                  days_ahead=1)
+
+    assert actions == [('spot_btc', 'p20200507', 'downsample'),
+                       ('spot_btc_delta', 'p20200507', 'drop'),
+                       ('spot_btc_delta', 'p20200508', 'drop')]
+    # The first partition also holds any rows before its day.
+    assert mock_iter_books.call_args[0] == ('spot_btc', 0, start + DAY_IN_NANOSECONDS, 20)
+    assert mock_insert.call_args[0][1] == 'spot_btc_compact'
+    assert mock_insert.call_args[0][2]['timestamp'].nunique() == 2
+    queries = executed(mock_engine)
+    assert 'ALTER TABLE spot_btc DROP PARTITION p20200507' in queries
+    assert 'ALTER TABLE spot_btc_delta DROP PARTITION p20200508' in queries
+    assert 'ALTER TABLE spot_btc DROP PARTITION p20200508' not in queries
+
+
+def test_archive_partition_rerun(mocker, mock_engine, mock_book, tmp_path):
+    """Test archiving a partition again after an interrupted compaction skips the finished
+    hours rather than archiving their rows twice."""
+    pytest.importorskip('pyarrow')
+    from locrian_collect.archive import HOUR_IN_NANOSECONDS, read_archive
+    from locrian_collect.partitions import compact_partition
+
+    start = day_start(date(2020, 5, 7))
+    books = pd.concat([parse_level_two_book(start + offset * HOUR_IN_NANOSECONDS, mock_book)
+                       for offset in (0, 1)], ignore_index=True)
+    mocker.patch('locrian_collect.partitions.iter_books', return_value=[books])
+    policy = {'action': 'archive'}
+    end = start + DAY_IN_NANOSECONDS
+
+    # The first run is interrupted with the second hour's file unfinished.
+    mock_close = mocker.patch('locrian_collect.archive.HourlyParquetWriter.close',
+                              side_effect=RuntimeError)
+    with pytest.raises(RuntimeError):
+        compact_partition('spot_btc', 'p20200507', start, end, policy,
+                          archive_directory=f'{tmp_path}')
+    archived = read_archive('locrian_level_two', 'spot_btc', f'{tmp_path}')
+    assert archived['timestamp'].unique().tolist() == [start]
+
+    mocker.stop(mock_close)
+    rows = compact_partition('spot_btc', 'p20200507', start, end, policy,
+                             archive_directory=f'{tmp_path}')
+
+    assert rows == len(books)
+    assert 'ALTER TABLE spot_btc DROP PARTITION p20200507' in executed(mock_engine)
+    paths = sorted(glob.glob(f'{tmp_path}/locrian_level_two/spot_btc/*/*/*'))
+    assert [os.path.relpath(path, tmp_path) for path in paths] == [
+        'locrian_level_two/spot_btc/date=2020-05-07/hour=00/p20200507.parquet',
+        'locrian_level_two/spot_btc/date=2020-05-07/hour=01/p20200507.parquet']
+    result = read_archive('locrian_level_two', 'spot_btc', f'{tmp_path}')
+    assert len(result) == len(books)
+    assert sorted(result['timestamp'].unique()) == [start, start + HOUR_IN_NANOSECONDS]
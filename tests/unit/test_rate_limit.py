@@ -0,0 +1,69 @@
+"""
+Test the per host token bucket rate limiters.
+"""
+import pytest
+
+from locrian_collect.rate_limit import TokenBucket, get_rate_limiter, parse_retry_after
+
+
+@pytest.fixture
+def clock(mocker):
+    """Patch the monotonic clock, advance it by setting `return_value`."""
+    return mocker.patch('locrian_collect.rate_limit.time.monotonic', return_value=100.0)
+
+
+def test_burst_then_rate(clock):
+    """Test a full bucket allows a burst and then one request per 1 / rate seconds."""
+    bucket = TokenBucket(rate=2, capacity=2)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.return_value = 100.5
+    assert bucket.try_acquire() == 0
+
+
+def test_back_off_and_recover(clock):
+    """Test a rate limited request pauses the bucket and halves its rate until it recovers."""
+    bucket = TokenBucket(rate=4, capacity=1)
+    bucket.back_off(retry_after=3)
+
+    assert bucket.rate == 2
+    assert bucket.try_acquire() == pytest.approx(3)
+
+    clock.return_value = 103.5
+    assert bucket.try_acquire() == 0
+
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rate == 4
+
+
+def test_back_off_min_rate(clock):
+    bucket = TokenBucket(rate=16)
+    for _ in range(10):
+        bucket.back_off()
+    assert bucket.rate == 1
+
+
+def test_acquire_timeout(clock, mocker):
+    """Test acquire gives up when no token is available within the timeout."""
+    mocker.patch('locrian_collect.rate_limit.time.sleep')
+    bucket = TokenBucket(rate=1, capacity=1)
+
+    assert bucket.acquire(timeout=0.1)
+    assert not bucket.acquire(timeout=0.1)
+
+
+def test_get_rate_limiter_per_host():
+    limiter = get_rate_limiter('https://www.okex.com/api/futures/v3/instruments')
+
+    assert get_rate_limiter('https://www.okex.com/other') is limiter
+    assert get_rate_limiter('https://www.okcoin.com/api') is not limiter
+
+
+@pytest.mark.parametrize('value, expected', [['2', 2], ['0.5', 0.5], [None, None],
+                                             ['Wed, 21 Oct 2015 07:28:00 GMT', None]])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
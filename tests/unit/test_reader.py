@@ -0,0 +1,90 @@
+"""
+Test reading stored data back against an in-memory SQLite database.
+"""
+import pandas as pd
+import pytest
+import sqlalchemy
+
+from locrian_collect.parse_level_two_book import parse_level_two_book
+from locrian_collect.reader import (
+    collected_tables, ensure_indexes, get_books, get_trades, iter_books, to_nanoseconds
+)
+
+
+@pytest.fixture
+def engine(mocker, mock_book):
+    engine = sqlalchemy.create_engine('sqlite://')
+    books = pd.concat([parse_level_two_book(timestamp, mock_book) for timestamp in (1, 2, 3)])
+    books.to_sql('spot_btc', engine, index=False)
+    pd.DataFrame({'unixRequestTime': [1, 1, 2], 'unixReturnTime': [2, 2, 3],
+                  'trade_time': [10, 11, 20], 'amount': [1.0, 2.0, 3.0],
+                  'price': [100.0, 101.0, 102.0], 'side': ['buy', 'sell', 'buy'],
+                  'tid': [1, 2, 3]}).to_sql('trades_spot_btc', engine, index=False)
+    mocker.patch('locrian_collect.reader.get_engine', return_value=engine)
+    yield engine
+    engine.dispose()
+
+
+def test_get_books(engine, mock_book):
+    """Test the books in the range are read with compact dtypes."""
+    books = get_books('spot_btc', 2, 4)
+
+    assert books['timestamp'].unique().tolist() == [2, 3]
+    assert books['side'].dtype == 'int8'
+    expected = parse_level_two_book(2, mock_book)
+    assert books[books['timestamp'] == 2].astype(expected.dtypes).equals(expected)
+
+
+def test_get_books_depth(engine):
+    books = get_books('spot_btc', 1, 2, depth=3)
+    assert books['level'].tolist() == [1, 2, 3] * 2
+
+
+def test_iter_books_whole_books(engine):
+    """Test chunks hold whole books whatever the chunk size."""
+    chunks = list(iter_books('spot_btc', 0, 10, chunksize=7))
+
+    assert [chunk['timestamp'].unique().tolist() for chunk in chunks] == [[1], [2], [3]]
+    assert all(len(chunk) == 20 for chunk in chunks)
+
+
+def test_get_books_empty(engine):
+    books = get_books('spot_btc', 100, 200)
+    assert books.empty
+    assert list(books.columns) == ['timestamp', 'side', 'level', 'price', 'volume']
+
+
+def test_get_trades(engine):
+    trades = get_trades('trades_spot_btc', 10, 20)
+
+    assert trades['tid'].tolist() == [1, 2]
+    assert trades['side'].dtype == 'category'
+
+
+def test_invalid_table(engine):
+    with pytest.raises(ValueError):
+        get_books('spot_btc; DROP TABLE spot_btc', 0, 1)
+
+
+def test_to_nanoseconds():
+    assert to_nanoseconds(5) == 5
+    assert to_nanoseconds('1970-01-01 00:00:01') == 1000000000
+    assert to_nanoseconds('1970-01-01T01:00:01+01:00') == 1000000000
+
+
+def test_ensure_indexes(mocker):
+    """Test only the missing indexes of existing tables are created, skipping the indexes
+    covered by a primary key."""
+    mock_engine = mocker.MagicMock()
+    mock_engine.execute.return_value.fetchall.return_value = [
+        ('spot_btc', None), ('future_btc_quarter', 'PRIMARY'),
+        ('trades_spot_btc', 'ix_trade_time_tid')]
+    mocker.patch('locrian_collect.reader.get_engine', return_value=mock_engine)
+
+    tables = collected_tables(currencies=['btc'], contracts=['quarter'])
+    created = ensure_indexes({name: tables[name]
+                              for name in ('locrian_level_two', 'locrian_trades')})
+
+    assert created == [('locrian_level_two', 'spot_btc', 'ix_timestamp_side_level')]
+    query = str(mock_engine.execute.call_args_list[1][0][0])
+    assert query == 'CREATE INDEX ix_timestamp_side_level ON spot_btc (timestamp, side, level)'
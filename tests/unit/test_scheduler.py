@@ -1,9 +1,19 @@
 """
 Test the scheduling of collecting data.
 """
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from threading import Event
+import time
+
 import pytest
 
-from locrian_collect.scheduler import delta_time_to_sleep
+from locrian_collect.rate_limit import get_rate_limiter
+from locrian_collect.scheduler import (
+    delta_time_to_sleep, get_scheduler, run_tick, scheduler, rate_limited_scheduler,
+    apply_schedule, spread_phases, initial_schedule, dispatch_due, due_managers,
+    _warn_over_rate_limit
+)
 
 
 @pytest.mark.parametrize('interval, offset, expected', [
@@ -16,3 +26,230 @@ def test_delta_time_to_sleep(interval, offset, expected, monkeypatch, mocker):
     mocker.patch('locrian_collect.scheduler.time.time', return_value=12345)
     result = delta_time_to_sleep(interval, offset)
     assert result == expected
+
+
+def test_get_scheduler():
+    """Test the scheduler is selected by mode."""
+    from locrian_collect.async_scheduler import run_async_scheduler
+
+    assert get_scheduler('thread') is scheduler
+    assert get_scheduler('async') is run_async_scheduler
+    assert get_scheduler('rate_limited') is rate_limited_scheduler
+    with pytest.raises(ValueError):
+        get_scheduler('unknown')
+
+
+class SleepingManager:
+    """Manager whose get_data sleeps, optionally raising."""
+    def __init__(self, mysql_table, duration, exception=None):
+        self.mysql_table = mysql_table
+        self.duration = duration
+        self.exception = exception
+        self.calls = 0
+
+    def get_data(self):
+        self.calls += 1
+        time.sleep(self.duration)
+        if self.exception is not None:
+            raise self.exception
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def test_run_tick_reports_slowest(executor, caplog):
+    """Test the tick reports its wall time and slowest manager."""
+    caplog.set_level(logging.INFO)
+    managers = [SleepingManager('fast', 0), SleepingManager('slow', 0.05)]
+    wall_time, slowest_table, slowest_time = run_tick(
+        managers, executor, {}, logging.getLogger(), task_timeout=1)
+
+    assert slowest_table == 'slow'
+    assert 0.05 <= slowest_time <= wall_time < 1
+    assert caplog.record_tuples[-1][2].startswith('Tick took')
+
+
+def test_run_tick_timeout_and_skip_late(executor, caplog):
+    """Test a hung manager does not hold up the tick and skips the next tick."""
+    hung = SleepingManager('hung', 0.3)
+    fast = SleepingManager('fast', 0)
+    in_flight = {}
+    logger = logging.getLogger()
+
+    wall_time, slowest_table, _ = run_tick([hung, fast], executor, in_flight, logger,
+                                           task_timeout=0.05)
+    assert wall_time < 0.3
+    assert slowest_table == 'hung'
+
+    run_tick([hung, fast], executor, in_flight, logger, task_timeout=0.05)
+    assert (hung.calls, fast.calls) == (1, 2)
+    assert 'Skipping hung, previous request still running.' in [
+        record[2] for record in caplog.record_tuples]
+
+
+def test_run_tick_no_skip(executor):
+    """Test a late manager runs again alongside the running request when skip_late is
+    False."""
+    hung = SleepingManager('hung', 0.1)
+    in_flight = {}
+    run_tick([hung], executor, in_flight, logging.getLogger(), task_timeout=0.01,
+             skip_late=False)
+    run_tick([hung], executor, in_flight, logging.getLogger(), task_timeout=0.5,
+             skip_late=False)
+    assert hung.calls == 2
+
+
+def test_run_tick_logs_exceptions(executor, caplog):
+    """Test an exception in a manager is logged."""
+    managers = [SleepingManager('broken', 0, exception=RuntimeError('failed'))]
+    run_tick(managers, executor, {}, logging.getLogger(), task_timeout=1)
+    assert "Error broken: RuntimeError('failed')" in [record[2] for record in caplog.record_tuples]
+
+
+class ScheduledManager(SleepingManager):
+    """Manager with the attributes used by the rate limited scheduler."""
+    def __init__(self, mysql_table, interval=10, priority=0, url='https://www.okex.com/x',
+                 duration=0, uses_rest=True):
+        super().__init__(mysql_table, duration)
+        self.url = url
+        self.uses_rest = uses_rest
+        self.interval = interval
+        self.priority = priority
+        self.phase = 0
+
+
+def test_scheduler_keeps_manager_intervals(mocker):
+    """Test the thread scheduler only defaults the intervals and sets the phase to the
+    offset."""
+    mocker.patch('locrian_collect.scheduler.time.sleep', side_effect=KeyboardInterrupt)
+    mocker.patch('locrian_collect.scheduler.close_outputs')
+    mocker.patch('locrian_collect.scheduler.close_sessions')
+    mocker.patch('locrian_collect.scheduler.dispose_engines')
+    managers = [ScheduledManager('configured', interval=30),
+                ScheduledManager('default', interval=None)]
+    with pytest.raises(KeyboardInterrupt):
+        scheduler(managers, logging.getLogger(), 10, 0.1, 'tick')
+
+    assert [(manager.interval, manager.phase) for manager in managers] == [(30, 0.1), (10, 0.1)]
+
+
+def test_due_managers():
+    """Test managers run on the first tick at or after each of their turns."""
+    every_tick = ScheduledManager('every_tick', interval=10)
+    slow = ScheduledManager('slow', interval=30)
+    odd = ScheduledManager('odd', interval=15)
+    fast = ScheduledManager('fast', interval=2)
+    for manager in (every_tick, slow, odd, fast):
+        manager.phase = 0.1
+
+    due = [[manager.mysql_table for manager in due_managers(
+        [every_tick, slow, odd, fast], tick + 0.001, 10)] for tick in (0.1, 10.1, 20.1, 30.1)]
+    assert due == [['every_tick', 'slow', 'odd', 'fast'], ['every_tick', 'fast'],
+                   ['every_tick', 'odd', 'fast'], ['every_tick', 'slow', 'odd', 'fast']]
+
+
+def test_apply_schedule():
+    """Test the first matching pattern sets the interval and priority."""
+    managers = [ScheduledManager('spot_btc_usd_orderbook', interval=None),
+                ScheduledManager('future_etc_usd_quarter_orderbook', interval=None),
+                ScheduledManager('spot_eth_usd_orderbook', interval=None)]
+    apply_schedule(managers, [('spot_btc_*', 2, 10), ('*quarter*', 30, 0), ('*btc*', 5, 1)])
+
+    assert [(manager.interval, manager.priority) for manager in managers] == [
+        (2, 10), (30, 0), (None, 0)]
+
+
+def test_initial_schedule_spreads_managers():
+    """Test managers sharing an interval are spread across it, highest priority first."""
+    managers = [ScheduledManager(f'table_{i}', interval=10) for i in range(4)]
+    managers.append(ScheduledManager('fast', interval=2, priority=5))
+    managers[3].priority = 1
+
+    spread_phases(managers, offset=0.1)
+    queue = initial_schedule(managers, now=1000.05)
+
+    assert [manager.phase for manager in managers] == [2.6, 5.1, 7.6, 0.1, 0.1]
+    assert sorted(entry[0] for entry in queue) == pytest.approx(
+        [1000.1, 1000.1, 1002.6, 1005.1, 1007.6])
+    assert queue[0][3] is managers[4]
+
+
+def test_dispatch_due(executor):
+    """Test due managers are submitted and rescheduled on their interval."""
+    managers = [ScheduledManager('a', interval=10), ScheduledManager('b', interval=10)]
+    queue = [[100.0, 0, 0, managers[0]], [105.0, 0, 1, managers[1]]]
+    in_flight = {}
+
+    dispatch_due(queue, executor, in_flight, logging.getLogger(), now=101.0)
+    in_flight[managers[0]].result()
+
+    assert (managers[0].calls, managers[1].calls) == (1, 0)
+    assert sorted(entry[0] for entry in queue) == [105.0, 110.0]
+
+
+def test_dispatch_due_on_turn(executor):
+    """Test the turn callback is called once a manager finishes."""
+    manager = ScheduledManager('a', interval=10)
+    finished = []
+    called = Event()
+
+    def on_turn(finished_manager):
+        finished.append(finished_manager)
+        called.set()
+
+    dispatch_due([[100.0, 0, 0, manager]], executor, {}, logging.getLogger(), now=100.0,
+                 on_turn=on_turn)
+
+    assert called.wait(timeout=1)
+    assert finished == [manager]
+
+
+def test_dispatch_due_rate_limited(executor, caplog):
+    """Test managers wait for a token, highest priority first, and skip their turn when the
+    token would come after their next turn."""
+    get_rate_limiter('https://www.okex.com').back_off(retry_after=5)
+    slow = ScheduledManager('slow', interval=60, priority=1)
+    fast = ScheduledManager('fast', interval=2)
+    queue = [[100.0, -1, 0, slow], [100.0, 0, 1, fast]]
+
+    dispatch_due(queue, executor, {}, logging.getLogger(), now=100.0)
+
+    assert slow.calls == fast.calls == 0
+    due = {entry[3].mysql_table: entry[0] for entry in queue}
+    assert due['fast'] == 102.0
+    assert 104 < due['slow'] < 106
+    assert 'Skipping fast, rate limited.' in [record[2] for record in caplog.record_tuples]
+
+
+def test_dispatch_due_skips_running(executor, caplog):
+    hung = ScheduledManager('hung', interval=1, duration=0.2)
+    in_flight = {}
+    queue = [[100.0, 0, 0, hung]]
+
+    dispatch_due(queue, executor, in_flight, logging.getLogger(), now=100.0)
+    dispatch_due(queue, executor, in_flight, logging.getLogger(), now=101.5)
+
+    assert hung.calls == 1
+    assert queue[0][0] == 102.0
+    assert 'Skipping hung, previous request still running.' in [
+        record[2] for record in caplog.record_tuples]
+
+
+def test_dispatch_due_streaming_takes_no_token(executor, caplog):
+    """Test managers not making REST requests run while their host is rate limited, and
+    don't count towards its rate limit."""
+    get_rate_limiter('https://www.okex.com').back_off(retry_after=5)
+    streaming = ScheduledManager('streaming', interval=0.01, uses_rest=False)
+    queue = [[100.0, 0, 0, streaming]]
+    in_flight = {}
+
+    dispatch_due(queue, executor, in_flight, logging.getLogger(), now=100.0)
+    in_flight[streaming].result()
+    _warn_over_rate_limit([streaming], logging.getLogger())
+
+    assert streaming.calls == 1
+    assert caplog.record_tuples == []
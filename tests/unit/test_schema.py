@@ -0,0 +1,131 @@
+"""
+Test the creation and migration of the tables.
+"""
+from datetime import date, timedelta
+import logging
+
+import pytest
+
+from locrian_collect.schema import (
+    check_schema, create_tables, day_start, migrate_table, migrate_tables, partition_days,
+    price_type, table_definition
+)
+
+TODAY = date(2020, 5, 10)
+SCHEMA = {'table_options': 'ENGINE=InnoDB', 'price_types': [('spot_*', 'DECIMAL(16,8)')],
+          'partition_books': True}
+
+
+@pytest.fixture
+def mock_engine(mocker):
+    mock_engine = mocker.MagicMock()
+    mocker.patch('locrian_collect.schema.get_engine', return_value=mock_engine)
+    mocker.patch('locrian_collect.schema.logger_storage', logging.getLogger())
+    return mock_engine
+
+
+def executed(mock_engine):
+    return [str(call[0][0]) for call in mock_engine.execute.call_args_list]
+
+
+def test_table_definition():
+    """Test the primary key replaces the read index it covers and prices take the type of the
+    first matching pattern."""
+    query = table_definition('spot_btc', 'book', SCHEMA)
+    assert query == ('CREATE TABLE IF NOT EXISTS spot_btc (timestamp BIGINT NOT NULL, '
+                     'side TINYINT UNSIGNED NOT NULL, level SMALLINT UNSIGNED NOT NULL, '
+                     'price DECIMAL(16,8) NOT NULL, volume DOUBLE NOT NULL, '
+                     'PRIMARY KEY (timestamp, side, level)) ENGINE=InnoDB')
+
+    query = table_definition('trades_future_quarter_btc', 'trades', SCHEMA)
+    assert "side ENUM('buy', 'sell') NOT NULL" in query
+    assert 'price DOUBLE NOT NULL' in query
+    assert 'PRIMARY KEY (tid), INDEX ix_trade_time_tid (trade_time, tid))' in query
+
+
+def test_table_definition_partitioned():
+    query = table_definition('spot_btc_delta', 'delta', SCHEMA, [TODAY])
+    assert 'PRIMARY KEY (timestamp, side, price)' in query
+    assert query.endswith(
+        f'ENGINE=InnoDB PARTITION BY RANGE (timestamp) (PARTITION p20200510 VALUES LESS THAN '
+        f'({day_start(date(2020, 5, 11))}), PARTITION pmax VALUES LESS THAN MAXVALUE)')
+
+
+def test_price_type():
+    assert price_type('spot_btc', SCHEMA['price_types']) == 'DECIMAL(16,8)'
+    assert price_type('future_btc_quarter', SCHEMA['price_types']) == 'DOUBLE'
+
+
+@pytest.mark.parametrize('price_types', [
+    [('spot_*', 'VARCHAR(20)')],
+    [('spot_*', 'DECIMAL(16)')],
+])
+def test_check_schema_invalid(price_types):
+    with pytest.raises(ValueError):
+        check_schema(dict(SCHEMA, price_types=price_types))
+
+
+def test_create_tables(mock_engine):
+    """Test only the missing tables are created and only level two tables are partitioned."""
+    mock_engine.execute.return_value.fetchall.return_value = [('spot_btc', 1)]
+    tables = {'locrian_level_two': [('spot_btc', 'book'), ('spot_eth', 'book')],
+              'locrian_future_index': [('future_index_btc_usd', 'index')]}
+
+    created = create_tables(tables, SCHEMA, today=TODAY, days_ahead=1)
+
+    assert created == [('locrian_level_two', 'spot_eth'),
+                       ('locrian_future_index', 'future_index_btc_usd')]
+    queries = [query for query in executed(mock_engine) if query.startswith('CREATE')]
+    assert queries[0].startswith('CREATE TABLE IF NOT EXISTS spot_eth ')
+    assert 'PARTITION p20200511 ' in queries[0]
+    assert 'PARTITION BY' not in queries[1]
+
+
+def test_migrate_tables(mocker, mock_engine):
+    """Test tables without a primary key are copied in key ranges, caught up and swapped."""
+    mocker.patch('locrian_collect.schema.MIGRATION_CHUNKS', 2)
+    results = {'information_schema': [('trades_spot_btc', 0), ('trades_spot_eth', 1)],
+               'MIN(tid), MAX(tid)': [(100, 199)], 'MAX(tid) FROM trades_spot_btc__new': [(199,)]}
+
+    def execute(query):
+        result = mocker.MagicMock(rowcount=10)
+        result.fetchall.return_value = next(
+            (rows for key, rows in results.items() if key in str(query)), [])
+        return result
+    mock_engine.execute.side_effect = execute
+
+    tables = {'locrian_trades': [('trades_spot_btc', 'trades'), ('trades_spot_eth', 'trades')]}
+    assert migrate_tables(tables, SCHEMA, TODAY) == [('locrian_trades', 'trades_spot_btc', 30)]
+
+    queries = executed(mock_engine)
+    assert queries[2].startswith('CREATE TABLE IF NOT EXISTS trades_spot_btc__new ')
+    copies = [query.split('WHERE ')[1] for query in queries if query.startswith('INSERT')]
+    assert copies == ['tid >= 100 AND tid < 150', 'tid >= 150 AND tid < 200', 'tid >= 199']
+    assert queries[-1] == ('RENAME TABLE trades_spot_btc TO trades_spot_btc__old, '
+                           'trades_spot_btc__new TO trades_spot_btc')
+
+
+def test_partition_days():
+    """Test only the last history days get a daily partition, older rows share phistory."""
+    days, history = partition_days(day_start(date(2020, 5, 8)), TODAY, days_ahead=1,
+                                   history_days=30)
+    assert (days[0], days[-1], history) == (date(2020, 5, 8), date(2020, 5, 11), False)
+
+    days, history = partition_days(day_start(date(2015, 1, 1)), TODAY, days_ahead=1,
+                                   history_days=30)
+    assert (days[0], len(days), history) == (TODAY - timedelta(days=30), 32, True)
+
+    assert partition_days(None, TODAY, days_ahead=1) == ([TODAY, date(2020, 5, 11)], False)
+
+
+def test_migrate_table_partitions_history(mocker, mock_engine):
+    """Test migrating years of books stays far below MySQL's partition limit."""
+    mock_engine.execute.return_value.fetchall.return_value = [
+        (day_start(date(2015, 1, 1)), day_start(TODAY))]
+    migrate_table('spot_btc', 'book', 'locrian_level_two', SCHEMA, TODAY, days_ahead=1)
+
+    create = next(query for query in executed(mock_engine) if query.startswith('CREATE'))
+    # A year of days, today, tomorrow, phistory and pmax.
+    assert create.count('PARTITION p') == 365 + 2 + 2
+    assert (f'PARTITION phistory VALUES LESS THAN ({day_start(date(2019, 5, 11))}), '
+            f'PARTITION p20190511 ') in create
@@ -0,0 +1,97 @@
+"""
+Test the shared HTTP sessions.
+"""
+import orjson
+import pytest
+import requests
+
+from locrian_collect import sessions
+from locrian_collect.rate_limit import RateLimited
+from locrian_collect.sessions import get_session, get_json, close_sessions
+
+
+@pytest.fixture(autouse=True)
+def empty_sessions(monkeypatch):
+    monkeypatch.setattr('locrian_collect.sessions._SESSIONS', {})
+
+
+@pytest.fixture
+def mock_session_get(mocker):
+    """Patch the session's get and skip backoff sleeps."""
+    mocker.patch('locrian_collect.sessions.time.sleep')
+    yield mocker.patch.object(requests.Session, 'get')
+
+
+def response(mocker, status_code=200, json=None):
+    return mocker.MagicMock(status_code=status_code, content=orjson.dumps(json))
+
+
+def test_get_session_per_host():
+    """Test sessions are shared per host and negotiate gzip."""
+    session = get_session('https://www.okex.com/api/futures/v3/instruments')
+
+    assert get_session('https://www.okex.com/api/futures/v3/other') is session
+    assert get_session('https://www.okcoin.com/api/spot/v3/instruments') is not session
+    assert 'gzip' in session.headers['Accept-Encoding']
+    assert session.get_adapter('https://www.okex.com')._pool_maxsize == sessions.HTTP_POOL_SIZE
+
+
+def test_close_sessions():
+    session = get_session('https://www.okex.com')
+    close_sessions()
+    assert get_session('https://www.okex.com') is not session
+
+
+def test_get_json_retries(mocker, mock_session_get):
+    """Test timeouts and server errors are retried."""
+    mock_session_get.side_effect = [requests.Timeout, response(mocker, 503),
+                                    response(mocker, json={'a': 1})]
+    assert get_json('https://www.okex.com', retries=2) == {'a': 1}
+    assert mock_session_get.call_count == 3
+
+
+def test_get_json_retries_exhausted(mock_session_get):
+    """Test the last error is raised when the retries are used up."""
+    mock_session_get.side_effect = requests.ConnectionError
+    with pytest.raises(requests.ConnectionError):
+        get_json('https://www.okex.com', retries=1)
+    assert mock_session_get.call_count == 2
+
+
+def test_get_json_deadline(mocker, mock_session_get):
+    """Test no retry starts after the deadline and the timeout is capped by it."""
+    mocker.patch('locrian_collect.sessions.time.time', return_value=100)
+    mock_session_get.side_effect = requests.Timeout
+    with pytest.raises(requests.Timeout):
+        get_json('https://www.okex.com', timeout=8, deadline=100.0001, retries=5)
+    assert mock_session_get.call_count == 1
+    assert mock_session_get.call_args[1]['timeout'] == 0.001
+
+
+def test_get_json_client_error_not_retried(mocker, mock_session_get):
+    """Test client errors are returned without retrying."""
+    mock_session_get.return_value = response(mocker, 400, json={'code': 30001})
+    assert get_json('https://www.okex.com') == {'code': 30001}
+    assert mock_session_get.call_count == 1
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_loads(use_orjson, monkeypatch):
+    """Test json is decoded with and without orjson and invalid json raises ValueError."""
+    if not use_orjson:
+        monkeypatch.setattr('locrian_collect.sessions.orjson', None)
+    assert sessions.loads(b'{"asks": [["1.5", "2"]]}') == {'asks': [['1.5', '2']]}
+    with pytest.raises(ValueError):
+        sessions.loads(b'not json')
+
+
+def test_get_json_rate_limited(mocker, mock_session_get):
+    """Test a rate limited request is raised with its Retry-After time and not retried."""
+    limited = response(mocker, 429)
+    limited.headers = {'Retry-After': '3'}
+    mock_session_get.return_value = limited
+
+    with pytest.raises(RateLimited) as exc_info:
+        get_json('https://www.okex.com', retries=2)
+    assert exc_info.value.retry_after == 3
+    assert mock_session_get.call_count == 1
@@ -0,0 +1,153 @@
+"""
+Test the sharding of managers across processes and the supervisor.
+"""
+from collections import Counter
+import logging
+import os
+import signal
+import time
+
+import pytest
+
+from locrian_collect.data_managers import BaseManager
+from locrian_collect.metrics import METRICS
+from locrian_collect.sharding import (
+    Supervisor, exit_on_terminate, health_summary, partition_managers, shard_for
+)
+
+TABLES = [f'table_{i}' for i in range(1000)]
+
+
+@pytest.fixture(autouse=True)
+def patch_loggers(mocker):
+    mocker.patch('locrian_collect.sharding.logger_collector', logging.getLogger())
+
+
+def test_shard_for_is_stable_and_balanced():
+    shards = [shard_for(table, 4) for table in TABLES]
+
+    assert shards == [shard_for(table, 4) for table in TABLES]
+    assert all(200 < count < 300 for count in Counter(shards).values())
+
+
+def test_shard_for_adding_a_shard_moves_few_tables():
+    """Test adding a fifth shard only moves tables to the new shard."""
+    moved = [(shard_for(table, 4), shard_for(table, 5)) for table in TABLES
+             if shard_for(table, 4) != shard_for(table, 5)]
+
+    assert all(new == 4 for _, new in moved)
+    assert len(moved) < 300
+
+
+def test_partition_managers():
+    managers = [BaseManager(table, 'url', 'db') for table in TABLES[:20]]
+    shards = partition_managers(managers, 3)
+
+    assert sorted(manager.mysql_table for shard in shards for manager in shard) == sorted(
+        TABLES[:20])
+    assert all(shard_for(manager.mysql_table, 3) == i
+               for i, shard in enumerate(shards) for manager in shard)
+
+
+def test_health_summary():
+    managers = [BaseManager('a', 'url', 'db'), BaseManager('b', 'url', 'db')]
+    METRICS.increment('a', 'requests', 3)
+    METRICS.increment('b', 'requests', 2)
+    METRICS.increment('b', 'errors_timeout')
+    METRICS.increment('b', 'rows_written', 10)
+    METRICS.increment('c', 'requests', 100)
+
+    assert health_summary(managers) == {'managers': 2, 'requests': 5, 'errors': 1,
+                                        'rows_written': 10}
+
+
+def beat_and_exit(shard, num_shards, health_queue):
+    """Worker that sends one heartbeat and exits."""
+    import os  # pylint: disable=import-outside-toplevel
+    health_queue.put({'shard': shard, 'pid': os.getpid(), 'time': time.time(), 'managers': 1,
+                      'requests': 1, 'errors': 0, 'rows_written': 1})
+
+
+def test_supervisor_restarts_dead_workers():
+    """Test workers that exit are restarted and their heartbeats aggregated."""
+    supervisor = Supervisor(2, target=beat_and_exit, restart_backoff=0).start()
+    try:
+        for process in supervisor.processes.values():
+            process.join(30)
+        first_pids = {shard: process.pid for shard, process in supervisor.processes.items()}
+
+        assert sorted(supervisor.check()) == [0, 1]
+        assert all(supervisor.processes[shard].pid != pid for shard, pid in first_pids.items())
+
+        for process in supervisor.processes.values():
+            process.join(30)
+        time.sleep(0.1)
+        supervisor._read_heartbeats()
+        health = supervisor.health()
+        assert health['totals']['restarts'] == 2
+        assert health['totals']['requests'] == 2
+        assert health['totals']['alive'] == 0
+    finally:
+        supervisor.close()
+
+
+def beat_and_sleep(path, progress_age, shard, num_shards, health_queue):
+    """Worker that beats with its progress `progress_age` seconds old and sleeps, writing
+    `path` once it exits cleanly.  A negative `progress_age` ignores SIGTERM."""
+    if progress_age < 0:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    else:
+        exit_on_terminate()
+    health_queue.put({'shard': shard, 'pid': os.getpid(), 'time': time.time(),
+                      'progress': time.time() - abs(progress_age)})
+    try:
+        time.sleep(60)
+    finally:
+        with open(path, 'w') as f:
+            f.write('flushed')
+
+
+def _wait_for_heartbeat(supervisor, shard=0):
+    for _ in range(300):
+        supervisor._read_heartbeats()
+        if supervisor.status[shard]['heartbeat'] is not None:
+            return
+        time.sleep(0.1)
+    raise AssertionError('no heartbeat')
+
+
+def test_supervisor_close_lets_workers_flush(tmp_path):
+    """Test closing stops the workers with SIGTERM, which runs their cleanup."""
+    path = f'{tmp_path}/flushed'
+    supervisor = Supervisor(1, target=beat_and_sleep, args=(path, 0)).start()
+    _wait_for_heartbeat(supervisor)
+    supervisor.close()
+
+    assert supervisor.processes[0].exitcode == 0
+    with open(path) as f:
+        assert f.read() == 'flushed'
+
+
+def test_supervisor_close_kills_stuck_workers(tmp_path):
+    """Test workers still running after the stop timeout are killed."""
+    supervisor = Supervisor(1, target=beat_and_sleep, args=(f'{tmp_path}/flushed', -1),
+                            stop_timeout=0.5).start()
+    _wait_for_heartbeat(supervisor)
+    supervisor.close()
+
+    assert supervisor.processes[0].exitcode == -signal.SIGKILL
+    assert not os.path.exists(f'{tmp_path}/flushed')
+
+
+def test_supervisor_restarts_workers_without_progress(tmp_path):
+    """Test a live worker whose heartbeats show no recent progress is restarted."""
+    supervisor = Supervisor(1, target=beat_and_sleep, args=(f'{tmp_path}/flushed', 100),
+                            heartbeat_timeout=10, restart_backoff=0).start()
+    try:
+        first_pid = supervisor.processes[0].pid
+        _wait_for_heartbeat(supervisor)
+
+        assert supervisor.check() == [0]
+        assert supervisor.processes[0].pid != first_pid
+    finally:
+        supervisor.close()
@@ -0,0 +1,204 @@
+"""
+Test the write-ahead spool.
+"""
+import logging
+import os
+from threading import Event
+
+import pytest
+
+from locrian_collect.data_managers import OrderBookManager
+from locrian_collect.metrics import METRICS
+from locrian_collect.spool import UNREADABLE, WriteAheadSpool, read_dead_letters
+
+
+@pytest.fixture(autouse=True)
+def patch_loggers(mocker):
+    mocker.patch('locrian_collect.spool.logger_storage', logging.getLogger())
+
+
+class Recorder:
+    """Write function recording its batches, failing the first `failures` calls with `error`."""
+    def __init__(self, failures=0, error=ConnectionError('database down')):
+        self.failures = failures
+        self.error = error
+        self.batches = []
+        self.written = Event()
+
+    def __call__(self, records, check_existing=False):
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        self.batches.append((records, check_existing))
+        self.written.set()
+        return len(records)
+
+
+def make_spool(directory, **kwargs):
+    return WriteAheadSpool(str(directory), fsync=False, poll_interval=0.01,
+                           retry_interval=0.01, **kwargs)
+
+
+def test_replay_in_batches(tmp_path):
+    """Test records are replayed per key in order and written segments are deleted."""
+    spool = make_spool(tmp_path, segment_bytes=100, batch_size=3)
+    books, trades = Recorder(), Recorder()
+    spool.register(('db', 'books'), books)
+    spool.register(('db', 'trades'), trades)
+    for record in range(4):
+        assert spool.append(('db', 'books'), record)
+    spool.append(('db', 'trades'), 'trade')
+
+    assert spool.replay() == 3
+    assert spool.replay() == 2
+    assert spool.replay() == 0
+    assert books.batches == [([0, 1, 2], False), ([3], False)]
+    assert trades.batches == [(['trade'], False)]
+    assert METRICS.snapshot()['spool']['counters'] == {'records_spooled': 5,
+                                                       'records_replayed': 5}
+
+    spool.close()
+    assert len(os.listdir(tmp_path)) <= 2  # the checkpoint and at most the last segment
+
+
+def test_failed_replay_is_retried(tmp_path):
+    """Test records stay spooled while the database is down and are written, skipping rows
+    already saved, once it recovers."""
+    spool = make_spool(tmp_path)
+    write = Recorder(failures=2)
+    spool.register('key', write)
+    spool.append('key', 1)
+    spool.start()
+
+    assert write.written.wait(timeout=5)
+    spool.close()
+    assert write.batches == [([1], True)]
+    assert METRICS.snapshot()['spool']['counters']['errors_replay'] == 2
+
+
+def test_restart_replays_unwritten_records(tmp_path):
+    """Test a new spool replays the records a crashed process left behind."""
+    crashed = make_spool(tmp_path)
+    for record in range(3):
+        crashed.append('key', record)
+    crashed._file.close()  # The process died without replaying.
+
+    spool = make_spool(tmp_path)
+    write = Recorder()
+    spool.register('key', write)
+    spool.start()
+    assert write.written.wait(timeout=5)
+    spool.close()
+
+    assert write.batches == [([0, 1, 2], True)]
+    assert not os.path.exists(crashed._path(0))
+    spool.append('key', 3)
+    assert os.path.exists(spool._path(1))
+
+
+def test_torn_record_is_skipped(tmp_path):
+    """Test a record torn by a crash is skipped and the records before it are replayed."""
+    crashed = make_spool(tmp_path)
+    for record in ('a', 'b'):
+        crashed.append('key', record)
+    crashed._file.close()
+    path = crashed._path(0)
+    os.truncate(path, os.path.getsize(path) - 3)
+
+    spool = make_spool(tmp_path)
+    write = Recorder()
+    spool.register('key', write)
+    assert spool.replay() == 1
+    assert write.batches == [(['a'], False)]
+    assert not os.path.exists(path)
+    assert spool.size == 0
+
+
+def test_poisoned_batch_is_dead_lettered(tmp_path):
+    """Test a key whose writes keep failing does not hold back the other keys and is moved to
+    the dead letters after max_attempts, while connection errors are retried indefinitely."""
+    spool = make_spool(tmp_path, max_attempts=3)
+    books, poisoned, down = Recorder(), Recorder(10, ValueError('bad row')), Recorder(10)
+    spool.register('books', books)
+    spool.register('index', poisoned)
+    spool.register('trades', down)
+    for key in ('books', 'index', 'trades'):
+        spool.append(key, f'{key} 1')
+
+    for _ in range(3):
+        with pytest.raises((ValueError, ConnectionError)):
+            spool.replay()
+    # The books are written once, the next record of the key goes in the retried batch.
+    spool.append('books', 'books 2')
+    with pytest.raises(ConnectionError):
+        spool.replay()
+    assert books.batches == [(['books 1'], False), (['books 2'], False)]
+    assert read_dead_letters(str(tmp_path)) == [('index', 'index 1')]
+    assert METRICS.snapshot()['spool']['counters']['errors_poisoned'] == 1
+
+    down.failures = 0
+    assert spool.replay() == 4
+    assert down.batches == [(['trades 1'], False)]
+    assert poisoned.batches == []
+
+
+def test_unreadable_record_is_dead_lettered(tmp_path):
+    """Test a record that cannot be unpickled is moved to the dead letters."""
+    spool = make_spool(tmp_path)
+    write = Recorder()
+    spool.register('key', write)
+    spool.append('key', Unpicklable())
+    spool.append('key', 'b')
+
+    assert spool.replay() == 2
+    assert write.batches == [(['b'], False)]
+    [(key, payload)] = read_dead_letters(str(tmp_path))
+    assert key == UNREADABLE and isinstance(payload, bytes)
+
+
+class Unpicklable:
+    """Pickles to a record failing to load, like the record of a class since changed."""
+    def __reduce__(self):
+        return _fail, ()
+
+
+def _fail():
+    raise TypeError('record of an old release')
+
+
+def test_full_spool_drops_and_alerts(tmp_path, caplog):
+    spool = make_spool(tmp_path, max_bytes=200, warn_fraction=0.5)
+    results = [spool.append('key', 'x' * 40) for _ in range(3)]
+
+    assert results == [True, True, False]
+    messages = [record[2] for record in caplog.record_tuples]
+    assert any('% full' in message for message in messages)
+    assert any('is full' in message for message in messages)
+    assert METRICS.snapshot()['spool']['counters']['errors_full'] == 1
+
+    # Once drained the segment is deleted even though it is still being appended to.
+    spool.register('key', Recorder())
+    assert spool.replay() == 2
+    assert spool.size == 0
+    assert spool.append('key', 'x')
+
+
+def test_manager_writes_through_spool(mocker, tmp_path, mock_book):
+    """Test a manager's books reach the database through the spool, skipping timestamps
+    already saved when asked to."""
+    mock_engine = mocker.MagicMock()
+    mock_engine.execute.return_value.fetchall.return_value = [(1,)]
+    mocker.patch('locrian_collect.data_managers.get_engine', return_value=mock_engine)
+    mock_insert = mocker.patch('locrian_collect.data_managers.insert_frame', return_value=20)
+    spool = make_spool(tmp_path)
+    manager = OrderBookManager('spot_btc', 'spot_btc_usd_orderbook', 'url').attach_spool(spool)
+
+    manager.add_book_to_db(1, mock_book)
+    manager.add_book_to_db(2, mock_book)
+    assert not mock_insert.called
+
+    assert spool.replay(check_existing=True) == 2
+    frame = mock_insert.call_args[0][2]
+    assert mock_insert.call_args[0][1] == 'spot_btc'
+    assert set(frame['timestamp']) == {2}
+    assert METRICS.snapshot()['spot_btc_usd_orderbook']['counters']['rows_written'] == 20
@@ -0,0 +1,222 @@
+"""
+Test the streaming order book against a local websocket server replaying recorded messages.
+"""
+import asyncio
+import json
+import logging
+import os
+import zlib
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import pytest
+
+from locrian_collect.constants import Side
+from locrian_collect.metrics import METRICS
+from locrian_collect.parse_level_two_book import parse_level_two_book
+from locrian_collect.streaming import BookStream, LocalBook, StreamingBookManager
+from locrian_collect.validation import validate_level_two_book
+
+MESSAGES_PATH = os.path.join(os.path.dirname(__file__), 'data', 'okex_depth_messages.jsonl')
+
+
+@pytest.fixture
+def messages():
+    with open(MESSAGES_PATH) as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture(autouse=True)
+def patch_loggers(mocker):
+    mocker.patch('locrian_collect.streaming.logger_order_book', logging.getLogger())
+
+
+def make_manager(instrument_id='BTC-USD-200626', channel='futures/depth'):
+    return StreamingBookManager(asset_name='future_btc_quarter',
+                                mysql_table='future_btc_usd_quarter_orderbook',
+                                url='https://www.okex.com/book', ws_url='ws://localhost',
+                                channel=channel, instrument_id=instrument_id, depth=5)
+
+
+def test_local_book():
+    """Test levels are kept sorted, replaced and removed."""
+    book = LocalBook()
+    book.apply_snapshot([['101', '1'], ['102', '2']], [['99', '3'], ['100', '4']])
+    book.apply_update([['101', '0'], ['103', '5'], ['104', '0']], [['100', '6'], ['98', '7']])
+
+    assert book.best(Side.asks) == [('102', '2'), ('103', '5')]
+    assert book.best(Side.bids, 2) == [('100', '6'), ('99', '3')]
+    assert len(book) == 5
+
+
+def test_local_book_to_book():
+    """Test the sampled book has the REST api's order and passes validation."""
+    book = LocalBook()
+    book.apply_snapshot([['101', '1'], ['102', '2'], ['103', '3']], [['100', '4'], ['99', '5']])
+
+    sample = book.to_book(depth=2)
+    assert sample == {'asks': [[102.0, 2.0], [101.0, 1.0]], 'bids': [[100.0, 4.0], [99.0, 5.0]]}
+    assert validate_level_two_book(sample) is None
+    assert parse_level_two_book(1, sample)['price'].tolist() == [101.0, 102.0, 100.0, 99.0]
+
+
+def test_checksum():
+    """Test the checksum interleaves bids and asks, continuing with the longer side."""
+    book = LocalBook()
+    book.apply_snapshot([['3366.8', '9']], [['3366.1', '7'], ['3366.0', '6']])
+
+    crc = zlib.crc32(b'3366.1:7:3366.8:9:3366.0:6')
+    assert book.checksum() == (crc - 2 ** 32 if crc >= 2 ** 31 else crc)
+
+
+def test_recorded_messages_stay_in_sync(mocker, messages):
+    """Test the recorded partial and updates match the exchange's checksums."""
+    manager = make_manager()
+    manager.stream = mocker.MagicMock()
+    for message in messages:
+        if message['table'] == 'futures/depth':
+            manager.handle_message(message['action'], message['data'][0])
+
+    assert not manager.stream.resync.called
+    assert manager.book.synced
+    assert manager.book.best(Side.asks, 2) == [('9550.75', '0.3'), ('9551.00', '2.0')]
+
+
+def test_checksum_mismatch_resyncs(mocker, messages):
+    """Test a missed update is detected by the checksum, the book dropped and resubscribed, and
+    updates dropped until the next partial."""
+    manager = make_manager()
+    manager.stream = mocker.MagicMock()
+    futures = [message for message in messages if message['table'] == 'futures/depth']
+    manager.handle_message('partial', futures[0]['data'][0])
+    manager.handle_message('update', futures[2]['data'][0])  # futures[1] is missed
+
+    manager.stream.resync.assert_called_once_with(manager)
+    assert not manager.book.synced
+    assert METRICS.snapshot()[manager.mysql_table]['counters'] == {'errors_stream_gap': 1}
+
+    # Updates still in flight are dropped without resubscribing again.
+    for message in futures[3:]:
+        manager.handle_message('update', message['data'][0])
+    assert manager.stream.resync.call_count == 1
+    assert len(manager.book) == 0
+
+    manager.handle_message('partial', futures[0]['data'][0])
+    assert manager.book.synced
+
+
+def test_update_before_partial_resyncs(mocker):
+    """Test an update is dropped while the partial is expected and resyncs afterwards."""
+    manager = make_manager()
+    manager.stream = mocker.MagicMock()
+    manager.handle_message('update', {'asks': [['100', '1']], 'bids': []})
+    assert not manager.stream.resync.called
+
+    manager.handle_message('partial', {'asks': [['101', '1']], 'bids': [['99', '1']]})
+    manager.book.clear()
+    manager.handle_message('update', {'asks': [['100', '1']], 'bids': []})
+    manager.stream.resync.assert_called_once_with(manager)
+    assert not manager.book.synced
+
+
+def test_book_stream_resync_resubscribes(mocker):
+    """Test a resync sends an unsubscribe and a subscribe from the stream's loop."""
+    manager = make_manager()
+    stream = BookStream('ws://localhost', [manager])
+    websocket = mocker.MagicMock(closed=False)
+    websocket.send_json = mocker.AsyncMock()
+
+    async def resync():
+        stream._loop = asyncio.get_running_loop()
+        stream._websocket = websocket
+        stream.resync(manager)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(resync())
+    assert websocket.send_json.await_args_list == [
+        mocker.call({'op': 'unsubscribe', 'args': ['futures/depth:BTC-USD-200626']}),
+        mocker.call({'op': 'subscribe', 'args': ['futures/depth:BTC-USD-200626']})]
+    assert stream.managers == {'futures/depth:BTC-USD-200626': manager}
+
+
+def test_get_data_samples_book(mocker):
+    """Test get_data saves the sampled book and skips a stale book."""
+    add_book = mocker.patch.object(StreamingBookManager, 'add_book_to_db')
+    manager = make_manager()
+
+    manager.get_data()
+    assert not add_book.called
+
+    manager.handle_message('partial', {'asks': [['101', '1']], 'bids': [['99', '2']]})
+    manager.get_data()
+    assert add_book.call_args[0][1] == {'asks': [[101.0, 1.0]], 'bids': [[99.0, 2.0]]}
+
+    manager.book.updated_at -= 3600
+    manager.get_data()
+    assert add_book.call_count == 1
+
+
+def test_roll_contract_resubscribes(mocker):
+    manager = make_manager().track_instrument(
+        'quarter', 'https://www.okex.com/BTC-USD-{delivery}/book', 'BTC-USD-{delivery}')
+    manager.stream = mocker.MagicMock()
+    manager.handle_message('partial', {'asks': [['101', '1']], 'bids': [['99', '2']]})
+
+    assert manager.roll_contract({'quarter': '200925'})
+    assert manager.subscription == 'futures/depth:BTC-USD-200925'
+    assert not manager.book.synced
+    manager.stream.resubscribe.assert_called_once_with('futures/depth:BTC-USD-200626', manager)
+
+
+async def _replay(messages, managers):
+    """Serve the recorded messages, deflate compressed like the exchange, to a BookStream."""
+    subscriptions = []
+
+    async def depth(request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        subscriptions.append(json.loads((await websocket.receive()).data))
+        for message in messages:
+            compress = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            await websocket.send_bytes(compress.compress(json.dumps(message).encode())
+                                       + compress.flush())
+        async for _ in websocket:
+            pass
+        return websocket
+
+    app = web.Application()
+    app.add_routes([web.get('/ws/v3', depth)])
+    server = TestServer(app)
+    await server.start_server()
+    stream = BookStream(str(server.make_url('/ws/v3')), managers)
+    task = asyncio.ensure_future(stream.run())
+    try:
+        for _ in range(200):
+            if stream.messages == len(messages):
+                break
+            await asyncio.sleep(0.01)
+        books = [manager.book.to_book(1) if manager.book.synced else None
+                 for manager in managers]
+    finally:
+        stream._stop.set()
+        await asyncio.wait_for(task, 5)
+        await server.close()
+    return stream, subscriptions, books
+
+
+def test_book_stream_replay(mocker, messages):
+    """Test a stream subscribes to every manager and keeps their books in sync."""
+    mock_resync = mocker.patch.object(BookStream, 'resync')
+    futures = make_manager()
+    spot = make_manager(instrument_id='BTC-USD', channel='spot/depth')
+
+    stream, subscriptions, books = asyncio.run(_replay(messages, [futures, spot]))
+
+    assert stream.messages == len(messages)
+    assert subscriptions == [{'op': 'subscribe',
+                              'args': ['futures/depth:BTC-USD-200626', 'spot/depth:BTC-USD']}]
+    assert not mock_resync.called
+    assert books == [{'asks': [[9550.75, 0.3]], 'bids': [[9549.75, 1.5]]},
+                     {'asks': [[9500.75, 0.3]], 'bids': [[9499.75, 1.5]]}]
+    # The books are dropped when the stream disconnects.
+    assert not futures.book.synced
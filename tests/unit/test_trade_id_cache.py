@@ -0,0 +1,64 @@
+"""
+Test the trade identifier cache.
+"""
+from locrian_collect.metrics import METRICS
+from locrian_collect.trade_id_cache import TradeIdCache
+
+
+def test_filter_new_cold():
+    """Test a cold cache only drops trade ids that have been added."""
+    cache = TradeIdCache()
+    cache.add([1, 2])
+
+    assert not cache.is_warm
+    assert cache.filter_new([1, 2, 3]) == [3]
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'size': 2, 'high_water_mark': None}
+
+
+def test_filter_new_high_water_mark():
+    """Test trade ids at or below the high water mark are seen."""
+    cache = TradeIdCache()
+    cache.warm(10)
+
+    assert cache.filter_new([9, 10, 11]) == [11]
+
+
+def test_add_raises_high_water_mark():
+    """Test saved trade ids raise the high water mark, so they are seen once evicted."""
+    cache = TradeIdCache(max_size=1)
+    cache.warm(10)
+    cache.add([12, 11])
+    cache.add([13])
+
+    assert cache.high_water_mark == 13
+    assert cache.filter_new([11, 12, 14]) == [14]
+
+
+def test_stats_published():
+    cache = TradeIdCache(name='trades_table')
+    cache.warm(10)
+    cache.filter_new([10, 11])
+    cache.add([11])
+
+    metrics = METRICS.snapshot()['trades_table']
+    assert metrics['counters'] == {'tid_cache_hits': 1, 'tid_cache_misses': 1}
+    assert metrics['gauges'] == {'tid_cache_size': 1}
+
+
+def test_warm_empty_table():
+    """Test warming from an empty table treats every trade id as new."""
+    cache = TradeIdCache()
+    cache.warm(None)
+
+    assert cache.is_warm
+    assert cache.filter_new([0, 1]) == [0, 1]
+
+
+def test_add_evicts_oldest():
+    """Test the cache is bounded and evicts the oldest trade ids."""
+    cache = TradeIdCache(max_size=3)
+    cache.add([1, 2, 3])
+    cache.add([2, 4])
+
+    assert len(cache) == 3
+    assert cache.filter_new([1, 2, 3, 4]) == [1]
@@ -0,0 +1,51 @@
+"""
+Test validation of the data returned by the exchange.
+"""
+
+import pytest
+
+from locrian_collect.validation import validate_level_two_book
+
+
+def test_valid_book(mock_book):
+    assert validate_level_two_book(mock_book) is None
+
+
+def test_valid_book_with_empty_list_elsewhere(mock_book):
+    """Test an empty list outside of the sides does not reject the book."""
+    assert validate_level_two_book(dict(mock_book, extra=[])) is None
+
+
+def test_valid_book_strings():
+    """Test levels returned as strings with extra fields."""
+    book = {'asks': [['2.5', '3', '0', '1'], ['2', '1', '0', '2']],
+            'bids': [['1.5', '4', '0', '1']]}
+    assert validate_level_two_book(book) is None
+
+
+def test_valid_book_ascending():
+    """Test levels in ascending order, as sent over the websocket, are accepted."""
+    book = {'asks': [['2', '1'], ['2.5', '3']], 'bids': [['1', '4'], ['1.5', '4']]}
+    assert validate_level_two_book(book) is None
+
+
+@pytest.mark.parametrize('book, expected', [
+    [None, 'book is a NoneType not a dict'],
+    [{'asks': [[2.0, 1.0]]}, 'bids missing or empty'],
+    [{'asks': [[2.0, 1.0]], 'bids': []}, 'bids missing or empty'],
+    [{'asks': [[2.0]], 'bids': [[1.0, 1.0]]}, 'asks level [2.0] is not [price, volume, ...]'],
+    [{'asks': [['a', 1.0]], 'bids': [[1.0, 1.0]]},
+     "asks level ['a', 1.0] is not [price, volume, ...]"],
+    [{'asks': [[2.0, -1.0]], 'bids': [[1.0, 1.0]]},
+     'asks level [2.0, -1.0] has a non positive price or negative volume'],
+    [{'asks': [[3.0, 1.0], [2.0, 1.0], [3.0, 2.0]], 'bids': [[1.0, 1.0]]},
+     'asks price 3.0 appears more than once'],
+    [{'asks': [[2.0, 1.0]], 'bids': [[1.0, 1.0], [1.0, 2.0]]},
+     'bids price 1.0 appears more than once'],
+    [{'asks': [[2.0, 1.0]], 'bids': [[2.0, 1.0]]},
+     'book is crossed, best bid 2.0 >= best ask 2.0'],
+    [{'asks': [[2.0, 1.0], [3.0, 1.0]], 'bids': [[1.0, 1.0], [2.5, 1.0]]},
+     'book is crossed, best bid 2.5 >= best ask 2.0'],
+])
+def test_invalid_book(book, expected):
+    assert validate_level_two_book(book) == expected
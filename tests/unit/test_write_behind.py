@@ -0,0 +1,82 @@
+"""
+Test the write-behind writer.
+"""
+import logging
+from threading import Event
+
+import pytest
+
+from locrian_collect.metrics import METRICS
+from locrian_collect.write_behind import WriteBehindWriter
+
+
+@pytest.fixture
+def patch_loggers(mocker):
+    mocker.patch('locrian_collect.write_behind.logger_storage', logging.getLogger())
+
+
+def test_flush_by_batch_size():
+    """Test records of a key are flushed together once the batch is full."""
+    batches = []
+    writer = WriteBehindWriter(batch_size=3, flush_interval=60).start()
+    for record in range(7):
+        writer.submit(('db', 'table'), record, batches.append)
+    writer.close()
+
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+    assert writer.stats()['flushed_records'] == 7
+    metrics = METRICS.snapshot()['write_behind']
+    assert metrics['counters'] == {'records_submitted': 7, 'records_flushed': 7}
+    assert metrics['gauges'] == {'queue_depth': 0}
+    assert metrics['stages']['flush']['count'] == 3
+
+
+def test_flush_by_interval():
+    """Test records are flushed after the flush interval without waiting for a full batch."""
+    flushed = Event()
+    writer = WriteBehindWriter(batch_size=100, flush_interval=0.01).start()
+    writer.submit('key', 1, lambda records: flushed.set())
+
+    assert flushed.wait(timeout=1)
+    writer.close()
+
+
+def test_flush_on_close_per_key():
+    """Test closing flushes every key with its own flush function."""
+    flushed = {}
+    writer = WriteBehindWriter(batch_size=100, flush_interval=60).start()
+    for key in ('a', 'b', 'a'):
+        writer.submit(key, key, lambda records, key=key: flushed.setdefault(key, records))
+    writer.close()
+
+    assert flushed == {'a': ['a', 'a'], 'b': ['b']}
+
+
+def test_backpressure_drops(patch_loggers, caplog):
+    """Test a full queue drops records once the put timeout passes."""
+    writer = WriteBehindWriter(max_queue_size=1, put_timeout=0.01)  # Not started.
+    assert writer.submit('key', 1, print)
+    assert not writer.submit('key', 2, print)
+    assert writer.stats()['dropped'] == 1
+    assert writer.queue_depth == 1
+    assert METRICS.snapshot()['write_behind']['gauges'] == {'queue_depth': 1}
+    assert METRICS.snapshot()['write_behind']['counters']['errors_dropped'] == 1
+    assert caplog.record_tuples[0][2] == 'Write-behind queue full, dropped a record for key'
+
+
+def test_flush_error(patch_loggers, caplog):
+    """Test a failed flush is counted and the writer keeps running."""
+    def fail(records):
+        raise RuntimeError('db down')
+
+    batches = []
+    writer = WriteBehindWriter(batch_size=1, flush_interval=60).start()
+    writer.submit('bad', 1, fail)
+    writer.submit('good', 2, batches.append)
+    writer.close()
+
+    assert batches == [[2]]
+    assert writer.stats()['flush_errors'] == 1
+    assert METRICS.snapshot()['write_behind']['counters']['errors_flush'] == 1
+    assert caplog.record_tuples[0][2] == ("Error flushing 1 records for bad: "
+                                          "RuntimeError('db down')")